@@ -1,4 +1,5 @@
 import streamlit as st
+from utils.embedding_service import warm_up_embeddings
 
 # Page configuration
 st.set_page_config(
@@ -8,6 +9,9 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Carica in background il modello di embedding condiviso (una sola volta per processo)
+warm_up_embeddings()
+
 # Initialize session state for theme
 if 'dark_mode' not in st.session_state:
     st.session_state.dark_mode = False
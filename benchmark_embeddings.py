@@ -0,0 +1,136 @@
+"""
+LUMIA Studio - Benchmark Backend di Embedding
+=============================================
+
+Confronta i backend di embedding disponibili (PyTorch, ONNX, ONNX int8) sui
+chunk di un contesto esistente: throughput di indicizzazione e concordanza
+del retrieval rispetto al backend di riferimento (PyTorch).
+
+Uso:
+    python benchmark_embeddings.py <nome_contesto> [--limit 500] [--queries 50] [--top-k 10]
+
+Metriche:
+    - chunk/s: chunk embeddati al secondo (cache disattivata)
+    - recall@k: frazione dei top-k chunk del backend di riferimento ritrovati
+      anche dal backend in esame, usando come query l'inizio di alcuni chunk
+    - cos(ref): similarità coseno media tra i vettori dei due backend
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from utils.document_processor import DocumentProcessor
+from utils.embedding_service import EmbeddingService, EMBEDDING_BACKENDS, DEFAULT_EMBEDDING_BACKEND
+
+
+def load_chunks(context_name: str, limit: int):
+    """Reads the chunks of an existing context"""
+    processor = DocumentProcessor(context_name=context_name)
+    if not os.path.exists(processor.persist_directory):
+        print(f"❌ Contesto '{context_name}' non trovato ({processor.persist_directory})")
+        sys.exit(1)
+
+    processor.initialize_db()
+    results = processor.collection.get(limit=limit, include=["documents"])
+    return [doc for doc in results.get("documents", []) if doc]
+
+
+def build_queries(chunks, count: int):
+    """Uses the opening sentence of evenly spaced chunks as queries"""
+    step = max(1, len(chunks) // count)
+    return [chunk[:200] for chunk in chunks[::step][:count]]
+
+
+def normalize(vectors):
+    array = np.asarray(vectors, dtype=np.float32)
+    return array / np.clip(np.linalg.norm(array, axis=1, keepdims=True), 1e-12, None)
+
+
+def top_k(query_vectors, doc_vectors, k: int):
+    scores = query_vectors @ doc_vectors.T
+    return [set(row) for row in np.argsort(-scores, axis=1)[:, :k]]
+
+
+def run_backend(backend: str, chunks, queries):
+    """Embeds chunks and queries with a backend, bypassing the embedding cache"""
+    encoder = EmbeddingService(backend=backend).create_encoder()
+
+    # Prima inferenza esclusa dalla misura (caricamento lazy del modello)
+    encoder.embed_query("warm-up")
+
+    start = time.perf_counter()
+    doc_vectors = encoder.embed_documents(chunks)
+    elapsed = time.perf_counter() - start
+
+    query_vectors = [encoder.embed_query(query) for query in queries]
+    return normalize(doc_vectors), normalize(query_vectors), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dei backend di embedding")
+    parser.add_argument("context", help="Nome normalizzato del contesto (es. corso_inglese)")
+    parser.add_argument("--limit", type=int, default=500, help="Numero massimo di chunk")
+    parser.add_argument("--queries", type=int, default=50, help="Numero di query di test")
+    parser.add_argument("--top-k", type=int, default=10, help="k per recall@k")
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS.keys()),
+                        help="Backend da confrontare")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("🚀 LUMIA Studio - Benchmark Backend di Embedding")
+    print("=" * 70)
+    print()
+
+    chunks = load_chunks(args.context, args.limit)
+    if not chunks:
+        print("❌ Nessun chunk nel contesto")
+        sys.exit(1)
+
+    queries = build_queries(chunks, args.queries)
+    k = min(args.top_k, len(chunks))
+    print(f"📚 Contesto: {args.context} | Chunk: {len(chunks)} | Query: {len(queries)} | k={k}")
+    print()
+
+    backends = [DEFAULT_EMBEDDING_BACKEND] + [b for b in args.backends if b != DEFAULT_EMBEDDING_BACKEND]
+    reference = None
+    rows = []
+
+    for backend in backends:
+        print(f"⏳ {EMBEDDING_BACKENDS[backend]['label']}...")
+        try:
+            doc_vectors, query_vectors, elapsed = run_backend(backend, chunks, queries)
+        except Exception as e:
+            print(f"   ❌ {backend}: {e}")
+            continue
+
+        if reference is None:
+            reference = (doc_vectors, top_k(query_vectors, doc_vectors, k))
+            recall, cosine = 1.0, 1.0
+        else:
+            ref_docs, ref_top = reference
+            backend_top = top_k(query_vectors, doc_vectors, k)
+            recall = float(np.mean([len(a & b) / k for a, b in zip(ref_top, backend_top)]))
+            cosine = float(np.mean(np.sum(ref_docs * doc_vectors, axis=1)))
+
+        rows.append((backend, len(chunks) / elapsed, recall, cosine))
+
+    print()
+    print(f"{'Backend':<12} {'chunk/s':>10} {'speedup':>9} {'recall@' + str(k):>10} {'cos(ref)':>9}")
+    print("-" * 54)
+    base_rate = rows[0][1] if rows and rows[0][0] == DEFAULT_EMBEDDING_BACKEND else None
+    for backend, rate, recall, cosine in rows:
+        speedup = f"{rate / base_rate:.2f}x" if base_rate else "-"
+        print(f"{backend:<12} {rate:>10.1f} {speedup:>9} {recall:>10.3f} {cosine:>9.4f}")
+    print()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n⚠️ Benchmark interrotto dall'utente")
+        sys.exit(1)
@@ -9,6 +9,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utils.session_manager import SessionManager
 from utils.context_manager import ContextManager
+from utils.atomic_json import RevisionConflictError, write_json_atomic
+from utils.chat_log import DEFAULT_PAGE_SIZE
 
 st.set_page_config(
     page_title="Compass - LumIA Studio",
@@ -67,23 +69,75 @@ if 'context_manager' not in st.session_state:
 
 # LLMManager non viene inizializzato qui - viene caricato lazy quando serve (New Session, ecc)
 
-# Cache per get_bdi_data() - evita multiple chiamhe al disco
-@st.cache_data
-def get_cached_bdi_data(session_id: str):
-    """Returns cached BDI data for a session, avoiding repeated disk reads.
+# Revisioni dei dati BDI mostrate dagli editor, per sessione: quella del rerun corrente e del precedente.
+# Il salvataggio avviene nel rerun del click, quindi va confrontato con i dati mostrati nel rerun precedente
+if 'bdi_editor_revisions' not in st.session_state:
+    st.session_state.bdi_editor_revisions = {}
+st.session_state.compass_run = st.session_state.get('compass_run', 0) + 1
+
+
+def get_cached_bdi_snapshot(session_id: str):
+    """Returns the current BDI data of a session and the revision the editors' edits are based on.
 
-    Wraps ``SessionManager.get_bdi_data`` with Streamlit's ``@cache_data``
-    so that multiple calls within the same page rerun share one disk read.
+    The data comes from the materialized event view of ``SessionManager``,
+    which re-reads only what was appended since the previous rerun. A save
+    runs in the rerun triggered by the click, so the edits were made on the
+    data shown in the previous Compass rerun: its revision is the one
+    returned, and passed back on save to detect changes made meanwhile
+    elsewhere. Changes made by other pages before Compass is shown again
+    are therefore never reported as conflicts.
 
     Args:
         session_id: Unique identifier of the target session.
 
     Returns:
-        dict: The full BDI payload (desires, beliefs, intentions, etc.)
-            as stored in ``current_bdi.json``, or ``None`` if the session
+        tuple: ``(bdi_data, revision)``, ``(None, None)`` if the session
             has no BDI data yet.
     """
-    return st.session_state.session_manager.get_bdi_data(session_id)
+    bdi_data, revision = st.session_state.session_manager.get_bdi_data_versioned(session_id)
+    pin = st.session_state.bdi_editor_revisions.get(session_id)
+    if pin is None:
+        pin = {"run": st.session_state.compass_run, "current": revision, "previous": revision}
+        st.session_state.bdi_editor_revisions[session_id] = pin
+    elif pin["run"] != st.session_state.compass_run:
+        pin.update(run=st.session_state.compass_run, previous=pin["current"], current=revision)
+    return bdi_data, pin["previous"]
+
+
+def get_cached_bdi_data(session_id: str):
+    """Returns the BDI data of a session without re-reading unchanged files.
+
+    Args:
+        session_id: Unique identifier of the target session.
+
+    Returns:
+        dict: The full BDI payload (desires, beliefs, intentions, etc.),
+            or ``None`` if the session has no BDI data yet.
+    """
+    return get_cached_bdi_snapshot(session_id)[0]
+
+
+def save_bdi_edit(session_id: str, **fields) -> bool:
+    """Saves BDI fields edited in Compass, refusing to overwrite concurrent changes.
+
+    The write is checked against the revision of the data shown when the
+    edits were made (see ``get_cached_bdi_snapshot``).
+
+    Args:
+        session_id: Unique identifier of the target session.
+        **fields: BDI fields to update (see ``SessionManager.update_bdi_data``).
+
+    Returns:
+        bool: ``True`` if saved, ``False`` on a revision conflict (an
+            ``st.error`` is displayed).
+    """
+    _, revision = get_cached_bdi_snapshot(session_id)
+    try:
+        st.session_state.session_manager.update_bdi_data(session_id, expected_revision=revision, **fields)
+        return True
+    except RevisionConflictError:
+        st.error("❌ The BDI data was modified in another tab or by an agent. The editor now shows the latest version: reapply your changes.")
+        return False
 
 # Inizializza editing mode
 if 'editing_session_id' not in st.session_state:
@@ -120,10 +174,10 @@ with st.sidebar:
     st.markdown("---")
 
     st.markdown("### 👩🏻‍💻 Recent Sessions")
-    recent_sessions = st.session_state.session_manager.get_all_sessions(status="active")
+    recent_sessions = st.session_state.session_manager.list_sessions(status="active", limit=5)
 
     if recent_sessions:
-        for session in recent_sessions[:5]:
+        for session in recent_sessions:
             metadata = session['metadata']
             config = session['config']
 
@@ -140,6 +194,7 @@ with st.sidebar:
                     if st.button("📂", key=f"load_{session['session_id']}", help="Load session", width='stretch'):
                         st.session_state.editing_session_id = session['session_id']
                         st.session_state.active_session = session['session_id']
+                        st.session_state.bdi_editor_revisions.pop(session['session_id'], None)
                         st.session_state.new_session_requested = False
                         st.success(f"Session '{metadata['name']}' loaded!")
                         st.rerun()
@@ -178,8 +233,7 @@ with st.sidebar:
                 if st.button("✅ Overwrite", key="confirm_overwrite_framework", width='stretch', type="primary"):
                     try:
                         # Save BDI to framework
-                        with open(framework_info['path'], 'w', encoding='utf-8') as f:
-                            json.dump(framework_info['bdi_data'], f, indent=2, ensure_ascii=False)
+                        write_json_atomic(framework_info['path'], framework_info['bdi_data'])
                         st.success(f"✅ Exported:\n`{framework_info['filename']}`")
                         st.info("💡 Use it in Genius!")
                         st.session_state.pending_framework_export = None
@@ -224,8 +278,7 @@ with st.sidebar:
                             st.rerun()
                         else:
                             # Save BDI to framework
-                            with open(framework_path, 'w', encoding='utf-8') as f:
-                                json.dump(bdi_data, f, indent=2, ensure_ascii=False)
+                            write_json_atomic(framework_path, bdi_data)
                             st.success(f"✅ Exported:\n`{framework_filename}`")
                             st.info("💡 Use it in Genius!")
 
@@ -341,7 +394,7 @@ else:
     st.info(f"📝 Session Name Selected: **{current_session['metadata']['name']}**")
 
     # Tabs principali
-    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["📋 Session Settings", "🗂️ Context & Beliefs", "💭 Desires", "🧠 Beliefs", "🎯 Intentions", "📊 Analytics", "🕸️ Grafo BDI"])
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs(["📋 Session Settings", "🗂️ Context & Beliefs", "💭 Desires", "🧠 Beliefs", "🎯 Intentions", "📊 Analytics", "🕸️ Grafo BDI", "⚡ LLM Usage", "💬 Conversations"])
 
     # ============================================================================
     # TAB 1: Session Info (nome, descrizione, LLM)
@@ -575,7 +628,8 @@ else:
                                 provider=selected_provider,
                                 model=selected_model,
                                 messages=[{"role": "user", "content": "Hello! Please respond with 'OK' if you can read this."}],
-                                system_prompt="You are a helpful assistant."
+                                system_prompt="You are a helpful assistant.",
+                                agent="compass"
                             )
                             st.success(f"✅ Connection successful! Response: {test_response[:100]}...")
                         except Exception as e:
@@ -926,15 +980,14 @@ else:
                                 st.error("JSON must contain a 'beneficiario' object (legacy: 'persona')")
                             elif not isinstance(parsed.get("desires"), list):
                                 st.error("JSON must contain a 'desires' array")
-                            else:
-                                st.session_state.session_manager.update_bdi_data(
-                                    st.session_state.editing_session_id,
-                                    beneficiario=beneficiario_payload or {},
-                                    desires=parsed.get("desires") or [],
-                                    domain_summary=parsed.get("domain_summary", "")
-                                )
+                            elif save_bdi_edit(
+                                st.session_state.editing_session_id,
+                                beneficiario=beneficiario_payload or {},
+                                desires=parsed.get("desires") or [],
+                                domain_summary=parsed.get("domain_summary", "")
+                            ):
                                 st.success("Beneficiario e desires salvati!")
-                            st.rerun()
+                                st.rerun()
                         except AttributeError:
                             st.error("SessionManager non aggiornato. Riavvia l'applicazione.")
                         except json.JSONDecodeError as e:
@@ -951,15 +1004,16 @@ else:
                         st.warning("Sure?")
                         if st.button("Yes", width='stretch', key="btn_confirm_clear_desires"):
                             try:
-                                st.session_state.session_manager.update_bdi_data(
+                                cleared = save_bdi_edit(
                                     st.session_state.editing_session_id,
                                     beneficiario={},
                                     desires=[],
                                     domain_summary=""
                                 )
                                 st.session_state.confirm_clear_desires = False
-                                st.success("Beneficiario e desires azzerati!")
-                                st.rerun()
+                                if cleared:
+                                    st.success("Beneficiario e desires azzerati!")
+                                    st.rerun()
                             except AttributeError:
                                 st.error("SessionManager non aggiornato. Riavvia l'applicazione.")
                         if st.button("No", width='stretch', key="btn_cancel_clear_desires"):
@@ -1063,12 +1117,12 @@ else:
                         try:
                             parsed = json.loads(edited_bdi_beliefs_json)
                             if 'beliefs' in parsed and isinstance(parsed['beliefs'], list):
-                                st.session_state.session_manager.update_bdi_data(
+                                if save_bdi_edit(
                                     st.session_state.editing_session_id,
                                     beliefs=parsed['beliefs']
-                                )
-                                st.success("✅ BDI Beliefs saved!")
-                                st.rerun()
+                                ):
+                                    st.success("✅ BDI Beliefs saved!")
+                                    st.rerun()
                             else:
                                 st.error("❌ JSON must contain a 'beliefs' array")
                         except AttributeError:
@@ -1090,13 +1144,14 @@ else:
                         st.warning("⚠️ Sure?")
                         if st.button("✅ Yes", width='stretch', key="btn_confirm_clear_bdi_beliefs"):
                             try:
-                                st.session_state.session_manager.update_bdi_data(
+                                cleared = save_bdi_edit(
                                     st.session_state.editing_session_id,
                                     beliefs=[]
                                 )
                                 st.session_state.confirm_clear_bdi_beliefs = False
-                                st.success("✅ Cleared!")
-                                st.rerun()
+                                if cleared:
+                                    st.success("✅ Cleared!")
+                                    st.rerun()
                             except AttributeError:
                                 st.error("❌ SessionManager non aggiornato. Riavvia l'applicazione.")
                         if st.button("❌ No", width='stretch', key="btn_cancel_clear_bdi_beliefs"):
@@ -1198,12 +1253,12 @@ else:
                         try:
                             parsed = json.loads(edited_intentions_json)
                             if 'intentions' in parsed and isinstance(parsed['intentions'], list):
-                                st.session_state.session_manager.update_bdi_data(
+                                if save_bdi_edit(
                                     st.session_state.editing_session_id,
                                     intentions=parsed['intentions']
-                                )
-                                st.success("✅ Intentions saved!")
-                                st.rerun()
+                                ):
+                                    st.success("✅ Intentions saved!")
+                                    st.rerun()
                             else:
                                 st.error("❌ JSON must contain an 'intentions' array")
                         except AttributeError:
@@ -1223,13 +1278,14 @@ else:
                         st.warning("⚠️ Sure?")
                         if st.button("✅ Yes", width='stretch', key="btn_confirm_clear_intentions"):
                             try:
-                                st.session_state.session_manager.update_bdi_data(
+                                cleared = save_bdi_edit(
                                     st.session_state.editing_session_id,
                                     intentions=[]
                                 )
                                 st.session_state.confirm_clear_intentions = False
-                                st.success("✅ Cleared!")
-                                st.rerun()
+                                if cleared:
+                                    st.success("✅ Cleared!")
+                                    st.rerun()
                             except AttributeError:
                                 st.error("❌ SessionManager non aggiornato. Riavvia l'applicazione.")
                         if st.button("❌ No", width='stretch', key="btn_cancel_clear_intentions"):
@@ -2382,6 +2438,172 @@ else:
                     st.error("❌ PyVis library not installed. Run: `pip install pyvis>=0.3.2`")
                 except Exception as e:
                     st.error(f"❌ Error creating PyVis graph: {str(e)}")
+
+    # ============================================================================
+    # TAB 8: LLM Usage (telemetria delle chiamate LLM)
+    # ============================================================================
+    with tab8:
+        st.markdown("### ⚡ LLM Usage")
+
+        from utils.llm_telemetry import load_records, summarize_by_agent
+
+        telemetry_records = load_records(st.session_state.editing_session_id)
+
+        if not telemetry_records:
+            st.info("No LLM calls recorded for this session yet. Chat with the agents to collect telemetry.")
+        else:
+            agents_summary = summarize_by_agent(telemetry_records)
+            total_cost = sum(item['cost_usd'] or 0 for item in agents_summary)
+            total_tokens = sum(item['prompt_tokens'] + item['completion_tokens'] for item in agents_summary)
+
+            col_calls, col_tokens, col_cost, col_errors = st.columns(4)
+            with col_calls:
+                st.metric("Calls", len(telemetry_records))
+            with col_tokens:
+                st.metric("Tokens", f"{total_tokens:,}")
+            with col_cost:
+                st.metric("Estimated Cost", f"${total_cost:.4f}")
+            with col_errors:
+                st.metric("Errors", sum(item['errors'] for item in agents_summary))
+
+            def format_ms(value):
+                return f"{value / 1000:.2f} s" if value is not None else "—"
+
+            st.markdown("#### Per Agent")
+            st.dataframe(
+                [
+                    {
+                        "Agent": item['agent'],
+                        "Calls": item['calls'],
+                        "p50 Latency": format_ms(item['p50_latency_ms']),
+                        "p95 Latency": format_ms(item['p95_latency_ms']),
+                        "p50 TTFT": format_ms(item['p50_ttft_ms']),
+                        "Prompt Tokens": item['prompt_tokens'],
+                        "Completion Tokens": item['completion_tokens'],
+                        "Cost (USD)": f"{item['cost_usd']:.4f}" if item['cost_usd'] is not None else "—",
+                        "Cache Hits": item['cache_hits'],
+                        "Retries": item['retries'],
+                        "Errors": item['errors']
+                    }
+                    for item in agents_summary
+                ],
+                width='stretch',
+                hide_index=True
+            )
+            st.caption("Costs are estimates based on the prices configured in `LLM_PRICING` (utils/llm_manager_config.py).")
+
+            # Lazy load Plotly (solo nel tab LLM Usage)
+            import plotly.graph_objects as go
+
+            fig_latency = go.Figure(data=[
+                go.Bar(
+                    name="p50",
+                    x=[item['agent'] for item in agents_summary],
+                    y=[(item['p50_latency_ms'] or 0) / 1000 for item in agents_summary],
+                    marker=dict(color='#5DADE2')
+                ),
+                go.Bar(
+                    name="p95",
+                    x=[item['agent'] for item in agents_summary],
+                    y=[(item['p95_latency_ms'] or 0) / 1000 for item in agents_summary],
+                    marker=dict(color='#F5B041')
+                )
+            ])
+            fig_latency.update_layout(
+                title="Latency per Agent",
+                barmode='group',
+                yaxis_title="Seconds",
+                height=350
+            )
+            st.plotly_chart(fig_latency, width='stretch')
+
+            with st.expander("🧾 Recent Calls", expanded=False):
+                st.dataframe(
+                    [
+                        {
+                            "Time": record.get('timestamp', '')[:19].replace('T', ' '),
+                            "Agent": record.get('agent'),
+                            "Model": record.get('model'),
+                            "Route": record.get('route'),
+                            "Requested": record.get('requested_model') or "",
+                            "Prompt": record.get('prompt_tokens'),
+                            "Completion": record.get('completion_tokens'),
+                            "TTFT (ms)": record.get('ttft_ms'),
+                            "Latency (ms)": record.get('latency_ms'),
+                            "Retries": record.get('retries'),
+                            "Cache": "✅" if record.get('cache_hit') else "",
+                            "Status": record.get('status')
+                        }
+                        for record in reversed(telemetry_records[-200:])
+                    ],
+                    width='stretch',
+                    hide_index=True
+                )
+
+        # Statistiche della cache dei metadati (sessioni, contesti, framework) di questo processo
+        from utils.metadata_cache import get_metadata_cache
+
+        with st.expander("🗄️ Metadata Cache", expanded=False):
+            cache_stats = get_metadata_cache().stats()
+            col_hits, col_misses, col_invalidations, col_entries = st.columns(4)
+            with col_hits:
+                st.metric("Hits", cache_stats['hits'])
+            with col_misses:
+                st.metric("Misses", cache_stats['misses'])
+            with col_invalidations:
+                st.metric("Invalidations", cache_stats['invalidations'])
+            with col_entries:
+                st.metric("Cached Files", cache_stats['entries'])
+            st.caption(f"Hit rate: {cache_stats['hit_rate']:.1%} — JSON metadata files are re-read only when their mtime or size changes.")
+
+    # ============================================================================
+    # TAB 9: Conversations (log delle chat degli agenti)
+    # ============================================================================
+    with tab9:
+        st.markdown("### 💬 Conversations")
+
+        log_session_id = st.session_state.editing_session_id
+        log_agents = st.session_state.session_manager.list_chat_agents(log_session_id)
+
+        if not log_agents:
+            st.info("No conversations recorded for this session yet. Chat with the agents to build the log.")
+        else:
+            col_agent, col_export = st.columns([3, 1])
+            with col_agent:
+                log_agent = st.selectbox(
+                    "Agent",
+                    log_agents,
+                    format_func=lambda name: name.capitalize(),
+                    key=f"chat_log_agent_{log_session_id}"
+                )
+            with col_export:
+                st.markdown("###")
+                if st.button("📤 Export Log", width='stretch', key="export_chat_log", help="Export the conversations of all the agents as JSONL"):
+                    try:
+                        export_path = st.session_state.session_manager.export_chat_log(log_session_id)
+                        st.success(f"✅ Exported:\n`{export_path}`")
+                    except Exception as e:
+                        st.error(f"❌ Export failed: {str(e)}")
+
+            # Caricamento lazy: si legge solo l'ultima pagina, le precedenti su richiesta
+            pages_key = f"chat_log_pages_{log_session_id}_{log_agent}"
+            loaded_pages = st.session_state.get(pages_key, 1)
+            total_messages = st.session_state.session_manager.count_chat_messages(log_session_id, log_agent)
+            log_messages = st.session_state.session_manager.get_chat_page(
+                log_session_id, log_agent, page_size=DEFAULT_PAGE_SIZE * loaded_pages
+            )
+
+            st.caption(f"Showing the last {len(log_messages)} of {total_messages} messages")
+            if len(log_messages) < total_messages:
+                if st.button("⬆️ Load earlier messages", key="load_earlier_chat_log"):
+                    st.session_state[pages_key] = loaded_pages + 1
+                    st.rerun()
+
+            for log_message in log_messages:
+                with st.chat_message(log_message.get("role", "assistant")):
+                    st.caption(log_message.get("ts", "")[:19].replace("T", " "))
+                    st.markdown(log_message.get("content", ""))
+
 # Footer
 st.markdown("---")
 st.markdown("""
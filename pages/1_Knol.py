@@ -9,6 +9,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utils.document_processor import DocumentProcessor
 from utils.context_manager import ContextManager
+from utils.embedding_service import EMBEDDING_BACKENDS
+from utils.belief_extractor import BeliefBaseExtractor
+from utils.atomic_json import RevisionConflictError, read_json_versioned, update_json, write_json_atomic
 
 st.set_page_config(
     page_title="Knol - LumIA Studio",
@@ -32,6 +35,10 @@ if 'current_context' not in st.session_state:
 
 # Inizializza il document processor solo se c'è un contesto selezionato
 if 'doc_processor' not in st.session_state or st.session_state.get('context_changed', False):
+    # Rilascia il riferimento al client ChromaDB del contesto precedente (resta in cache nel registry)
+    if st.session_state.get('doc_processor'):
+        st.session_state.doc_processor.release_connections()
+
     if st.session_state.current_context:
         st.session_state.doc_processor = DocumentProcessor(
             context_name=st.session_state.current_context
@@ -77,6 +84,41 @@ def load_belief_count():
     except:
         return 0
 
+# Funzione helper per l'ingestion batch dei file caricati
+def ingest_uploaded_files(files, source_prefix):
+    """Ingests a batch of uploaded files into the active context's knowledge base.
+
+    Delegates to ``DocumentProcessor.ingest_files`` (parallel extraction,
+    batched embedding, single ChromaDB commit), reports the per-file
+    outcome (new, removed and unchanged chunks when a source is
+    re-ingested) and updates the context metadata once at the end.
+
+    Args:
+        files: Files returned by ``st.file_uploader``.
+        source_prefix: Source type prefix (``"PDF"``, ``"TXT"``, ``"MD"``).
+    """
+    result = st.session_state.doc_processor.ingest_files(files, source_prefix=source_prefix)
+
+    for source, chunk_count in result['processed']:
+        changes = result['changes'].get(source, {})
+        if changes.get('unchanged') or changes.get('removed'):
+            st.success(
+                f"✅ {source} updated ({chunk_count} chunks: {changes.get('added', 0)} new, "
+                f"{changes.get('removed', 0)} removed, {changes.get('unchanged', 0)} unchanged)"
+            )
+        else:
+            st.success(f"✅ {source} processed successfully ({chunk_count} chunks)")
+    for file_name, error in result['errors']:
+        st.error(f"❌ Error processing {file_name}: {error}")
+
+    if result['processed']:
+        # Aggiorna il conteggio documenti nel metadata (una sola volta per batch)
+        stats = st.session_state.doc_processor.get_stats()
+        st.session_state.context_manager.update_context_metadata(
+            st.session_state.current_context,
+            {'document_count': stats['document_count']}
+        )
+
 # Funzione dialog per editor beliefs
 @st.dialog("📝 Beliefs Editor", width="large")
 def belief_editor_modal():
@@ -93,6 +135,10 @@ def belief_editor_modal():
       (requires a second click for confirmation).
     * **Close** – discards unsaved changes and closes the dialog.
 
+    Save and Clear All are checked against the revision of the belief base
+    loaded when the editor was opened: if it was changed meanwhile (another
+    tab, a new extraction) the write is refused instead of overwriting it.
+
     The function mutates ``st.session_state`` directly: it clears
     ``show_belief_editor`` on save / close and triggers ``st.rerun()``.
 
@@ -107,15 +153,19 @@ def belief_editor_modal():
     )
 
     beliefs = []
+    revision = None
     if os.path.exists(belief_base_path):
         try:
-            with open(belief_base_path, 'r', encoding='utf-8') as f:
-                belief_data = json.load(f)
-                beliefs = belief_data.get('beliefs_base', belief_data.get('beliefs', []))
+            belief_data, revision = read_json_versioned(belief_base_path)
+            beliefs = belief_data.get('beliefs_base', belief_data.get('beliefs', []))
         except Exception as e:
             st.error(f"Error loading beliefs: {str(e)}")
             beliefs = []
 
+    # Revisione della belief base all'apertura dell'editor (base dei salvataggi)
+    if 'belief_editor_revision' not in st.session_state:
+        st.session_state.belief_editor_revision = revision
+
     # Prepara JSON per l'editor
     beliefs_json = json.dumps({"beliefs_base": beliefs}, indent=2, ensure_ascii=False)
 
@@ -165,9 +215,12 @@ def belief_editor_modal():
             try:
                 parsed = json.loads(edited_json)
                 if 'beliefs_base' in parsed and isinstance(parsed['beliefs_base'], list):
-                    # Salva nel file
-                    with open(belief_base_path, 'w', encoding='utf-8') as f:
-                        json.dump(parsed, f, ensure_ascii=False, indent=2)
+                    # Salva nel file (solo se non è cambiato dall'apertura dell'editor)
+                    update_json(
+                        belief_base_path,
+                        lambda _: parsed,
+                        expected_revision=st.session_state.belief_editor_revision
+                    )
 
                     # Aggiorna metadata
                     belief_count = len(parsed['beliefs_base'])
@@ -178,11 +231,14 @@ def belief_editor_modal():
 
                     st.success(f"✅ Beliefs saved! ({belief_count} beliefs)")
                     st.session_state.show_belief_editor = False
+                    st.session_state.pop('belief_editor_revision', None)
                     st.rerun()
                 else:
                     st.error("❌ JSON must contain a 'beliefs_base' array")
             except json.JSONDecodeError as e:
                 st.error(f"❌ Invalid JSON: {str(e)}")
+            except RevisionConflictError:
+                st.error("❌ The belief base was modified elsewhere since the editor was opened. Close and reopen the editor to load the latest version.")
             except Exception as e:
                 st.error(f"❌ Save error: {str(e)}")
 
@@ -191,14 +247,23 @@ def belief_editor_modal():
             if st.session_state.get('confirm_clear_beliefs_modal', False):
                 # Conferma e cancella
                 empty_data = {"beliefs_base": []}
-                with open(belief_base_path, 'w', encoding='utf-8') as f:
-                    json.dump(empty_data, f, ensure_ascii=False, indent=2)
+                try:
+                    update_json(
+                        belief_base_path,
+                        lambda _: empty_data,
+                        expected_revision=st.session_state.belief_editor_revision
+                    )
+                except RevisionConflictError:
+                    st.session_state.confirm_clear_beliefs_modal = False
+                    st.error("❌ The belief base was modified elsewhere since the editor was opened. Close and reopen the editor to load the latest version.")
+                    return
 
                 st.session_state.context_manager.update_context_metadata(
                     st.session_state.current_context,
                     {'belief_count': 0}
                 )
                 st.session_state.confirm_clear_beliefs_modal = False
+                st.session_state.pop('belief_editor_revision', None)
                 st.success("✅ Tutti i beliefs sono stati cancellati!")
                 st.rerun()
             else:
@@ -210,6 +275,7 @@ def belief_editor_modal():
         if st.button("❌ Chiudi", width='stretch'):
             st.session_state.show_belief_editor = False
             st.session_state.confirm_clear_beliefs_modal = False
+            st.session_state.pop('belief_editor_revision', None)
             st.rerun()
 
     # Info
@@ -325,13 +391,20 @@ with st.sidebar:
     with st.form("new_context_form", clear_on_submit=True):
         new_context_name = st.text_input("Context name", placeholder="e.g. Project X")
         new_context_desc = st.text_area("Description (optional)", placeholder="Brief context description...")
+        new_context_backend = st.selectbox(
+            "Embedding backend",
+            options=list(EMBEDDING_BACKENDS.keys()),
+            format_func=lambda key: EMBEDDING_BACKENDS[key]["label"],
+            help="Encoder used to index and query this context. It cannot be changed after creation."
+        )
         create_btn = st.form_submit_button("Create Context", width='stretch', type="primary")
 
         if create_btn and new_context_name:
             try:
                 metadata = st.session_state.context_manager.create_context(
                     name=new_context_name,
-                    description=new_context_desc
+                    description=new_context_desc,
+                    embedding_backend=new_context_backend
                 )
                 st.success(f"✅ Context '{new_context_name}' created!")
                 # Seleziona automaticamente il nuovo contesto
@@ -457,23 +530,7 @@ with col1:
 
         if pdf_files and st.button("Process PDF", key="process_pdf"):
             with st.spinner("Processing PDF files..."):
-                for pdf_file in pdf_files:
-                    try:
-                        chunks = st.session_state.doc_processor.process_pdf(pdf_file)
-                        st.session_state.doc_processor.add_documents(
-                            chunks,
-                            source=f"PDF: {pdf_file.name}"
-                        )
-                        st.success(f"✅ {pdf_file.name} processed successfully ({len(chunks)} chunks)")
-
-                        # Aggiorna il conteggio documenti nel metadata
-                        stats = st.session_state.doc_processor.get_stats()
-                        st.session_state.context_manager.update_context_metadata(
-                            st.session_state.current_context,
-                            {'document_count': stats['document_count']}
-                        )
-                    except Exception as e:
-                        st.error(f"❌ Error processing {pdf_file.name}: {str(e)}")
+                ingest_uploaded_files(pdf_files, source_prefix="PDF")
 
     with tab2:
         st.markdown("Enter web page URLs to extract content")
@@ -509,23 +566,7 @@ with col1:
 
         if txt_files and st.button("Process Text Files", key="process_txt"):
             with st.spinner("Processing text files..."):
-                for txt_file in txt_files:
-                    try:
-                        chunks = st.session_state.doc_processor.process_text(txt_file)
-                        st.session_state.doc_processor.add_documents(
-                            chunks,
-                            source=f"TXT: {txt_file.name}"
-                        )
-                        st.success(f"✅ {txt_file.name} processed successfully ({len(chunks)} chunks)")
-
-                        # Aggiorna il conteggio documenti nel metadata
-                        stats = st.session_state.doc_processor.get_stats()
-                        st.session_state.context_manager.update_context_metadata(
-                            st.session_state.current_context,
-                            {'document_count': stats['document_count']}
-                        )
-                    except Exception as e:
-                        st.error(f"❌ Error processing {txt_file.name}: {str(e)}")
+                ingest_uploaded_files(txt_files, source_prefix="TXT")
 
     with tab4:
         st.markdown("Load Markdown files (.md)")
@@ -538,23 +579,7 @@ with col1:
 
         if md_files and st.button("Process Markdown", key="process_md"):
             with st.spinner("Processing Markdown files..."):
-                for md_file in md_files:
-                    try:
-                        chunks = st.session_state.doc_processor.process_text(md_file)
-                        st.session_state.doc_processor.add_documents(
-                            chunks,
-                            source=f"MD: {md_file.name}"
-                        )
-                        st.success(f"✅ {md_file.name} processed successfully ({len(chunks)} chunks)")
-
-                        # Aggiorna il conteggio documenti nel metadata
-                        stats = st.session_state.doc_processor.get_stats()
-                        st.session_state.context_manager.update_context_metadata(
-                            st.session_state.current_context,
-                            {'document_count': stats['document_count']}
-                        )
-                    except Exception as e:
-                        st.error(f"❌ Error processing {md_file.name}: {str(e)}")
+                ingest_uploaded_files(md_files, source_prefix="MD")
 
     # Suggerimento
     st.markdown("---")
@@ -622,12 +647,6 @@ with col2:
                         generate_description = True
                         st.info("📝 Generating context description...")
 
-                    # Recupera tutti i documenti dalla knowledge base
-                    all_docs = st.session_state.doc_processor.collection.get()
-
-                    # Concatena tutti i documenti
-                    context = "\n\n---\n\n".join(all_docs['documents'])
-
                     # Chiama l'LLM (usa il primo provider disponibile)
                     # Lazy load LLMManager solo quando necessario
                     if 'llm_manager' not in st.session_state:
@@ -660,7 +679,8 @@ with col2:
                                 provider=provider,
                                 model=model,
                                 messages=[{"role": "user", "content": description_prompt}],
-                                system_prompt="Sei un assistente che analizza documenti e genera descrizioni concise."
+                                system_prompt="Sei un assistente che analizza documenti e genera descrizioni concise.",
+                                agent="knol"
                             )
 
                             # Salva la descrizione nel metadata
@@ -671,62 +691,63 @@ with col2:
                             )
                             st.success(f"✅ Descrizione generata: {description}")
 
-                        # STEP 3: Estrai belief base
+                        # STEP 3: Estrai belief base (map-reduce su finestre di chunk a budget di token)
                         st.info("🧠 Estrazione belief di base...")
 
-                        # Carica il prompt per i belief base
-                        prompt_path = "./prompts/belief_base_prompt.md"
-                        with open(prompt_path, 'r', encoding='utf-8') as f:
-                            belief_base_prompt = f.read()
-
-                        # Prepara il messaggio per l'LLM
-                        user_message = f"Analizza la seguente base di conoscenza ed estrai tutti i belief di base secondo le istruzioni fornite.\n\nBASE DI CONOSCENZA:\n{context}"
-
-                        response = st.session_state.llm_manager.chat(
+                        extractor = BeliefBaseExtractor(
+                            llm_manager=st.session_state.llm_manager,
+                            doc_processor=st.session_state.doc_processor,
+                            context_path=st.session_state.context_manager.get_context_path(
+                                st.session_state.current_context
+                            ),
                             provider=provider,
-                            model=model,
-                            messages=[{"role": "user", "content": user_message}],
-                            system_prompt=belief_base_prompt
+                            model=model
                         )
 
-                        # Estrai il JSON dalla risposta
-                        json_start = response.find('{')
-                        json_end = response.rfind('}') + 1
-
-                        if json_start != -1 and json_end > json_start:
-                            json_str = response[json_start:json_end]
-                            try:
-                                belief_base = json.loads(json_str)
-
-                                # Verifica che abbia la chiave richiesta
-                                if 'beliefs_base' not in belief_base:
-                                    st.error("❌ Errore: JSON non contiene la chiave 'beliefs_base'")
-                                    st.code(json_str[:500])
-                                else:
-                                    # Salva nel file belief_base.json del contesto
-                                    belief_base_path = st.session_state.context_manager.get_belief_base_path(
-                                        st.session_state.current_context
-                                    )
-                                    with open(belief_base_path, 'w', encoding='utf-8') as f:
-                                        json.dump(belief_base, f, ensure_ascii=False, indent=2)
-
-                                    # Aggiorna il conteggio nel metadata
-                                    belief_count = len(belief_base.get('beliefs_base', []))
-                                    st.session_state.context_manager.update_context_metadata(
-                                        st.session_state.current_context,
-                                        {'belief_count': belief_count}
-                                    )
-
-                                    st.success(f"✅ Belief Base extracted successfully! {belief_count} beliefs identified.")
-                                    st.rerun()
-                            except json.JSONDecodeError as e:
-                                st.error(f"❌ JSON parsing error: {str(e)}")
-                                st.warning("Showing first 1000 characters of response for debugging:")
-                                st.code(response[:1000])
+                        progress_bar = st.progress(0.0, text="Preparing knowledge base windows...")
+                        progress_log = st.empty()
+                        window_lines = []
+
+                        def report_window(event):
+                            progress_bar.progress(
+                                event['done'] / event['total'],
+                                text=f"Window {event['done']}/{event['total']}"
+                            )
+                            if event['error']:
+                                window_lines.append(f"❌ Window {event['window_id']}: {event['error']}")
+                            elif event['resumed']:
+                                window_lines.append(f"♻️ Window {event['window_id']}: {event['beliefs']} beliefs (resumed)")
+                            else:
+                                window_lines.append(f"✅ Window {event['window_id']}: {event['beliefs']} beliefs")
+                            progress_log.markdown("\n\n".join(window_lines[-8:]))
+
+                        result = extractor.run(resume=True, progress_callback=report_window)
+
+                        if not result['complete']:
+                            st.error(
+                                f"❌ {len(result['errors'])} of {result['windows']} windows failed. "
+                                "Run the extraction again to retry only the failed windows."
+                            )
+                        elif not result['beliefs_base']:
+                            st.error("❌ No beliefs extracted from the knowledge base")
                         else:
-                            st.error("❌ Error: LLM response does not contain valid JSON (no '{' or '}' found)")
-                            st.warning("Showing complete response:")
-                            st.code(response)
+                            belief_base = {'beliefs_base': result['beliefs_base']}
+
+                            # Salva nel file belief_base.json del contesto
+                            belief_base_path = st.session_state.context_manager.get_belief_base_path(
+                                st.session_state.current_context
+                            )
+                            write_json_atomic(belief_base_path, belief_base)
+
+                            # Aggiorna il conteggio nel metadata
+                            belief_count = len(belief_base['beliefs_base'])
+                            st.session_state.context_manager.update_context_metadata(
+                                st.session_state.current_context,
+                                {'belief_count': belief_count}
+                            )
+
+                            st.success(f"✅ Belief Base extracted successfully! {belief_count} beliefs identified.")
+                            st.rerun()
 
                 except Exception as e:
                     st.error(f"❌ Error extracting beliefs: {e}")
@@ -736,6 +757,7 @@ with col2:
     # Logica per aprire editor beliefs
     if edit_belief:
         st.session_state.show_belief_editor = True
+        st.session_state.pop('belief_editor_revision', None)
         st.rerun()
 
     # Logica per cancellare knowledge base del contesto
@@ -756,6 +778,7 @@ with col2:
                         st.warning(f"⚠️ Cannot delete belief_base.json: {e}")
 
                 # Forza la re-inizializzazione del DocumentProcessor
+                st.session_state.doc_processor.release_connections()
                 st.session_state.doc_processor = DocumentProcessor(
                     context_name=st.session_state.current_context
                 )
@@ -3,7 +3,6 @@ import os
 import sys
 import json
 from datetime import datetime
-import re
 # Aggiungi la directory parent al path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -11,8 +10,12 @@ from utils.document_processor import DocumentProcessor
 from utils.prompts import get_prompt
 from utils.session_manager import SessionManager
 from utils.context_manager import ContextManager
-from utils.auditor import ConversationAuditor
+from utils.auditor import ConversationAuditor, merge_audit_results
 from utils.ui_messages import get_random_thinking_message
+from utils.chat_page import render_audit_poller, sync_chat_log
+from utils.history_manager import HistoryCompactor, summary_file_name
+from utils.structured_output import extract_json
+from utils.atomic_json import write_json_atomic
 
 ALI_MODULE_GOAL = (
     "Guide the domain owner to collect and formalize concrete desires, "
@@ -40,6 +43,7 @@ if 'context_manager' not in st.session_state:
 
 if 'ali_chat_history' not in st.session_state:
     st.session_state.ali_chat_history = []
+    st.session_state.ali_chat_logged = 0
     st.session_state.ali_greeted = False
 
 if 'desires' not in st.session_state:
@@ -60,11 +64,10 @@ if 'ali_pending_prompt' not in st.session_state:
 # Se non c'è active_session, prova a caricare l'ultima sessione attiva
 if 'active_session' not in st.session_state or not st.session_state.active_session:
     # Fallback: carica l'ultima sessione attiva disponibile
-    all_sessions = st.session_state.session_manager.get_all_sessions(status="active")
-    if all_sessions:
-        # Usa la più recentemente acceduta
-        latest_session = max(all_sessions, key=lambda s: s['metadata'].get('last_accessed', ''))
-        st.session_state.active_session = latest_session['session_id']
+    # Usa la più recentemente acceduta (le sessioni sono ordinate per last_accessed)
+    latest_sessions = st.session_state.session_manager.list_sessions(status="active", limit=1)
+    if latest_sessions:
+        st.session_state.active_session = latest_sessions[0]['session_id']
 
 if 'active_session' in st.session_state and st.session_state.active_session:
     active_session_data = st.session_state.session_manager.get_session(st.session_state.active_session)
@@ -107,6 +110,8 @@ if 'active_session' in st.session_state and st.session_state.active_session:
             # Inizializza o aggiorna il DocumentProcessor per il contesto della sessione
             # NOTA: initialize_db() viene chiamato solo al primo uso (query RAG)
             if 'doc_processor' not in st.session_state or st.session_state.get('current_context') != normalized_context:
+                if st.session_state.get('doc_processor'):
+                    st.session_state.doc_processor.release_connections()
                 st.session_state.doc_processor = DocumentProcessor(context_name=normalized_context)
                 st.session_state.current_context = normalized_context
                 st.session_state.doc_processor_initialized = False  # Flag per lazy init
@@ -319,6 +324,9 @@ with st.sidebar:
         from utils.llm_manager import LLMManager
         st.session_state.llm_manager = LLMManager()
 
+    # La telemetria delle chiamate LLM viene scritta nella sessione attiva
+    st.session_state.llm_manager.set_telemetry_session(st.session_state.get('active_session'))
+
     if 'desires_auditor' not in st.session_state:
         st.session_state.desires_auditor = ConversationAuditor(
             st.session_state.llm_manager,
@@ -377,20 +385,19 @@ with st.sidebar:
 
     if st.button("🔄 New Conversation", width='stretch'):
         st.session_state.ali_chat_history = []
+        st.session_state.ali_chat_logged = 0
         st.session_state.ali_greeted = False
         st.session_state.ali_audit_trail = []
         st.session_state.ali_suggestions = []
         st.session_state.ali_pending_prompt = None
+        if st.session_state.get("desires_auditor"):
+            st.session_state.desires_auditor.discard_reviews()
         st.rerun()
 
     if st.button("Complete Session", type="primary", width='stretch'):
         # Verifica se c'e' una sessione attiva
         if 'active_session' in st.session_state and st.session_state.active_session:
             if st.session_state.desires:
-                existing_bdi = st.session_state.session_manager.get_bdi_data(st.session_state.active_session) or {}
-                beneficiario_info = existing_bdi.get("beneficiario") or existing_bdi.get("persona") or {}
-                domain_summary = existing_bdi.get("domain_summary", "")
-
                 bdi_desires = []
                 for i, d in enumerate(st.session_state.desires):
                     success_metrics = (d.get("success_criteria") or "").splitlines() if d.get("success_criteria") else []
@@ -401,11 +408,10 @@ with st.sidebar:
                         "success_metrics": success_metrics
                     })
 
+                # Solo i desires: beneficiario e domain_summary restano quelli salvati
                 st.session_state.session_manager.update_bdi_data(
                     st.session_state.active_session,
-                    desires=bdi_desires,
-                    beneficiario=beneficiario_info,
-                    domain_summary=domain_summary
+                    desires=bdi_desires
                 )
 
                 st.session_state.session_manager.update_session_metadata(
@@ -457,8 +463,7 @@ with st.sidebar:
                 with open(filename, 'w', encoding='utf-8') as f:
                     json.dump(fallback_bdi, f, ensure_ascii=False, indent=2)
 
-                with open("./data/current_bdi.json", 'w', encoding='utf-8') as f:
-                    json.dump(fallback_bdi, f, ensure_ascii=False, indent=2)
+                write_json_atomic("./data/current_bdi.json", fallback_bdi)
 
                 st.info(f"BDI (desires) saved in: {filename}")
                 st.info("Tip: Activate a session in Compass to integrate it into the system!")
@@ -551,6 +556,18 @@ if not st.session_state.ali_greeted:
     })
     st.session_state.ali_greeted = True
 
+# Raccoglie le revisioni dell'Auditor concluse in background
+ali_auditor = st.session_state.get("desires_auditor")
+if ali_auditor:
+    merged_audits, audit_error = merge_audit_results(st.session_state.ali_audit_trail, ali_auditor.collect_reviews())
+    last_index = len(st.session_state.ali_chat_history) - 1
+    if last_index in merged_audits:
+        st.session_state.ali_suggestions = (merged_audits[last_index].get("suggested_user_replies") or [])[:3]
+    if audit_error:
+        st.warning(f"Auditor not available: {audit_error}")
+
+pending_audits = set(ali_auditor.pending_reviews()) if ali_auditor else set()
+
 # Display chat history
 audit_map = {
     item["message_index"]: item.get("result", {})
@@ -558,6 +575,9 @@ audit_map = {
     if isinstance(item, dict) and "message_index" in item
 }
 
+# Registra nel log della sessione i messaggi aggiunti dal rerun precedente
+sync_chat_log("ali")
+
 for idx, message in enumerate(st.session_state.ali_chat_history):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
@@ -573,6 +593,27 @@ for idx, message in enumerate(st.session_state.ali_chat_history):
             if summary:
                 st.markdown(summary)
 
+            rubric = audit_payload.get("rubric") or {}
+            if isinstance(rubric, dict) and rubric:
+                rubric_labels = [
+                    ("coerenza_domanda", "Coerenza con la domanda"),
+                    ("allineamento_modulo", "Allineamento al modulo"),
+                    ("contesto_conservato", "Contesto conservato"),
+                    ("progressione_dialogo", "Progressione dialogo"),
+                    ("focus_beneficiario", "Focus sul beneficiario"),
+                    ("gestione_json", "Gestione finalizzazione/JSON"),
+                ]
+                st.markdown("**Rubric scores:**")
+                for key, label in rubric_labels:
+                    item = rubric.get(key) or {}
+                    score = item.get("score")
+                    notes = (item.get("notes") or "").strip()
+                    score_text = f"{score}/5" if isinstance(score, int) else "N/A"
+                    if notes:
+                        st.write(f"- {label}: {score_text} — {notes}")
+                    else:
+                        st.write(f"- {label}: {score_text}")
+
             issues = audit_payload.get("issues") or []
             if issues:
                 st.markdown("**Detected issues:**")
@@ -604,6 +645,12 @@ for idx, message in enumerate(st.session_state.ali_chat_history):
                     pending_state_key="ali_pending_prompt",
                     button_prefix=f"ali_{idx}"
                 )
+    elif message.get("role") == "assistant" and idx in pending_audits:
+        with st.chat_message("system"):
+            st.caption("⏳ Auditor review in progress...")
+
+if pending_audits:
+    render_audit_poller(ali_auditor)
 
 # Chat input (supporta suggerimenti automatici dell'Auditor)
 auto_prompt = None
@@ -650,21 +697,33 @@ if prompt:
                 context_parts.append(beneficiario_ctx.strip())
 
             if rag_results and rag_results['documents'] and rag_results['documents'][0]:
-                context_parts.append("\n\n".join(rag_results['documents'][0]))
+                context_parts.extend(rag_results['documents'][0])
 
-            context = "\n\n".join([c for c in context_parts if c])
+            # I blocchi vengono passati separati: LLMManager li deduplica e ne limita la dimensione
+            context = [c for c in context_parts if c]
 
             # Get LLM settings from session
             llm_settings = active_session_data['config'].get('llm_settings', {})
             use_defaults = llm_settings.get('use_defaults', False)
 
+            # Compatta la cronologia: turni recenti integrali, i precedenti riassunti
+            compactor = HistoryCompactor(
+                "ali",
+                st.session_state.llm_manager,
+                st.session_state.session_manager.get_session_path(
+                    st.session_state.active_session, summary_file_name("ali")
+                )
+            )
+            compacted_history = compactor.compact(st.session_state.ali_chat_history, provider, model)
+
             # Prepara i parametri della chiamata
             chat_params = {
                 'provider': provider,
                 'model': model,
-                'messages': st.session_state.ali_chat_history,
-                'system_prompt': ALI_SYSTEM_PROMPT,
-                'context': context if context else None
+                'messages': compacted_history['messages'],
+                'system_prompt': ALI_SYSTEM_PROMPT + compacted_history['system_addendum'],
+                'context': context if context else None,
+                'agent': 'ali'
             }
 
             # Aggiungi parametri custom solo se use_defaults è False
@@ -682,8 +741,13 @@ if prompt:
                 if model.startswith('gpt-5'):
                     chat_params['reasoning_effort'] = llm_settings.get('reasoning_effort', 'medium')
 
-            # Get response from LLM
-            response = st.session_state.llm_manager.chat(**chat_params)
+            # Get response from LLM (streaming: la risposta viene mostrata mentre arriva)
+            with st.chat_message("assistant"):
+                response_stream = st.session_state.llm_manager.chat_stream(**chat_params)
+                st.write_stream(response_stream)
+                if response_stream.rerouted:
+                    st.caption(f"↪️ Answered by {response_stream.provider} / {response_stream.model} ({response_stream.route})")
+            response = response_stream.text
 
             # Add assistant response
             st.session_state.ali_chat_history.append({
@@ -691,9 +755,6 @@ if prompt:
                 "content": response
             })
 
-            with st.chat_message("assistant"):
-                st.markdown(response)
-
             # Visualizzazione compressa del RAG context e beneficiario
             with st.expander("📚 RAG & Context Details", expanded=False):
                 if beneficiario_ctx:
@@ -710,9 +771,13 @@ if prompt:
                 else:
                     st.info("No RAG documents used for this response")
 
-            auditor_result = None
+            # Revisione dell'Auditor in background (solo sui turni campionati o di finalizzazione):
+            # la card compare appena la revisione è pronta
+            st.session_state.ali_suggestions = []
             auditor = st.session_state.get("desires_auditor")
-            if auditor and provider and model:
+            if auditor and provider and model and auditor.should_review(
+                "ali", st.session_state.ali_chat_history, ALI_EXPECTED_OUTCOME, prompt, response
+            ):
                 context_summary = {
                     "session_name": active_session_data['metadata'].get('name'),
                     "context_name": active_session_data['config'].get('context'),
@@ -727,120 +792,31 @@ if prompt:
                     beneficiario = st.session_state["active_beneficiario"]
                     context_summary["beneficiario_name"] = beneficiario.get("beneficiario_name") or beneficiario.get("persona_name")
 
-                try:
-                    auditor_result = auditor.review(
-                        provider=provider,
-                        model=model,
-                        conversation=[msg.copy() for msg in st.session_state.ali_chat_history],
-                        module_name="ali",
-                        module_goal=ALI_MODULE_GOAL,
-                        expected_outcome=ALI_EXPECTED_OUTCOME,
-                        context_summary=context_summary,
-                        last_user_message=prompt,
-                        assistant_message=response,
-                    )
-                except Exception as audit_exc:  # pylint: disable=broad-except
-                    auditor_result = {"error": str(audit_exc)}
-
-            if auditor_result and "error" not in auditor_result:
-                message_index = len(st.session_state.ali_chat_history) - 1
-                existing_entry = next(
-                    (item for item in st.session_state.ali_audit_trail if item.get("message_index") == message_index),
-                    None
+                auditor.submit_review(
+                    len(st.session_state.ali_chat_history) - 1,
+                    provider=provider,
+                    model=model,
+                    conversation=[msg.copy() for msg in st.session_state.ali_chat_history],
+                    module_name="ali",
+                    module_goal=ALI_MODULE_GOAL,
+                    expected_outcome=ALI_EXPECTED_OUTCOME,
+                    context_summary=context_summary,
+                    last_user_message=prompt,
+                    assistant_message=response,
+                    rag_context=context or None,
+                    embedding_backend=st.session_state.doc_processor.embedding_backend,
                 )
-                audit_record = {
-                    "message_index": message_index,
-                    "result": auditor_result,
-                    "timestamp": datetime.now().isoformat()
-                }
-
-                if existing_entry:
-                    existing_entry.update(audit_record)
-                else:
-                    st.session_state.ali_audit_trail.append(audit_record)
-
-                st.session_state.ali_suggestions = (auditor_result.get("suggested_user_replies") or [])[:3]
-
                 with st.chat_message("system"):
-                    status = auditor_result.get("status", "pass")
-                    icon = "✅" if status == "pass" else "⚠️"
-                    summary = auditor_result.get("summary")
-
-                    st.markdown(f"**Auditor {icon}**")
-                    if summary:
-                        st.markdown(summary)
-
-                    rubric = auditor_result.get("rubric") or {}
-                    if isinstance(rubric, dict) and rubric:
-                        rubric_labels = [
-                            ("coerenza_domanda", "Coerenza con la domanda"),
-                            ("allineamento_modulo", "Allineamento al modulo"),
-                            ("contesto_conservato", "Contesto conservato"),
-                            ("progressione_dialogo", "Progressione dialogo"),
-                            ("focus_beneficiario", "Focus sul beneficiario"),
-                            ("gestione_json", "Gestione finalizzazione/JSON"),
-                        ]
-                        st.markdown("**Rubric scores:**")
-                        for key, label in rubric_labels:
-                            item = rubric.get(key) or {}
-                            score = item.get("score")
-                            notes = (item.get("notes") or "").strip()
-                            score_text = f"{score}/5" if isinstance(score, int) else "N/A"
-                            if notes:
-                                st.write(f"- {label}: {score_text} — {notes}")
-                            else:
-                                st.write(f"- {label}: {score_text}")
-
-                    issues = auditor_result.get("issues") or []
-                    if issues:
-                        st.markdown("**Detected issues:**")
-                        for issue in issues:
-                            issue_type = issue.get("type", "issue")
-                            severity = issue.get("severity", "low")
-                            message_text = issue.get("message", "")
-                            st.write(f"- ({severity.upper()} · {issue_type}) {message_text}")
-
-                    improvements = auditor_result.get("assistant_improvements") or []
-                    if improvements:
-                        st.markdown("**Suggestions for the agent:**")
-                        for idea in improvements:
-                            st.write(f"- {idea}")
-
-                    next_focus = auditor_result.get("next_focus")
-                    if next_focus:
-                        st.caption(f"Next focus: {next_focus}")
-
-                    confidence = auditor_result.get("confidence")
-                    if confidence:
-                        st.caption(f"Assessment confidence: {confidence}")
-
-                    quick_reply_placeholder = st.empty()
-                    render_quick_replies(
-                        placeholder=quick_reply_placeholder,
-                        suggestions=st.session_state.ali_suggestions,
-                        pending_state_key="ali_pending_prompt",
-                        button_prefix=f"ali_{message_index}"
-                    )
-
-            elif auditor_result and "error" in auditor_result:
-                st.session_state.ali_suggestions = []
-                st.warning(f"Auditor not available: {auditor_result['error']}")
+                    st.caption("⏳ Auditor review in progress...")
+                render_audit_poller(auditor)
 
             # --- NUOVA LOGICA PER PARSARE IL JSON ---
-            json_content_str = None
-            if "```" in response:
-                json_block = re.search(r"```json\s*(.*?)\s*```", response, re.IGNORECASE | re.DOTALL)
-                if not json_block:
-                    json_block = re.search(r"```[^{]*({.*?})\s*```", response, re.DOTALL)
-                if json_block:
-                    json_content_str = json_block.group(1).strip()
-            elif response.strip().startswith("{"):
-                json_content_str = response.strip()
-
-            if json_content_str:
-                try:
-                    parsed_json = json.loads(json_content_str)
+            parsed_json = None
+            if "```" in response or response.strip().startswith("{"):
+                parsed_json = extract_json(response, expect=dict)
 
+            if parsed_json:
+                try:
                     beneficiario_info = parsed_json.get("beneficiario") or parsed_json.get("persona") or {}
                     domain_summary = parsed_json.get("domain_summary")
                     desires_payload = parsed_json.get("desires") if isinstance(parsed_json.get("desires"), list) else []
@@ -873,16 +849,16 @@ if prompt:
                         st.session_state.desires.extend(extracted_desires)
 
                         if 'active_session' in st.session_state and st.session_state.active_session:
-                            existing_bdi = st.session_state.session_manager.get_bdi_data(st.session_state.active_session) or {}
-                            existing_structured_desires = existing_bdi.get("desires", []) if isinstance(existing_bdi.get("desires"), list) else []
-                            combined_desires = existing_structured_desires + bdi_desires
-
-                            st.session_state.session_manager.update_bdi_data(
-                                st.session_state.active_session,
-                                desires=combined_desires,
-                                beneficiario=beneficiario_info or existing_bdi.get("beneficiario") or existing_bdi.get("persona") or {},
-                                domain_summary=domain_summary if domain_summary is not None else existing_bdi.get("domain_summary", "")
-                            )
+                            # Unione con i desires salvati sotto il lock del documento (nessun aggiornamento perso)
+                            def append_desires(existing_bdi):
+                                existing_structured_desires = existing_bdi["desires"] if isinstance(existing_bdi["desires"], list) else []
+                                return {
+                                    "desires": existing_structured_desires + bdi_desires,
+                                    "beneficiario": beneficiario_info or existing_bdi["beneficiario"] or {},
+                                    "domain_summary": domain_summary if domain_summary is not None else existing_bdi["domain_summary"]
+                                }
+
+                            st.session_state.session_manager.merge_bdi_data(st.session_state.active_session, append_desires)
                             st.success(f"✅ Final report detected! {len(extracted_desires)} new desires extracted and added! Total: {len(st.session_state.desires)}")
                         else:
                             st.success(f"✅ Final report detected! {len(extracted_desires)} desires extracted! Total: {len(st.session_state.desires)}")
@@ -892,10 +868,10 @@ if prompt:
                     else:
                         st.warning("⚠️ The JSON report was detected but doesn't contain desires in the expected format.")
 
-                except json.JSONDecodeError:
-                    st.error("❌ The final JSON report generated by the agent is invalid and cannot be parsed.")
                 except Exception as e:
                     st.error(f"An unexpected error occurred while parsing the report: {e}")
+            elif "```json" in response.lower():
+                st.error("❌ The final JSON report generated by the agent is invalid and cannot be parsed.")
             # --- FINE NUOVA LOGICA ---
 
             # Check if a desire was mentioned (simple heuristic)
@@ -904,3 +880,6 @@ if prompt:
 
         except Exception as e:
             st.error(f"❌ Error: {str(e)}")
+
+# Registra nel log della sessione i messaggi di questo rerun (se non è seguito da st.rerun)
+sync_chat_log("ali")
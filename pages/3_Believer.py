@@ -3,7 +3,6 @@ import os
 import sys
 import json
 from datetime import datetime
-import re
 # Aggiungi la directory parent al path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -11,6 +10,12 @@ from utils.document_processor import DocumentProcessor
 from utils.prompts import get_prompt
 from utils.session_manager import SessionManager
 from utils.ui_messages import get_random_thinking_message
+from utils.chat_page import render_audit_poller, sync_chat_log
+from utils.history_manager import HistoryCompactor, summary_file_name
+from utils.structured_output import StructuredOutputError
+from utils.belief_generation import generate_beliefs_from_scratch
+from utils.atomic_json import write_json_atomic
+from utils.auditor import merge_audit_results
 
 BELIEVER_MODULE_GOAL = (
     "Guide the domain owner to extract and formalize verifiable beliefs that support identified desires, "
@@ -33,6 +38,7 @@ if 'session_manager' not in st.session_state:
 
 if 'believer_chat_history' not in st.session_state:
     st.session_state.believer_chat_history = []
+    st.session_state.believer_chat_logged = 0
     st.session_state.believer_greeted = False
 
 if 'beliefs' not in st.session_state:
@@ -145,11 +151,10 @@ st.markdown("""
 # Se non c'è active_session, prova a caricare l'ultima sessione attiva
 if 'active_session' not in st.session_state or not st.session_state.active_session:
     # Fallback: carica l'ultima sessione attiva disponibile
-    all_sessions = st.session_state.session_manager.get_all_sessions(status="active")
-    if all_sessions:
-        # Usa la più recentemente acceduta
-        latest_session = max(all_sessions, key=lambda s: s['metadata'].get('last_accessed', ''))
-        st.session_state.active_session = latest_session['session_id']
+    # Usa la più recentemente acceduta (le sessioni sono ordinate per last_accessed)
+    latest_sessions = st.session_state.session_manager.list_sessions(status="active", limit=1)
+    if latest_sessions:
+        st.session_state.active_session = latest_sessions[0]['session_id']
 
     st.session_state.show_compass_button = False
 
@@ -183,6 +188,8 @@ if session_context:
     
     # Inizializza o aggiorna il DocumentProcessor per il contesto della sessione
     if 'doc_processor' not in st.session_state or st.session_state.get('current_context') != normalized_context:
+        if st.session_state.get('doc_processor'):
+            st.session_state.doc_processor.release_connections()
         st.session_state.doc_processor = DocumentProcessor(context_name=normalized_context)
         st.session_state.doc_processor.initialize_db()
         st.session_state.current_context = normalized_context
@@ -239,6 +246,22 @@ def load_desires():
         st.error(f"**Error loading desires from session:** {e}")
         return None
 
+def append_beliefs_to_bdi(new_beliefs):
+    """Appends newly extracted beliefs to the active session's BDI beliefs.
+
+    The append is applied through ``SessionManager.merge_bdi_data`` to the
+    stored list, under the document lock, so beliefs saved meanwhile by
+    another tab (the Compass editor, another Believer chat) are kept
+    instead of being replaced by this page's in-memory list.
+
+    Args:
+        new_beliefs: List of belief dicts to append.
+    """
+    st.session_state.session_manager.merge_bdi_data(
+        st.session_state.active_session,
+        lambda current_bdi: {"beliefs": (current_bdi["beliefs"] or []) + list(new_beliefs)}
+    )
+
 def load_base_beliefs():
     """Loads the pre-extracted base beliefs for the active session.
 
@@ -395,6 +418,9 @@ with st.sidebar:
         from utils.llm_manager import LLMManager
         st.session_state.llm_manager = LLMManager()
 
+    # La telemetria delle chiamate LLM viene scritta nella sessione attiva
+    st.session_state.llm_manager.set_telemetry_session(st.session_state.get('active_session'))
+
     if 'belief_auditor' not in st.session_state:
         from utils.auditor import ConversationAuditor
         st.session_state.belief_auditor = ConversationAuditor(
@@ -459,6 +485,7 @@ with st.sidebar:
     with col_left:
         if st.button("🔄 New", width='stretch'):
             st.session_state.believer_chat_history = []
+            st.session_state.believer_chat_logged = 0
             st.session_state.believer_greeted = False
             st.session_state.loaded_desires = None  # Forza il ricaricamento
             st.session_state.base_beliefs_checked = False  # Reset del check belief di base
@@ -467,6 +494,8 @@ with st.sidebar:
             st.session_state.believer_audit_trail = []
             st.session_state.believer_suggestions = []
             st.session_state.believer_pending_prompt = None
+            if st.session_state.get("belief_auditor"):
+                st.session_state.belief_auditor.discard_reviews()
             st.rerun()
 
     with col_right:
@@ -480,20 +509,14 @@ with st.sidebar:
                         beliefs=st.session_state.beliefs
                     )
 
-                    # Salva anche la chat history come metadati della sessione
-                    st.session_state.session_manager.update_session_metadata(
-                        st.session_state.active_session,
-                        chat_history_believer=st.session_state.believer_chat_history
-                    )
+                    # Registra nel log della sessione gli ultimi messaggi della chat
+                    sync_chat_log("believer")
 
                     st.success(f"✅ Session completed! {len(st.session_state.beliefs)} Beliefs saved to active session!")
                     st.balloons()
                 elif len(st.session_state.believer_chat_history) > 1:
                     # Se ci sono messaggi ma nessun belief, salva solo la chat
-                    st.session_state.session_manager.update_session_metadata(
-                        st.session_state.active_session,
-                        chat_history_believer=st.session_state.believer_chat_history
-                    )
+                    sync_chat_log("believer")
 
                     st.warning("⚠️ No beliefs identified, but the conversation has been saved to the session.")
                     st.info("💡 Tip: Ask Believer to generate the final report with identified beliefs.")
@@ -517,8 +540,7 @@ with st.sidebar:
                     with open(filename, 'w', encoding='utf-8') as f:
                         json.dump(final_data, f, ensure_ascii=False, indent=2)
 
-                    with open("./data/current_bdi.json", 'w', encoding='utf-8') as f:
-                        json.dump(final_data, f, ensure_ascii=False, indent=2)
+                    write_json_atomic("./data/current_bdi.json", final_data)
 
                     st.info(f"💾 Beliefs saved to: {filename}")
                     st.info("💡 Tip: Activate a session in Compass to integrate it into the system!")
@@ -627,6 +649,18 @@ Now we'll work together to identify the beliefs, facts, and principles that are
     })
     st.session_state.believer_greeted = True
 
+# Raccoglie le revisioni dell'Auditor concluse in background
+believer_auditor = st.session_state.get("belief_auditor")
+if believer_auditor:
+    merged_audits, audit_error = merge_audit_results(st.session_state.believer_audit_trail, believer_auditor.collect_reviews())
+    last_index = len(st.session_state.believer_chat_history) - 1
+    if last_index in merged_audits:
+        st.session_state.believer_suggestions = (merged_audits[last_index].get("suggested_user_replies") or [])[:3]
+    if audit_error:
+        st.warning(f"Auditor not available: {audit_error}")
+
+believer_pending_audits = set(believer_auditor.pending_reviews()) if believer_auditor else set()
+
 # Display chat history
 believer_audit_map = {
     item["message_index"]: item.get("result", {})
@@ -634,6 +668,9 @@ believer_audit_map = {
     if isinstance(item, dict) and "message_index" in item
 }
 
+# Registra nel log della sessione i messaggi aggiunti dal rerun precedente
+sync_chat_log("believer")
+
 for idx, message in enumerate(st.session_state.believer_chat_history):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
@@ -692,8 +729,20 @@ for idx, message in enumerate(st.session_state.believer_chat_history):
             confidence = audit_payload.get("confidence")
             if confidence:
                 st.caption(f"Assessment confidence: {confidence}")
+    elif message.get("role") == "assistant" and idx in believer_pending_audits:
+        with st.chat_message("system"):
+            st.caption("⏳ Auditor review in progress...")
+
+if believer_pending_audits:
+    render_audit_poller(believer_auditor)
 
 believer_suggestions_placeholder = st.empty()
+render_quick_replies(
+    placeholder=believer_suggestions_placeholder,
+    suggestions=st.session_state.believer_suggestions,
+    pending_state_key="believer_pending_prompt",
+    button_prefix="believer_active"
+)
 
 # Gestisci la chat conversazionale per i belief specializzati
 if st.session_state.believer_specialized_chat_active and not st.session_state.base_beliefs_available:
@@ -803,7 +852,8 @@ Once you've reviewed the base beliefs, come back here if you want to create more
                         'provider': provider,
                         'model': model,
                         'messages': [{"role": "user", "content": mix_prompt}],
-                        'system_prompt': None  # Nessun system prompt, tutto è nel prompt utente
+                        'system_prompt': None,  # Nessun system prompt, tutto è nel prompt utente
+                        'agent': 'believer'
                     }
 
                     # Aggiungi parametri custom solo se use_defaults è False
@@ -841,11 +891,15 @@ Here's the result:
                     })
 
                     # Parsing JSON per estrarre i beliefs dal mix
-                    json_match = re.search(r'```json(.*?)```', mix_response, re.DOTALL) or re.search(r'\{[\s\S]*\}', mix_response)
-                    if json_match:
+                    # Parsing condiviso con riparazione mirata della parte finale se il JSON è troncato
+                    try:
+                        parsed_json = st.session_state.llm_manager.parse_structured(
+                            mix_response, provider, model, agent='believer'
+                        )["data"]
+                    except StructuredOutputError:
+                        parsed_json = None
+                    if parsed_json:
                         try:
-                            json_str = json_match.group(1).strip() if '```' in json_match.group(0) else json_match.group(0).strip()
-                            parsed_json = json.loads(json_str)
 
                             if "beliefs" in parsed_json and isinstance(parsed_json["beliefs"], list):
                                 extracted_beliefs = []
@@ -865,10 +919,7 @@ Here's the result:
 
                                 if extracted_beliefs:
                                     st.session_state.beliefs.extend(extracted_beliefs)
-                                    st.session_state.session_manager.update_bdi_data(
-                                        st.session_state.active_session,
-                                        beliefs=st.session_state.beliefs
-                                    )
+                                    append_beliefs_to_bdi(extracted_beliefs)
                         except (json.JSONDecodeError, Exception):
                             pass  # Se il parsing fallisce, ignora silenziosamente
 
@@ -919,126 +970,48 @@ if 'from_scratch_generation_requested' in st.session_state and st.session_state.
     # Avvia processo con spinner
     with st.spinner(get_random_thinking_message()):
         try:
-            # STEP 1: Prepare desires context
-            desires_context = "USER DESIRES:\n\n"
-            for idx, desire in enumerate(st.session_state.loaded_desires, 1):
-                desire_id = desire.get('id', f'D{idx}')
-                desire_desc = desire.get('description', desire.get('content', 'N/A'))
-                desire_priority = desire.get('priority', 'N/A')
-                desires_context += f"- **Desire {desire_id}**: {desire_desc} (Priority: {desire_priority})\n"
-
-            # STEP 2: Query KB for each desire
-            progress_placeholder.markdown("🎯 **Generating beliefs from scratch...**\n\n🔍 Querying knowledge base for desires...")
-
-            desire_to_chunks = {}
-            query_details = []
-
-            for idx, desire in enumerate(st.session_state.loaded_desires, 1):
-                desire_id = desire.get('id', f'D{idx}')
-                desire_desc = desire.get('description', desire.get('content', 'N/A'))
-
-                # Query top-10 chunks (user preference: balanced coverage)
-                query_results = st.session_state.doc_processor.query(
-                    query_text=desire_desc,
-                    n_results=10
+            def show_progress(status, query_details):
+                progress_placeholder.markdown(
+                    f"🎯 **Generating beliefs from scratch...**\n\n{status}\n\n" + "\n".join(query_details)
                 )
 
-                # Format chunks
-                chunks_text = []
-                if query_results and 'documents' in query_results:
-                    for doc_list in query_results['documents']:
-                        for doc in doc_list:
-                            chunks_text.append(doc)
-
-                desire_to_chunks[desire_id] = chunks_text
-                query_details.append(f"- Desire {desire_id}: {len(chunks_text)} chunks found")
-
-            # STEP 3: Format chunks context
-            progress_placeholder.markdown(f"🎯 **Generating beliefs from scratch...**\n\n📝 Formatting context...\n\n" + "\n".join(query_details))
-
-            chunks_context = "CHUNKS FROM KNOWLEDGE BASE:\n\n"
-            for desire_id, chunks in desire_to_chunks.items():
-                chunks_context += f"### [Desire {desire_id}]\n\n"
-                for i, chunk in enumerate(chunks, 1):
-                    chunks_context += f"**Chunk {i}:**\n{chunk}\n\n"
-
-            # STEP 4: Load prompt template
-            from_scratch_template = get_prompt('believer', use_cache=False, prompt_suffix='from_scratch_prompt')
-
-            # Template substitution
-            from_scratch_prompt = from_scratch_template.replace('{desires_context}', desires_context)
-            from_scratch_prompt = from_scratch_prompt.replace('{chunks_context}', chunks_context)
-
-            # STEP 5: LLM call
-            progress_placeholder.markdown(f"🎯 **Generating beliefs from scratch...**\n\n🤖 Analyzing with LLM...\n\n" + "\n".join(query_details))
-
-            from_scratch_response = st.session_state.llm_manager.chat(
-                provider=provider,
-                model=model,
-                messages=[{"role": "user", "content": from_scratch_prompt}],
-                system_prompt=None,
-                max_tokens=8192,
-                temperature=0.5  # Balanced mode: medium-high relevance (user preference)
-            )
-
-            # STEP 6: Parse JSON
-            json_match = re.search(r'```json\s*(.*?)\s*```', from_scratch_response, re.DOTALL)
-            if not json_match:
-                json_match = re.search(r'\{[\s\S]*\}', from_scratch_response)
-
-            if json_match:
-                json_text = json_match.group(1) if '```json' in from_scratch_response else json_match.group(0)
-                parsed_json = json.loads(json_text)
-
-                extracted_beliefs = parsed_json.get("beliefs", [])
-
-                if extracted_beliefs:
-                    # STEP 7: Assign IDs & timestamps
-                    existing_ids = [b.get("id", 0) for b in st.session_state.beliefs]
-                    next_id = max(existing_ids) + 1 if existing_ids else 1
-
-                    for i, b in enumerate(extracted_beliefs):
-                        belief_copy = b.copy()
-                        belief_copy["id"] = next_id + i
-                        if "timestamp" not in belief_copy:
-                            belief_copy["timestamp"] = datetime.now().isoformat()
-                        st.session_state.beliefs.append(belief_copy)
-
-                    # STEP 8: Save to session
-                    st.session_state.session_manager.update_bdi_data(
-                        st.session_state.active_session,
-                        beliefs=st.session_state.beliefs
-                    )
-
-                    # Update final message
-                    success_msg = f"""✅ **Generation from scratch completed!** {len(extracted_beliefs)} new beliefs added.
-
-Beliefs have been extracted directly from knowledge base chunks and are now available in the sidebar. Each belief has been classified for relevance to desires and includes citation of the original source.
+            try:
+                generation = generate_beliefs_from_scratch(
+                    doc_processor=st.session_state.doc_processor,
+                    llm_manager=st.session_state.llm_manager,
+                    provider=provider,
+                    model=model,
+                    desires=st.session_state.loaded_desires,
+                    existing_beliefs=st.session_state.beliefs,
+                    on_progress=show_progress
+                )
+            except StructuredOutputError:
+                generation = None
 
-📊 **Generation summary:**
-- Desires analyzed: {len(st.session_state.loaded_desires)}
-- Chunks processed: {sum(len(chunks) for chunks in desire_to_chunks.values())}
-- Beliefs extracted: {len(extracted_beliefs)}
+            if generation is None:
+                # User preference: generic error message (no raw response)
+                error_msg = "⚠️ Unable to extract JSON from LLM response. Please try again or contact support."
+                progress_placeholder.error(error_msg)
+            elif generation["beliefs"]:
+                st.session_state.beliefs.extend(generation["beliefs"])
 
-You can view beliefs in the sidebar or export them using the button at the bottom of the page."""
+                # Salva nella sessione
+                append_beliefs_to_bdi(generation["beliefs"])
 
-                    progress_placeholder.markdown(success_msg)
+                success_msg = generation["summary"]
+                progress_placeholder.markdown(success_msg)
 
-                    st.session_state.believer_chat_history.append({
-                        "role": "assistant",
-                        "content": success_msg
-                    })
+                st.session_state.believer_chat_history.append({
+                    "role": "assistant",
+                    "content": success_msg
+                })
 
-                    st.rerun()
-                else:
-                    error_msg = "⚠️ No beliefs extracted from JSON."
-                    progress_placeholder.error(error_msg)
+                st.rerun()
             else:
-                # User preference: generic error message (no raw response)
-                error_msg = "⚠️ Unable to extract JSON from LLM response. Please try again or contact support."
+                error_msg = "⚠️ No beliefs extracted from JSON."
                 progress_placeholder.error(error_msg)
 
-        except json.JSONDecodeError as e:
+        except (json.JSONDecodeError, AttributeError):
             # User preference: generic error message
             error_msg = "❌ JSON parsing error. Response format is invalid."
             progress_placeholder.error(error_msg)
@@ -1071,7 +1044,7 @@ if st.session_state.believer_specialized_chat_active and prompt and prompt.strip
     # Chiama l'LLM con il system prompt di Believer
     with st.spinner(get_random_thinking_message()):
         try:
-            # Prepara il contesto da includere nel prompt
+            # Desire della sessione: inviati una sola volta nell'addendum della cronologia compattata
             desires_context = "\n## DESIRES DELL'UTENTE:\n"
             for idx, desire in enumerate(st.session_state.loaded_desires, 1):
                 desire_id = desire.get('id', idx)
@@ -1079,11 +1052,19 @@ if st.session_state.believer_specialized_chat_active and prompt and prompt.strip
                 desire_priority = desire.get('priority', 'N/A')
                 desires_context += f"- **Desire #{desire_id}**: {desire_desc} (Priorità: {desire_priority})\n"
 
-            # Prepara i parametri per la chiamata LLM
-            messages = st.session_state.believer_chat_history.copy()
-
-            # Aggiorna il messaggio di sistema per includere i desire
-            system_prompt = BELIEVER_SYSTEM_PROMPT + desires_context
+            # Prepara i parametri per la chiamata LLM (cronologia compattata se troppo lunga)
+            compactor = HistoryCompactor(
+                "believer",
+                st.session_state.llm_manager,
+                st.session_state.session_manager.get_session_path(
+                    st.session_state.active_session, summary_file_name("believer")
+                )
+            )
+            compacted_history = compactor.compact(
+                st.session_state.believer_chat_history, provider, model, pinned_context=desires_context
+            )
+            messages = compacted_history['messages']
+            system_prompt = BELIEVER_SYSTEM_PROMPT + compacted_history['system_addendum']
 
             # Get LLM settings from session
             llm_settings = active_session_data['config'].get('llm_settings', {})
@@ -1094,7 +1075,8 @@ if st.session_state.believer_specialized_chat_active and prompt and prompt.strip
                 'provider': provider,
                 'model': model,
                 'messages': messages,
-                'system_prompt': system_prompt
+                'system_prompt': system_prompt,
+                'agent': 'believer'
             }
 
             # Aggiungi parametri custom solo se use_defaults è False
@@ -1112,8 +1094,13 @@ if st.session_state.believer_specialized_chat_active and prompt and prompt.strip
                 if model and model.startswith('gpt-5'):
                     chat_params['reasoning_effort'] = llm_settings.get('reasoning_effort', 'medium')
 
-            # Chiama l'LLM
-            response = st.session_state.llm_manager.chat(**chat_params)
+            # Chiama l'LLM (streaming: la risposta viene mostrata mentre arriva)
+            with st.chat_message("assistant"):
+                response_stream = st.session_state.llm_manager.chat_stream(**chat_params)
+                st.write_stream(response_stream)
+                if response_stream.rerouted:
+                    st.caption(f"↪️ Answered by {response_stream.provider} / {response_stream.model} ({response_stream.route})")
+            response = response_stream.text
 
             # Aggiungi la risposta alla chat history
             st.session_state.believer_chat_history.append({
@@ -1121,10 +1108,6 @@ if st.session_state.believer_specialized_chat_active and prompt and prompt.strip
                 "content": response
             })
 
-            # Mostra la risposta
-            with st.chat_message("assistant"):
-                st.markdown(response)
-
             # Visualizzazione compressa del RAG context e Desires
             with st.expander("📚 Context & Desires Details", expanded=False):
                 if st.session_state.loaded_desires:
@@ -1145,6 +1128,31 @@ if st.session_state.believer_specialized_chat_active and prompt and prompt.strip
                 else:
                     st.info("No base beliefs available")
 
+            # Revisione dell'Auditor in background (solo sui turni campionati o di finalizzazione):
+            # la card compare dopo il rerun, appena la revisione è pronta
+            st.session_state.believer_suggestions = []
+            auditor = st.session_state.get("belief_auditor")
+            if auditor and provider and model and auditor.should_review(
+                "believer", st.session_state.believer_chat_history, BELIEVER_EXPECTED_OUTCOME, prompt, response
+            ):
+                auditor.submit_review(
+                    len(st.session_state.believer_chat_history) - 1,
+                    provider=provider,
+                    model=model,
+                    conversation=[msg.copy() for msg in st.session_state.believer_chat_history],
+                    module_name="believer",
+                    module_goal=BELIEVER_MODULE_GOAL,
+                    expected_outcome=BELIEVER_EXPECTED_OUTCOME,
+                    context_summary={
+                        "session_name": active_session_data['metadata'].get('name'),
+                        "context_name": active_session_data['config'].get('context'),
+                        "desire_count": len(st.session_state.loaded_desires or []),
+                        "base_belief_count": len(st.session_state.base_beliefs_available or []),
+                    },
+                    last_user_message=prompt,
+                    assistant_message=response,
+                )
+
         except Exception as e:
             error_msg = f"❌ Chat error: {str(e)}"
             st.error(error_msg)
@@ -1246,7 +1254,8 @@ Let's start exploring your knowledge base to identify relevant beliefs. Tell me,
                         'provider': provider,
                         'model': model,
                         'messages': [{"role": "user", "content": mix_prompt}],
-                        'system_prompt': None  # Nessun system prompt, tutto è nel prompt utente
+                        'system_prompt': None,  # Nessun system prompt, tutto è nel prompt utente
+                        'agent': 'believer'
                     }
 
                     # Aggiungi parametri custom solo se use_defaults è False
@@ -1284,11 +1293,15 @@ Here's the result:
                     })
 
                     # --- LOGICA DI PARSING JSON SPOSTATA QUI ---
-                    json_match = re.search(r'```json(.*?)```', mix_response, re.DOTALL) or re.search(r'\{[\s\S]*\}', mix_response)
-                    if json_match:
+                    # Parsing condiviso con riparazione mirata della parte finale se il JSON è troncato
+                    try:
+                        parsed_json = st.session_state.llm_manager.parse_structured(
+                            mix_response, provider, model, agent='believer'
+                        )["data"]
+                    except StructuredOutputError:
+                        parsed_json = None
+                    if parsed_json:
                         try:
-                            json_str = json_match.group(1).strip() if '```' in json_match.group(0) else json_match.group(0).strip()
-                            parsed_json = json.loads(json_str)
 
                             if "beliefs" in parsed_json and isinstance(parsed_json["beliefs"], list):
                                 extracted_beliefs = []
@@ -1308,10 +1321,7 @@ Here's the result:
 
                                 if extracted_beliefs:
                                     st.session_state.beliefs.extend(extracted_beliefs)
-                                    st.session_state.session_manager.update_bdi_data(
-                                        st.session_state.active_session,
-                                        beliefs=st.session_state.beliefs
-                                    )
+                                    append_beliefs_to_bdi(extracted_beliefs)
                                     st.success(f"✅ Automatic mix completed! {len(extracted_beliefs)} new beliefs added.")
                                 else:
                                     st.warning("⚠️ JSON received, but no valid beliefs found.")
@@ -1332,11 +1342,15 @@ Here's the result:
                     })
 
                     # --- LOGICA DI PARSING JSON SPOSTATA QUI ---
-                    json_match = re.search(r'```json(.*?)```', mix_response, re.DOTALL) or re.search(r'\{[\s\S]*\}', mix_response)
-                    if json_match:
+                    # Parsing condiviso con riparazione mirata della parte finale se il JSON è troncato
+                    try:
+                        parsed_json = st.session_state.llm_manager.parse_structured(
+                            mix_response, provider, model, agent='believer'
+                        )["data"]
+                    except StructuredOutputError:
+                        parsed_json = None
+                    if parsed_json:
                         try:
-                            json_str = json_match.group(1).strip() if '```' in json_match.group(0) else json_match.group(0).strip()
-                            parsed_json = json.loads(json_str)
 
                             if "beliefs" in parsed_json and isinstance(parsed_json["beliefs"], list):
                                 extracted_beliefs = []
@@ -1356,10 +1370,7 @@ Here's the result:
 
                                 if extracted_beliefs:
                                     st.session_state.beliefs.extend(extracted_beliefs)
-                                    st.session_state.session_manager.update_bdi_data(
-                                        st.session_state.active_session,
-                                        beliefs=st.session_state.beliefs
-                                    )
+                                    append_beliefs_to_bdi(extracted_beliefs)
                                     st.success(f"✅ Automatic mix completed! {len(extracted_beliefs)} new beliefs added.")
                                 else:
                                     st.warning("⚠️ JSON received, but no valid beliefs found.")
@@ -1372,3 +1383,6 @@ Here's the result:
                         st.markdown(response)
 
             st.stop()
+
+# Registra nel log della sessione i messaggi di questo rerun (se non è seguito da st.rerun)
+sync_chat_log("believer")
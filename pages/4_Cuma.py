@@ -1,8 +1,6 @@
 import streamlit as st
 import os
 import sys
-import json
-from datetime import datetime
 import re
 
 # Aggiungi la directory parent al path
@@ -10,8 +8,11 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utils.prompts import get_prompt
 from utils.session_manager import SessionManager
-from utils.auditor import ConversationAuditor
+from utils.auditor import ConversationAuditor, merge_audit_results
 from utils.ui_messages import get_random_thinking_message
+from utils.chat_page import render_audit_poller, sync_chat_log
+from utils.history_manager import HistoryCompactor, summary_file_name
+from utils.structured_output import extract_json
 
 CUMA_MODULE_GOAL = (
     "Map multiple possible strategic Intentions for a specific domain, helping domain "
@@ -35,6 +36,7 @@ if 'session_manager' not in st.session_state:
 
 if 'cuma_chat_history' not in st.session_state:
     st.session_state.cuma_chat_history = []
+    st.session_state.cuma_chat_logged = 0
     st.session_state.cuma_greeted = False
 
 if 'intentions_list' not in st.session_state:
@@ -265,11 +267,10 @@ def extract_intention_from_response(response_text):
 # Se non c'è active_session, prova a caricare l'ultima sessione attiva
 if 'active_session' not in st.session_state or not st.session_state.active_session:
     # Fallback: carica l'ultima sessione attiva disponibile
-    all_sessions = st.session_state.session_manager.get_all_sessions(status="active")
-    if all_sessions:
-        # Usa la più recentemente acceduta
-        latest_session = max(all_sessions, key=lambda s: s['metadata'].get('last_accessed', ''))
-        st.session_state.active_session = latest_session['session_id']
+    # Usa la più recentemente acceduta (le sessioni sono ordinate per last_accessed)
+    latest_sessions = st.session_state.session_manager.list_sessions(status="active", limit=1)
+    if latest_sessions:
+        st.session_state.active_session = latest_sessions[0]['session_id']
 
 # CONTROLLO SESSIONE OBBLIGATORIO
 if 'active_session' not in st.session_state or not st.session_state.active_session:
@@ -339,6 +340,9 @@ with st.sidebar:
         from utils.llm_manager import LLMManager
         st.session_state.llm_manager = LLMManager()
 
+    # La telemetria delle chiamate LLM viene scritta nella sessione attiva
+    st.session_state.llm_manager.set_telemetry_session(st.session_state.get('active_session'))
+
     if 'intention_auditor' not in st.session_state:
         st.session_state.intention_auditor = ConversationAuditor(
             st.session_state.llm_manager,
@@ -399,11 +403,14 @@ with st.sidebar:
     with col_new:
         if st.button("🔄 New Conversation", width='stretch'):
             st.session_state.cuma_chat_history = []
+            st.session_state.cuma_chat_logged = 0
             st.session_state.cuma_greeted = False
             st.session_state.intentions_list = []
             st.session_state.cuma_audit_trail = []
             st.session_state.cuma_suggestions = []
             st.session_state.cuma_pending_prompt = None
+            if st.session_state.get("intention_auditor"):
+                st.session_state.intention_auditor.discard_reviews()
             st.rerun()
 
     with col_complete:
@@ -478,6 +485,18 @@ if not st.session_state.cuma_greeted:
     st.session_state.cuma_greeted = True
 
 
+# Raccoglie le revisioni dell'Auditor concluse in background
+cuma_auditor = st.session_state.get("intention_auditor")
+if cuma_auditor:
+    merged_audits, audit_error = merge_audit_results(st.session_state.cuma_audit_trail, cuma_auditor.collect_reviews())
+    last_index = len(st.session_state.cuma_chat_history) - 1
+    if last_index in merged_audits:
+        st.session_state.cuma_suggestions = (merged_audits[last_index].get("suggested_user_replies") or [])[:3]
+    if audit_error:
+        st.warning(f"Auditor not available: {audit_error}")
+
+cuma_pending_audits = set(cuma_auditor.pending_reviews()) if cuma_auditor else set()
+
 # Display chat history
 cuma_audit_map = {
     item["message_index"]: item.get("result", {})
@@ -485,6 +504,9 @@ cuma_audit_map = {
     if isinstance(item, dict) and "message_index" in item
 }
 
+# Registra nel log della sessione i messaggi aggiunti dal rerun precedente
+sync_chat_log("cuma")
+
 for idx, message in enumerate(st.session_state.cuma_chat_history):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
@@ -542,6 +564,12 @@ for idx, message in enumerate(st.session_state.cuma_chat_history):
             confidence = audit_payload.get("confidence")
             if confidence:
                 st.caption(f"Assessment confidence: {confidence}")
+    elif message.get("role") == "assistant" and idx in cuma_pending_audits:
+        with st.chat_message("system"):
+            st.caption("⏳ Auditor review in progress...")
+
+if cuma_pending_audits:
+    render_audit_poller(cuma_auditor)
 
 # Funzione per gestire la risposta dell'AI
 def get_ai_system_context():
@@ -587,19 +615,13 @@ def process_ai_response(response):
 
     # Cerca di estrarre il JSON dalla risposta
     if "json" in response.lower() or "{" in response:
-        json_match = re.search(r'\{[\s\S]*\}', response)
-        if json_match:
-            try:
-                json_str = json_match.group()
-                parsed_json = json.loads(json_str)
-                if "intentions" in parsed_json:
-                    st.session_state.intentions_list = parsed_json["intentions"]
-                    st.success("✅ JSON report extracted successfully!")
-                else:
-                    if parsed_json and parsed_json not in st.session_state.intentions_list:
-                        st.session_state.intentions_list.append(parsed_json)
-            except json.JSONDecodeError:
-                pass
+        parsed_json = extract_json(response, expect=dict)
+        if parsed_json:
+            if "intentions" in parsed_json:
+                st.session_state.intentions_list = parsed_json["intentions"]
+                st.success("✅ JSON report extracted successfully!")
+            elif parsed_json not in st.session_state.intentions_list:
+                st.session_state.intentions_list.append(parsed_json)
 
     return True
 
@@ -633,19 +655,41 @@ def handle_ai_response(user_message):
             provider = active_session_data['config'].get('llm_provider', 'Gemini')
             model = active_session_data['config'].get('llm_model', 'gemini-2.5-pro')
 
-            response = st.session_state.llm_manager.chat(
-                provider=provider,
-                model=model,
-                messages=st.session_state.cuma_chat_history,
-                system_prompt=system_with_context
+            # Il placeholder "thinking" (ultimo messaggio) non viene inviato al modello;
+            # la cronologia troppo lunga viene compattata in un riassunto
+            compactor = HistoryCompactor(
+                "cuma",
+                st.session_state.llm_manager,
+                st.session_state.session_manager.get_session_path(
+                    st.session_state.active_session, summary_file_name("cuma")
+                )
             )
+            compacted_history = compactor.compact(st.session_state.cuma_chat_history[:-1], provider, model)
+
+            # Streaming: la risposta viene mostrata mentre arriva
+            with st.chat_message("assistant"):
+                response_stream = st.session_state.llm_manager.chat_stream(
+                    provider=provider,
+                    model=model,
+                    messages=compacted_history['messages'],
+                    system_prompt=system_with_context + compacted_history['system_addendum'],
+                    agent="cuma"
+                )
+                st.write_stream(response_stream)
+                if response_stream.rerouted:
+                    st.caption(f"↪️ Answered by {response_stream.provider} / {response_stream.model} ({response_stream.route})")
+            response = response_stream.text
 
             processed = process_ai_response(response)
 
             if processed:
-                auditor_result = None
+                # Revisione dell'Auditor in background (solo sui turni campionati o di finalizzazione):
+                # la card compare dopo il rerun, appena la revisione è pronta
+                st.session_state.cuma_suggestions = []
                 auditor = st.session_state.get("intention_auditor")
-                if auditor and provider and model:
+                if auditor and provider and model and auditor.should_review(
+                    "cuma", st.session_state.cuma_chat_history, CUMA_EXPECTED_OUTCOME, user_message, response
+                ):
                     context_summary = {
                         "session_name": active_session_data['metadata'].get('name'),
                         "context_name": active_session_data['config'].get('context'),
@@ -653,44 +697,18 @@ def handle_ai_response(user_message):
                         "belief_count": len(st.session_state.loaded_beliefs),
                         "intention_count": len(st.session_state.intentions_list),
                     }
-                    try:
-                        auditor_result = auditor.review(
-                            provider=provider,
-                            model=model,
-                            conversation=[msg.copy() for msg in st.session_state.cuma_chat_history],
-                            module_name="cuma",
-                            module_goal=CUMA_MODULE_GOAL,
-                            expected_outcome=CUMA_EXPECTED_OUTCOME,
-                            context_summary=context_summary,
-                            last_user_message=user_message,
-                            assistant_message=response,
-                        )
-                    except Exception as audit_exc:  # pylint: disable=broad-except
-                        auditor_result = {"error": str(audit_exc)}
-
-                if auditor_result and "error" not in auditor_result:
-                    message_index = len(st.session_state.cuma_chat_history) - 1
-                    existing_entry = next(
-                        (item for item in st.session_state.cuma_audit_trail if item.get("message_index") == message_index),
-                        None
+                    auditor.submit_review(
+                        len(st.session_state.cuma_chat_history) - 1,
+                        provider=provider,
+                        model=model,
+                        conversation=[msg.copy() for msg in st.session_state.cuma_chat_history],
+                        module_name="cuma",
+                        module_goal=CUMA_MODULE_GOAL,
+                        expected_outcome=CUMA_EXPECTED_OUTCOME,
+                        context_summary=context_summary,
+                        last_user_message=user_message,
+                        assistant_message=response,
                     )
-                    audit_record = {
-                        "message_index": message_index,
-                        "result": auditor_result,
-                        "timestamp": datetime.now().isoformat()
-                    }
-
-                    if existing_entry:
-                        existing_entry.update(audit_record)
-                    else:
-                        st.session_state.cuma_audit_trail.append(audit_record)
-
-                    st.session_state.cuma_suggestions = (auditor_result.get("suggested_user_replies") or [])[:3]
-                elif auditor_result and "error" in auditor_result:
-                    st.session_state.cuma_suggestions = []
-                    st.warning(f"Auditor not available: {auditor_result['error']}")
-                else:
-                    st.session_state.cuma_suggestions = []
 
                 st.rerun()
 
@@ -748,3 +766,6 @@ prompt = auto_prompt or user_input
 
 if prompt:
     handle_ai_response(prompt)
+
+# Registra nel log della sessione i messaggi di questo rerun (se non è seguito da st.rerun)
+sync_chat_log("cuma")
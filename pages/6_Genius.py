@@ -15,6 +15,7 @@ Flow:
 import streamlit as st
 import os
 from utils.genius_engine import GeniusEngine
+from utils.atomic_json import RevisionConflictError, content_revision
 from utils.llm_manager import LLMManager
 from utils.prompts import get_prompt
 from utils.ui_messages import get_random_thinking_message
@@ -163,14 +164,22 @@ with st.sidebar:
                     if new_status != is_completed:
                         target_status = 'completed' if new_status else 'pending'
 
-                        # Update plan
-                        success = genius_engine.update_plan_progress(
-                            plan_id=plan['plan_id'],
-                            step_id=step_id,
-                            new_status=target_status,
-                            user_notes="",
-                            session_id=None
-                        )
+                        # Update plan (the revision of the displayed plan detects changes from other tabs)
+                        try:
+                            success = genius_engine.update_plan_progress(
+                                plan_id=plan['plan_id'],
+                                step_id=step_id,
+                                new_status=target_status,
+                                user_notes="",
+                                session_id=None,
+                                expected_revision=content_revision(plan)
+                            )
+                        except RevisionConflictError:
+                            # Nessuna sovrascrittura: si ricarica il piano e si annulla il click
+                            st.session_state.genius_generated_plan = genius_engine.load_plan(plan['plan_id'], session_id=None) or plan
+                            del st.session_state[checkbox_key]
+                            st.warning("⚠️ The plan was modified in another tab: reloaded the latest version, please retry.")
+                            success = False
 
                         if success:
                             # Reload plan
@@ -325,8 +334,8 @@ if st.session_state.genius_phase == "bdi_selection":
             **How to do it:**
             1. Go to **Compass**
             2. Load a session with complete BDI (Desires + Beliefs)
-            3. Use the "Export as Framework" function (coming soon)
-            4. Or manually copy the `current_bdi.json` file to the `data/bdi_frameworks/` folder
+            3. Use the "Export as Framework" button in the sidebar
+            4. Or copy the `current_bdi.json` file of an exported session to the `data/bdi_frameworks/` folder
             """)
 
             if st.button("🧭 Go to Compass", width='stretch'):
@@ -505,15 +514,25 @@ elif st.session_state.genius_phase in ["desire_customization", "context_gatherin
                     # Extract settings
                     llm_settings = st.session_state.genius_llm_settings
 
-                    response = llm_manager.chat(
+                    # Streaming: il testo viene mostrato mentre arriva, poi sostituito dalla versione finale
+                    response_placeholder = st.empty()
+                    response_stream = llm_manager.chat_stream(
                         provider=st.session_state.genius_llm_provider,
                         model=st.session_state.genius_llm_model,
                         messages=messages,
                         temperature=llm_settings.get("temperature", 0.7),
                         max_tokens=llm_settings.get("max_tokens", 2000),
                         top_p=llm_settings.get("top_p", 0.9),
-                        reasoning_effort=llm_settings.get("reasoning_effort", "medium")
+                        reasoning_effort=llm_settings.get("reasoning_effort", "medium"),
+                        agent="genius"
                     )
+                    partial_response = ""
+                    for delta in response_stream:
+                        partial_response += delta
+                        response_placeholder.markdown(partial_response + "▌")
+                    response = response_stream.text
+                    if response_stream.rerouted:
+                        st.caption(f"↪️ Answered by {response_stream.provider} / {response_stream.model} ({response_stream.route})")
 
                     # Check for completion signal
                     if "USER_PROFILE_COMPLETE" in response:
@@ -548,7 +567,7 @@ elif st.session_state.genius_phase in ["desire_customization", "context_gatherin
                                 break
 
                     # Display response
-                    st.markdown(response)
+                    response_placeholder.markdown(response)
 
                     # Add to history
                     st.session_state.genius_messages.append({
@@ -574,6 +593,17 @@ elif st.session_state.genius_phase == "plan_generation":
 
         with st.spinner("Generating your personalized action plan... This may take 30-60 seconds."):
             try:
+                # Gli step generati vengono mostrati man mano che arrivano
+                steps_placeholder = st.empty()
+                generated_steps = []
+
+                def show_step(step):
+                    generated_steps.append(step)
+                    steps_placeholder.markdown(
+                        f"**{len(generated_steps)} steps generated**\n\n" +
+                        "\n".join(f"- {s.get('step_id', '')} {s.get('description', '')}" for s in generated_steps)
+                    )
+
                 # Generate plan structure via LLM
                 plan_structure = genius_engine.generate_plan_structure(
                     llm_manager=llm_manager,
@@ -581,7 +611,8 @@ elif st.session_state.genius_phase == "plan_generation":
                     desire_id=st.session_state.genius_selected_desire,
                     user_profile=st.session_state.genius_user_profile,
                     llm_provider=st.session_state.genius_llm_provider,
-                    llm_model=st.session_state.genius_llm_model
+                    llm_model=st.session_state.genius_llm_model,
+                    on_step=show_step
                 )
 
                 if plan_structure:
@@ -106,6 +106,8 @@ def main():
     print("🎯 Prossimi passi:")
     print("   1. Avvia LUMIA Studio: streamlit run app.py")
     print("   2. Il modello sarà caricato istantaneamente dalla cache locale")
+    print("      (in background all'avvio dell'app, una sola volta per processo;")
+    print("       imposta LUMIA_EMBEDDINGS_WARMUP=0 per disattivare il warm-up)")
     print()
     print("💡 Note:")
     print("   • Il download è necessario solo la prima volta")
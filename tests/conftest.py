@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Rende importabile il package utils quando pytest viene lanciato da qualsiasi directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,51 @@
+"""Tests for the local pre-audit scorer (utils/audit_scorer.py)"""
+
+import pytest
+
+from utils import audit_scorer
+from utils.audit_scorer import LocalAuditScorer
+
+REPLY = "Here is a complete answer to your question about the retention strategy"
+
+
+def truncation_flagged(text):
+    result = LocalAuditScorer().score(text)
+    return any(issue["message"] == "The reply looks truncated." for issue in result["issues"])
+
+
+@pytest.mark.parametrize("ending", [
+    ".", "?", " 🎉", " ✅", " ⭐", " ❤️", " 👍🏽", " #️⃣", "\n\n**Next step: define the KPI**",
+    " `gpt-5`", " _emphasis_", " ~~old~~", " “quoted”", " (see above)"
+])
+def test_complete_endings_are_not_truncated(ending):
+    assert not truncation_flagged(REPLY + ending)
+
+
+@pytest.mark.parametrize("ending", [" and the", ",", " the KPI is 4"])
+def test_cut_replies_are_truncated(ending):
+    assert truncation_flagged(REPLY + ending)
+
+
+class FakeService:
+    def __init__(self):
+        self.transient = []
+
+    def embed_documents(self, texts):
+        raise AssertionError("the conversation must not go through the persistent embedding cache")
+
+    def embed_transient(self, texts):
+        self.transient.append(list(texts))
+        return [[1.0, 0.0] for _ in texts]
+
+
+def test_similarity_uses_transient_embeddings(monkeypatch):
+    service = FakeService()
+    monkeypatch.setattr(audit_scorer, "get_embedding_service", lambda backend: service)
+
+    result = LocalAuditScorer().score(
+        REPLY + ".", last_user_message="What about retention?", rag_context=["chunk about retention"]
+    )
+
+    assert service.transient == [[REPLY + ".", "What about retention?", "chunk about retention"]]
+    assert result["rubric"]["relevance"] == 1.0
+    assert result["rubric"]["grounding"] == 1.0
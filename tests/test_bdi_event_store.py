@@ -0,0 +1,47 @@
+"""Tests for the event-sourced BDI store (utils/bdi_event_store.py)"""
+
+from utils.bdi_event_store import BdiEventStore
+from utils.session_store import JsonSessionStore
+
+SESSION = "session_1"
+
+
+def make_store(tmp_path):
+    return BdiEventStore(tmp_path, JsonSessionStore(tmp_path))
+
+
+def add_desire(desire_id, description):
+    def build(state):
+        state.setdefault("desires", []).append({"desire_id": desire_id, "description": description})
+        return state
+    return build
+
+
+def test_commit_after_torn_write_repairs_the_segment(tmp_path):
+    store = make_store(tmp_path)
+    store.commit(SESSION, add_desire("D1", "Reduce churn"))
+    segment = store._segments(SESSION)[-1]
+
+    # Crash a metà di un append: ultima riga senza newline
+    with open(segment, "a", encoding="utf-8") as f:
+        f.write('{"seq": 3, "ts": "2026-01-01T00:00:00", "op": "add", "coll')
+
+    state, _ = store.commit(SESSION, add_desire("D2", "Grow revenue"))
+
+    assert [d["desire_id"] for d in state["desires"]] == ["D1", "D2"]
+    reopened = make_store(tmp_path)
+    assert reopened.materialize(SESSION) == state
+    assert segment.read_bytes().endswith(b"\n")
+
+
+def test_undecodable_lines_are_skipped(tmp_path):
+    store = make_store(tmp_path)
+    store.commit(SESSION, add_desire("D1", "Reduce churn"))
+    segment = store._segments(SESSION)[-1]
+    with open(segment, "a", encoding="utf-8") as f:
+        f.write('{"seq": 2, "op": "add", "coll{"seq": 2, "op": "set"}\n')
+
+    reopened = make_store(tmp_path)
+
+    assert [d["desire_id"] for d in reopened.materialize(SESSION)["desires"]] == ["D1"]
+    assert len(reopened.history(SESSION)) == 1
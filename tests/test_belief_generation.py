@@ -0,0 +1,74 @@
+"""Tests for the Believer from-scratch generation flow (utils/belief_generation.py)"""
+
+from utils.belief_generation import generate_beliefs_from_scratch
+
+
+class FakeDocProcessor:
+    """query_many returning two desires that share one chunk (as DocumentProcessor with deduplicate=True)"""
+
+    def __init__(self):
+        self.queries = []
+
+    def query_many(self, query_texts, n_results=5):
+        self.queries.append((list(query_texts), n_results))
+        return [
+            {"ids": ["c1", "c2"], "documents": ["chunk one", "chunk two"], "metadatas": [{}, {}],
+             "distances": [0.1, 0.2], "shared": []},
+            {"ids": ["c3"], "documents": ["chunk three"], "metadatas": [{}],
+             "distances": [0.3], "shared": [{"id": "c2", "owner": 0}]}
+        ]
+
+
+class FakeLLMManager:
+    def __init__(self, beliefs):
+        self.beliefs = beliefs
+        self.prompts = []
+
+    def chat_structured(self, provider, model, messages, item_keys=None, on_item=None, **kwargs):
+        self.prompts.append(messages[0]["content"])
+        for belief in self.beliefs:
+            on_item("beliefs", belief)
+        return {"data": {"beliefs": self.beliefs}, "text": "", "items": [], "repaired": None}
+
+
+DESIRES = [
+    {"id": "D1", "description": "Reduce churn", "priority": "high"},
+    {"id": "D2", "description": "Grow revenue", "priority": "medium"}
+]
+
+
+def test_generation_summary_counts_distinct_chunks():
+    doc_processor = FakeDocProcessor()
+    llm_manager = FakeLLMManager([{"subject": "a"}, {"subject": "b"}])
+    progress = []
+
+    result = generate_beliefs_from_scratch(
+        doc_processor, llm_manager, "Gemini", "gemini-2.5-flash",
+        DESIRES, existing_beliefs=[{"id": 4}],
+        on_progress=lambda status, details: progress.append(status)
+    )
+
+    # Una sola query batch per tutti i desire
+    assert doc_processor.queries == [(["Reduce churn", "Grow revenue"], 10)]
+    assert result["chunks_processed"] == 3
+    assert [belief["id"] for belief in result["beliefs"]] == [5, 6]
+    assert all("timestamp" in belief for belief in result["beliefs"])
+    assert "- Chunks processed: 3" in result["summary"]
+    assert "- Desires analyzed: 2" in result["summary"]
+    assert "2 new beliefs added" in result["summary"]
+    assert result["query_details"][1] == "- Desire D2: 2 chunks found (1 shared with other desires)"
+    assert progress[-1] == "🤖 2 beliefs received..."
+
+    prompt = llm_manager.prompts[0]
+    assert "**Desire D1**: Reduce churn (Priority: high)" in prompt
+    assert prompt.count("chunk two") == 1
+    assert "*Also relevant: 1 chunk(s) listed under Desire D1*" in prompt
+
+
+def test_generation_without_beliefs_has_no_summary():
+    result = generate_beliefs_from_scratch(
+        FakeDocProcessor(), FakeLLMManager([]), "Gemini", "gemini-2.5-flash", DESIRES, existing_beliefs=[]
+    )
+
+    assert result["beliefs"] == []
+    assert result["summary"] is None
@@ -0,0 +1,39 @@
+"""Tests for the segmented chat logs (utils/chat_log.py)"""
+
+from utils.chat_log import ChatLogStore
+
+SESSION = "session_1"
+
+
+def message(i):
+    return {"role": "user" if i % 2 else "assistant", "content": f"message {i}"}
+
+
+def test_append_after_torn_write_repairs_the_segment(tmp_path):
+    store = ChatLogStore(tmp_path, segment_max_messages=5)
+    log = store.get(SESSION, "ali")
+    log.append([message(i) for i in range(1, 4)])
+
+    # Crash a metà di un append: ultima riga senza newline
+    segment = log.log_dir / log._load_index()["segments"][-1]["file"]
+    with open(segment, "a", encoding="utf-8") as f:
+        f.write('{"seq": 4, "ts": "2026-01-01T00:00:00", "role": "us')
+
+    assert log.append([message(i) for i in range(4, 8)]) == 7
+
+    assert [m["seq"] for m in log.read_page()] == list(range(1, 8))
+    assert [m["content"] for m in log.iter_messages()] == [f"message {i}" for i in range(1, 8)]
+    assert log.count() == 7
+    assert [m["seq"] for m in store.iter_session(SESSION)] == list(range(1, 8))
+
+
+def test_undecodable_lines_are_skipped(tmp_path):
+    log = ChatLogStore(tmp_path).get(SESSION, "believer")
+    log.append([message(1)])
+    segment = log.log_dir / log._load_index()["segments"][-1]["file"]
+    with open(segment, "a", encoding="utf-8") as f:
+        f.write('{"seq": 2, "role": "us{"seq": 2, "role": "user"}\n')
+    log.append([message(3)])
+
+    assert [m["content"] for m in log.read_page()] == ["message 1", "message 3"]
+    assert [m["content"] for m in log.iter_messages()] == ["message 1", "message 3"]
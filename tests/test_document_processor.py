@@ -0,0 +1,54 @@
+"""Tests for the choice between batch and streaming ingestion (utils/document_processor.py)"""
+
+import io
+
+import pytest
+
+PyPDF2 = pytest.importorskip("PyPDF2")
+document_processor = pytest.importorskip("utils.document_processor")
+
+DocumentProcessor = document_processor.DocumentProcessor
+
+
+class UploadedFile(io.BytesIO):
+    """Minimal stand-in for Streamlit's UploadedFile"""
+
+    def __init__(self, name, data, size=None):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data) if size is None else size
+
+
+def make_pdf(pages):
+    writer = PyPDF2.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=72, height=72)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def test_small_pdf_uses_batch_extraction():
+    pdf = UploadedFile("small.pdf", make_pdf(document_processor.STREAMING_THRESHOLD_PAGES))
+    assert not DocumentProcessor._should_stream(pdf)
+
+
+def test_pdf_over_page_threshold_is_streamed_regardless_of_size():
+    data = make_pdf(document_processor.STREAMING_THRESHOLD_PAGES + 1)
+    assert len(data) < document_processor.STREAMING_THRESHOLD_BYTES
+
+    pdf = UploadedFile("long.pdf", data)
+    pdf.seek(5)
+    assert DocumentProcessor._should_stream(pdf)
+    # La posizione di lettura viene ripristinata dopo il conteggio delle pagine
+    assert pdf.tell() == 5
+
+
+def test_pdf_over_size_threshold_is_streamed():
+    pdf = UploadedFile("big.pdf", make_pdf(1), size=document_processor.STREAMING_THRESHOLD_BYTES + 1)
+    assert DocumentProcessor._should_stream(pdf)
+
+
+def test_non_pdf_and_unreadable_pdf_are_not_streamed():
+    assert not DocumentProcessor._should_stream(UploadedFile("notes.txt", b"x" * 10))
+    assert not DocumentProcessor._should_stream(UploadedFile("broken.pdf", b"not a pdf"))
@@ -0,0 +1,82 @@
+"""Tests for the chat history compaction (utils/history_manager.py)"""
+
+from utils.history_manager import HistoryCompactor
+
+DESIRES = "\n## DESIRES DELL'UTENTE:\n- **Desire #1**: Reduce churn (Priorità: high)\n"
+
+
+class FakeLLMManager:
+    def __init__(self):
+        self.prompts = []
+
+    def chat(self, provider, model, messages, **kwargs):
+        self.prompts.append(messages[0]["content"])
+        return "User wants to reduce churn."
+
+
+def make_history(turns):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"question {i} " + "x" * 400})
+        history.append({"role": "assistant", "content": f"answer {i} " + "y" * 400})
+    return history
+
+
+def test_pinned_context_is_sent_once_without_compaction():
+    compactor = HistoryCompactor("believer", FakeLLMManager(), config={"max_history_tokens": 10_000})
+
+    compacted = compactor.compact(make_history(2), "Anthropic", "model", pinned_context=DESIRES)
+
+    assert not compacted["compacted"]
+    assert compacted["system_addendum"] == DESIRES
+
+
+def test_pinned_context_precedes_summary_and_is_left_out_of_it():
+    llm = FakeLLMManager()
+    compactor = HistoryCompactor(
+        "believer", llm, config={"max_history_tokens": 100, "keep_last_turns": 1, "pinned_artefacts": 0}
+    )
+
+    compacted = compactor.compact(make_history(4), "Anthropic", "model", pinned_context=DESIRES)
+
+    assert compacted["compacted"]
+    assert compacted["system_addendum"].startswith(DESIRES)
+    assert compacted["system_addendum"].count("Reduce churn") == 1
+    assert len(compacted["messages"]) == 2
+    assert "do not repeat it in the summary" in llm.prompts[0]
+
+
+class FailingLLMManager:
+    def chat(self, provider, model, messages, **kwargs):
+        raise RuntimeError("provider unavailable")
+
+
+COMPACT_CONFIG = {"max_history_tokens": 100, "keep_last_turns": 1, "pinned_artefacts": 0}
+
+
+def test_failed_summary_sends_the_full_history():
+    history = make_history(10)
+    compactor = HistoryCompactor("believer", FailingLLMManager(), config=COMPACT_CONFIG)
+
+    compacted = compactor.compact(history, "Anthropic", "model", pinned_context=DESIRES)
+
+    assert not compacted["compacted"]
+    assert [m["content"] for m in compacted["messages"]] == [m["content"] for m in history]
+    assert compacted["system_addendum"] == DESIRES
+
+
+def test_failed_summary_update_keeps_uncovered_turns_verbatim(tmp_path):
+    summary_path = tmp_path / "history_summary_believer.json"
+    history = make_history(10)
+    HistoryCompactor("believer", FakeLLMManager(), summary_path, COMPACT_CONFIG).compact(
+        history[:8], "Anthropic", "model"
+    )
+
+    compacted = HistoryCompactor("believer", FailingLLMManager(), summary_path, COMPACT_CONFIG).compact(
+        history, "Anthropic", "model"
+    )
+
+    # Il riassunto copre i primi 6 messaggi, gli altri arrivano integrali
+    assert compacted["compacted"]
+    assert "User wants to reduce churn." in compacted["system_addendum"]
+    assert [m["content"] for m in compacted["messages"]] == [m["content"] for m in history[6:]]
@@ -0,0 +1,31 @@
+"""Tests for the session storage backends (utils/session_store.py)"""
+
+import pytest
+
+from utils.session_store import JsonSessionStore, SessionStore, SqliteSessionStore
+
+
+def test_incomplete_backend_fails_at_creation():
+    class PartialStore(SessionStore):
+        def exists(self, session_id):
+            return False
+
+    with pytest.raises(TypeError):
+        PartialStore()
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_backends_store_documents(tmp_path, backend):
+    if backend == "json":
+        store = JsonSessionStore(tmp_path / "sessions")
+    else:
+        store = SqliteSessionStore(str(tmp_path / "sessions.sqlite3"), tmp_path / "sessions")
+
+    store.create("s1", {"session_id": "s1", "status": "active"}, {"llm_settings": {}},
+                 {"current_bdi.json": {"desires": []}})
+    store.save_document("s1", "belief_base.json", {"beliefs_base": []})
+
+    assert store.exists("s1")
+    assert store.get_document("s1", "current_bdi.json") == {"desires": []}
+    assert store.get_document("s1", "belief_base.json") == {"beliefs_base": []}
+    assert store.count_sessions() == 1
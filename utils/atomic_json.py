@@ -0,0 +1,228 @@
+"""
+Atomic JSON persistence - Shared safe writes for the JSON files of LUMIA Studio
+
+This module handles:
+- Atomic writes: the document is written to a temporary file in the same
+  directory, flushed to disk and moved over the target with os.replace,
+  so readers never see a truncated file
+- Per-file advisory locks (a ".<name>.lock" file next to the target,
+  fcntl on POSIX, msvcrt on Windows) plus an in-process lock per path
+- Optimistic versioning: the revision of a document is a hash of its
+  content; read-modify-write updates given an expected revision fail
+  with RevisionConflictError instead of overwriting a concurrent change
+- Invalidation of the in-process metadata cache (utils/metadata_cache.py)
+  for every file written here
+- Recovery of append-only JSONL logs: truncating a torn last line left by
+  a crash before the next append, and decoding the lines of a log while
+  skipping the undecodable ones
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+from utils.metadata_cache import get_metadata_cache
+
+
+class RevisionConflictError(Exception):
+    """Raised when a document changed after the revision the caller read"""
+
+    def __init__(self, path: str, expected: Optional[str], actual: Optional[str]):
+        super().__init__(
+            f"{path} was modified by another writer (expected revision {expected}, found {actual})"
+        )
+        self.path = path
+        self.expected = expected
+        self.actual = actual
+
+
+_registry_lock = threading.Lock()
+_path_locks: Dict[str, threading.RLock] = {}
+
+
+def content_revision(data: Any) -> Optional[str]:
+    """Revision of a JSON document: hash of its canonical serialization (None when missing)"""
+    if data is None:
+        return None
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _thread_lock(path: str) -> threading.RLock:
+    key = os.path.abspath(path)
+    with _registry_lock:
+        return _path_locks.setdefault(key, threading.RLock())
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """
+    Holds the advisory lock of a file for the duration of the block
+
+    The lock is taken on a ".<name>.lock" file in the same directory, so
+    it survives the os.replace of the target. Re-entrant within a thread.
+    """
+    path = str(path)
+    directory, name = os.path.split(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    with _thread_lock(path):
+        with open(os.path.join(directory, f".{name}.lock"), "a+") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                elif msvcrt is not None:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_json(path: str, default: Any = None) -> Any:
+    """Loads a JSON file, returning default when it does not exist"""
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_json_versioned(path: str) -> Tuple[Any, Optional[str]]:
+    """
+    Loads a JSON file together with its revision
+
+    Returns:
+        (data, revision), (None, None) when the file does not exist
+    """
+    data = read_json(path)
+    return data, content_revision(data)
+
+
+def write_text_atomic(path: str, text: str):
+    """Writes a text file atomically: temporary file in the same directory, fsync, os.replace"""
+    path = str(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        # Il file originale resta intatto: si elimina solo il temporaneo
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        # Anche una scrittura fallita invalida la voce: il file potrebbe essere cambiato
+        get_metadata_cache().invalidate(path)
+
+
+def write_json_atomic(path: str, data: Any, indent: Optional[int] = 2) -> Optional[str]:
+    """
+    Writes a JSON file atomically (temporary file + os.replace)
+
+    Returns:
+        The revision of the written document
+    """
+    write_text_atomic(path, json.dumps(data, indent=indent, ensure_ascii=False))
+    return content_revision(data)
+
+
+def update_json(
+    path: str,
+    mutate: Callable[[Any], Any],
+    expected_revision: Optional[str] = None,
+    default: Any = None,
+    indent: Optional[int] = 2
+) -> Tuple[Any, Optional[str]]:
+    """
+    Read-modify-write of a JSON file under its lock
+
+    Args:
+        path: JSON file to update
+        mutate: Receives the current data (default when the file is missing)
+            and returns the new data; returning None keeps the in-place changes
+        expected_revision: Revision the caller based its change on; when it
+            differs from the stored one RevisionConflictError is raised
+        default: Data passed to mutate when the file does not exist
+        indent: JSON indentation of the written file
+
+    Returns:
+        (data, revision) of the written document
+    """
+    with file_lock(path):
+        current = read_json(path)
+        actual = content_revision(current)
+        if expected_revision is not None and actual != expected_revision:
+            raise RevisionConflictError(str(path), expected_revision, actual)
+
+        data = current if current is not None else default
+        updated = mutate(data)
+        if updated is None:
+            updated = data
+        return updated, write_json_atomic(path, updated, indent=indent)
+
+
+def truncate_partial_line(path: str, block_size: int = 65536) -> int:
+    """
+    Truncates an append-only JSONL file after its last newline
+
+    To be called under the lock of the log before appending: a line without
+    its newline was torn by a crash and would merge with the next record.
+
+    Returns:
+        Number of bytes removed
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            f.truncate(end)
+            f.flush()
+            os.fsync(f.fileno())
+            print(f"Truncated a partial line ({size - end} bytes) at the end of {path}")
+    return size - end
+
+
+def decode_jsonl_lines(lines: Iterable[Any], source: str = "") -> List[Dict[str, Any]]:
+    """Decodes the non-empty lines of a JSONL log, skipping (and reporting) the undecodable ones"""
+    records = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            print(f"Skipped an undecodable line in {source}: {line[:80]!r}")
+    return records
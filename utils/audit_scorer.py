@@ -0,0 +1,211 @@
+"""
+LocalAuditScorer - Fast local pre-audit of an agent reply
+
+This module handles:
+- Deterministic rubric checks on the reply (length, truncation, unbalanced
+  code fences, malformed JSON, partial structured markers, dialogue progression)
+- Embedding similarity between the reply and the user message (relevance),
+  the RAG context (grounding) and the previous reply (repetition); the
+  conversation is embedded without the persistent embedding cache
+- The escalation decision: the LLM auditor is called only when the local
+  score is below the threshold or the assessment is uncertain
+"""
+
+import re
+import math
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from utils.embedding_service import get_embedding_service, DEFAULT_EMBEDDING_BACKEND
+from utils.structured_output import extract_json
+
+
+# Soglie del pre-audit locale: sotto escalate_below (o entro uncertainty_margin
+# sopra la soglia) la revisione passa all'Auditor LLM
+LOCAL_AUDIT_CONFIG = {
+    "enabled": True,
+    "escalate_below": 0.6,
+    "uncertainty_margin": 0.08,
+    "min_reply_chars": 40,
+    "max_reply_chars": 6000,
+    # Similarità coseno mappata linearmente su [0, 1] tra low e high
+    "relevance_range": (0.15, 0.5),
+    "grounding_range": (0.25, 0.55),
+    "repetition_similarity": 0.95,
+    "weights": {
+        "structure": 1.0,
+        "format": 1.0,
+        "progression": 0.5,
+        "repetition": 1.0,
+        "relevance": 1.5,
+        "grounding": 1.0,
+    },
+}
+
+# Fine "completa" di una risposta: punteggiatura, chiusura di markdown (** _ ~~ `), virgolette
+# tipografiche o emoji (anche con selettore di variante / keycap)
+_SENTENCE_END = re.compile(
+    r"(?:[.!?:;)\]}\"'*`_~…»>|”’]"
+    r"|[\u20E3\u2600-\u27BF\u2B00-\u2BFF\U0001F000-\U0001FAFF]\uFE0F?)\s*$"
+)
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _scale(value: float, low: float, high: float) -> float:
+    """Maps value linearly from [low, high] to [0, 1], clamped"""
+    if high <= low:
+        return 1.0 if value >= high else 0.0
+    return max(0.0, min(1.0, (value - low) / (high - low)))
+
+
+class LocalAuditScorer:
+    """
+    Local rubric scorer used as first tier of ConversationAuditor
+
+    score() returns a partial rubric (each entry 0-1, None when the signal
+    is not available), the overall weighted score, the detected issues and
+    whether the turn must be escalated to the LLM auditor.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = {**LOCAL_AUDIT_CONFIG, **(config or {})}
+
+    def score(
+        self,
+        assistant_message: str,
+        last_user_message: Optional[str] = None,
+        previous_assistant_message: Optional[str] = None,
+        rag_context: Optional[Union[str, List[str]]] = None,
+        structured_markers: Optional[List[str]] = None,
+        marker_threshold: int = 3,
+        embedding_backend: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Scores a reply locally
+
+        Args:
+            assistant_message: Reply to score
+            last_user_message: Message the reply answers
+            previous_assistant_message: Previous reply of the agent (repetition check)
+            rag_context: RAG context used for the reply (string or list of chunks)
+            structured_markers: Markers of a structured formalization in the module
+            marker_threshold: Markers needed to consider the formalization declared
+            embedding_backend: Embedding backend of the context (default backend if None)
+
+        Returns:
+            Dict with 'score', 'rubric', 'issues', 'uncertain' and 'escalate'
+        """
+        text = (assistant_message or "").strip()
+        rubric: Dict[str, Optional[float]] = {}
+        issues: List[Dict[str, str]] = []
+        uncertain = False
+
+        # Struttura: lunghezza, troncamento, blocchi di codice non chiusi
+        structure = 1.0
+        if len(text) < self.config["min_reply_chars"]:
+            structure = 0.3
+            issues.append({"type": "structure", "severity": "medium", "message": "The reply is very short."})
+        elif len(text) > self.config["max_reply_chars"]:
+            structure = 0.6
+            issues.append({"type": "structure", "severity": "low", "message": "The reply is very long."})
+        if text.count("```") % 2:
+            structure = min(structure, 0.3)
+            issues.append({"type": "structure", "severity": "high", "message": "The reply contains an unclosed code block."})
+        elif text and not _SENTENCE_END.search(text):
+            structure = min(structure, 0.5)
+            issues.append({"type": "structure", "severity": "medium", "message": "The reply looks truncated."})
+        rubric["structure"] = structure
+
+        # Formato: JSON malformato o formalizzazione strutturata incompleta
+        has_json = extract_json(text) is not None
+        text_lower = text.lower()
+        format_score = 1.0
+        if ("```json" in text_lower or text.startswith("{")) and not has_json:
+            format_score = 0.0
+            issues.append({"type": "format", "severity": "high", "message": "The reply contains malformed JSON."})
+        elif structured_markers and not has_json:
+            hits = sum(1 for marker in structured_markers if marker in text_lower)
+            if 0 < hits < marker_threshold:
+                # Formalizzazione solo accennata: i controlli locali non bastano a valutarla
+                format_score = 0.6
+                uncertain = True
+        rubric["format"] = format_score
+
+        # Progressione: la risposta guida il dialogo (domanda o report)
+        rubric["progression"] = 1.0 if has_json or "?" in text else 0.6
+
+        rubric.update(self._similarity_scores(
+            text, last_user_message, previous_assistant_message, rag_context, embedding_backend, issues
+        ))
+        if rubric.get("relevance") is None:
+            # Senza embedding la pertinenza non è valutabile localmente
+            uncertain = True
+
+        weights = self.config["weights"]
+        available = {key: value for key, value in rubric.items() if value is not None}
+        total_weight = sum(weights.get(key, 1.0) for key in available)
+        overall = sum(value * weights.get(key, 1.0) for key, value in available.items()) / total_weight if total_weight else 0.0
+
+        threshold = self.config["escalate_below"]
+        if threshold <= overall < threshold + self.config["uncertainty_margin"]:
+            uncertain = True
+        high_severity = any(issue["severity"] == "high" for issue in issues)
+
+        return {
+            "score": round(overall, 3),
+            "rubric": rubric,
+            "issues": issues,
+            "uncertain": uncertain,
+            "escalate": overall < threshold or uncertain or high_severity,
+        }
+
+    def _similarity_scores(
+        self,
+        text: str,
+        last_user_message: Optional[str],
+        previous_assistant_message: Optional[str],
+        rag_context: Optional[Union[str, List[str]]],
+        embedding_backend: Optional[str],
+        issues: List[Dict[str, str]],
+    ) -> Dict[str, Optional[float]]:
+        """Relevance, grounding and repetition scores from embedding similarity (None if unavailable)"""
+        scores: Dict[str, Optional[float]] = {"relevance": None}
+        if not text or not last_user_message:
+            return scores
+
+        chunks = [rag_context] if isinstance(rag_context, str) else list(rag_context or [])
+        chunks = [chunk for chunk in chunks if chunk and chunk.strip()]
+        texts = [text, last_user_message] + ([previous_assistant_message] if previous_assistant_message else []) + chunks
+
+        try:
+            service = get_embedding_service(embedding_backend or DEFAULT_EMBEDDING_BACKEND)
+            # Testo della conversazione: non va scritto nella cache persistente degli embedding
+            vectors = service.embed_transient(texts)
+        except Exception as e:
+            print(f"Local audit: embeddings not available: {e}")
+            return scores
+
+        reply_vector = vectors[0]
+        low, high = self.config["relevance_range"]
+        scores["relevance"] = _scale(_cosine(reply_vector, vectors[1]), low, high)
+        if scores["relevance"] < 0.5:
+            issues.append({"type": "relevance", "severity": "medium", "message": "The reply seems unrelated to the user message."})
+
+        next_index = 2
+        if previous_assistant_message:
+            repeated = _cosine(reply_vector, vectors[2]) >= self.config["repetition_similarity"]
+            scores["repetition"] = 0.2 if repeated else 1.0
+            if repeated:
+                issues.append({"type": "repetition", "severity": "medium", "message": "The reply repeats the previous one."})
+            next_index = 3
+
+        if chunks:
+            low, high = self.config["grounding_range"]
+            best = max(_cosine(reply_vector, vector) for vector in vectors[next_index:])
+            scores["grounding"] = _scale(best, low, high)
+
+        return scores
@@ -1,8 +1,30 @@
 ﻿import json
-import re
-from typing import Any, Dict, List, Optional
+import threading
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+from utils.audit_scorer import LocalAuditScorer
 from utils.prompts import get_prompt
+from utils.structured_output import StructuredOutputError, extract_json
+
+
+# Revisioni in background: la risposta dell'agente viene mostrata subito e la
+# card dell'Auditor compare quando la revisione è pronta.
+# sample_every_n_turns: revisiona un turno ogni N (1 = tutti); i turni di
+# finalizzazione (report JSON richiesto o dichiarato) sono sempre revisionati.
+AUDIT_SCHEDULING_CONFIG = {
+    "background": True,
+    "sample_every_n_turns": 2,
+    "max_workers": 4,
+    "poll_interval_seconds": 2,
+}
+
+# Esecutore condiviso dalle sessioni: le revisioni non bloccano il rerun della pagina
+_executor = ThreadPoolExecutor(
+    max_workers=AUDIT_SCHEDULING_CONFIG["max_workers"],
+    thread_name_prefix="auditor"
+)
 
 
 FINALIZATION_KEYWORDS = [
@@ -169,6 +191,92 @@ class ConversationAuditor:
         self._llm_manager = llm_manager
         self._auditor_agent_name = auditor_agent_name or "auditor"
         self._system_prompt = get_prompt(self._auditor_agent_name)
+        # Revisioni in corso o concluse e non ancora raccolte, per indice del messaggio
+        self._reviews: Dict[int, Future] = {}
+        self._reviews_lock = threading.Lock()
+        # Primo livello di revisione: punteggio locale, l'LLM solo se necessario
+        self._local_scorer = LocalAuditScorer()
+        self._tier_counts = {"local": 0, "llm": 0}
+
+    # ==================== Background reviews ====================
+
+    def should_review(
+        self,
+        module_name: str,
+        conversation: List[Dict[str, str]],
+        expected_outcome: Optional[str] = None,
+        last_user_message: Optional[str] = None,
+        assistant_message: Optional[str] = None,
+        sample_every: Optional[int] = None,
+    ) -> bool:
+        """
+        Sampling policy: True for every Nth user turn and for finalization turns
+
+        Args:
+            module_name: Module of the conversation (ali, believer, cuma)
+            conversation: Conversation including the latest assistant reply
+            expected_outcome: Expected outcome of the module
+            last_user_message: Latest user message
+            assistant_message: Latest assistant reply
+            sample_every: Review one turn every N (default AUDIT_SCHEDULING_CONFIG)
+        """
+        excerpt = self._trim_history(conversation, 8)
+        if self._is_finalization_turn(module_name, expected_outcome, last_user_message, assistant_message, excerpt):
+            return True
+
+        every = sample_every or AUDIT_SCHEDULING_CONFIG["sample_every_n_turns"]
+        turn_number = sum(1 for message in conversation if message.get("role") == "user")
+        return every <= 1 or turn_number % every == 0
+
+    def submit_review(self, message_index: int, **review_kwargs) -> None:
+        """
+        Starts the review of an assistant message without waiting for it
+
+        The result is returned later by collect_reviews (with
+        AUDIT_SCHEDULING_CONFIG["background"] disabled the review runs here).
+
+        Args:
+            message_index: Index of the reviewed message in the chat history
+            **review_kwargs: Arguments of review
+        """
+        if AUDIT_SCHEDULING_CONFIG["background"]:
+            future = _executor.submit(self._safe_review, **review_kwargs)
+        else:
+            future = Future()
+            future.set_result(self._safe_review(**review_kwargs))
+
+        with self._reviews_lock:
+            self._reviews[message_index] = future
+
+    def collect_reviews(self) -> List[Tuple[int, Dict[str, Any]]]:
+        """Returns (message_index, result) of the completed reviews, oldest message first"""
+        completed = []
+        with self._reviews_lock:
+            for message_index, future in list(self._reviews.items()):
+                if future.done():
+                    del self._reviews[message_index]
+                    completed.append((message_index, future.result()))
+        return sorted(completed, key=lambda item: item[0])
+
+    def pending_reviews(self) -> List[int]:
+        """Message indexes whose review is still running"""
+        with self._reviews_lock:
+            return sorted(index for index, future in self._reviews.items() if not future.done())
+
+    def has_completed_reviews(self) -> bool:
+        with self._reviews_lock:
+            return any(future.done() for future in self._reviews.values())
+
+    def discard_reviews(self):
+        """Forgets the pending reviews (e.g. when the chat is reset); running calls end in background"""
+        with self._reviews_lock:
+            self._reviews.clear()
+
+    def _safe_review(self, **review_kwargs) -> Optional[Dict[str, Any]]:
+        try:
+            return self.review(**review_kwargs)
+        except Exception as audit_exc:  # pylint: disable=broad-except
+            return {"error": str(audit_exc)}
 
     def review(
         self,
@@ -185,8 +293,16 @@ class ConversationAuditor:
         temperature: float = 0.15,
         max_tokens: int = 900,
         top_p: float = 0.6,
+        rag_context: Optional[Union[str, List[str]]] = None,
+        embedding_backend: Optional[str] = None,
     ) -> Optional[Dict[str, Any]]:
-        """Sends the conversation to the Auditor and returns the structured assessment."""
+        """Sends the conversation to the Auditor and returns the structured assessment.
+
+        Reviews are tiered: after the JSON enforcement check, the reply is
+        scored locally (LocalAuditScorer, optionally against the RAG context)
+        and the LLM Auditor is called only when the local score is low or
+        uncertain. The result carries 'tier' ("local" or "llm").
+        """
 
         if not self._llm_manager or not provider or not model:
             return None
@@ -203,6 +319,23 @@ class ConversationAuditor:
         if enforcement:
             return enforcement
 
+        local = None
+        if self._local_scorer.config["enabled"]:
+            local = self._local_scorer.score(
+                assistant_message or self._extract_last_role(excerpt, "assistant"),
+                last_user_message=last_user_message or self._extract_last_role(excerpt, "user"),
+                previous_assistant_message=self._previous_assistant_message(excerpt),
+                rag_context=rag_context,
+                structured_markers=MODULE_STRUCTURED_MARKERS.get(module_name),
+                marker_threshold=MODULE_STRUCTURED_THRESHOLDS.get(module_name, 3),
+                embedding_backend=embedding_backend,
+            )
+            if not local["escalate"]:
+                self._count_tier("local")
+                return self._local_assessment(local)
+
+        self._count_tier("llm")
+
         payload: Dict[str, Any] = {
             "module_name": module_name,
             "module_goal": module_goal,
@@ -217,30 +350,61 @@ class ConversationAuditor:
 
         message_content = json.dumps(payload, ensure_ascii=False, indent=2)
 
-        response = self._llm_manager.chat(
-            provider=provider,
-            model=model,
-            messages=[{"role": "user", "content": message_content}],
-            system_prompt=self._system_prompt,
-            context=None,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            top_p=top_p
-        )
+        # Modalità JSON nativa del provider; un JSON troncato viene riparato solo nella parte finale
+        try:
+            result = self._llm_manager.chat_structured(
+                provider=provider,
+                model=model,
+                messages=[{"role": "user", "content": message_content}],
+                system_prompt=self._system_prompt,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+                agent=f"auditor:{module_name}"
+            )
+        except StructuredOutputError as e:
+            return {"error": "parse_error", "raw_response": e.text}
+
+        parsed = result["data"]
+        parsed["raw_response"] = result["text"]
+        parsed["tier"] = "llm"
+        if local:
+            parsed["local_score"] = local["score"]
+        return parsed
 
-        parsed = self._extract_json(response)
-        if parsed is not None:
-            parsed["raw_response"] = response
-        else:
-            parsed = {"error": "parse_error", "raw_response": response}
+    def get_tier_stats(self) -> Dict[str, int]:
+        """Reviews resolved locally and escalated to the LLM since the auditor was created"""
+        with self._reviews_lock:
+            return dict(self._tier_counts)
 
-        return parsed
+    def _count_tier(self, tier: str):
+        with self._reviews_lock:
+            self._tier_counts[tier] += 1
+
+    @staticmethod
+    def _local_assessment(local: Dict[str, Any]) -> Dict[str, Any]:
+        """Assessment in the Auditor format for a reply that passed the local checks"""
+        return {
+            "status": "pass",
+            "summary": f"Local pre-audit passed (score {local['score']:.2f}): no LLM review needed.",
+            "issues": local["issues"],
+            "assistant_improvements": [],
+            "suggested_user_replies": [],
+            "confidence": "medium",
+            "tier": "local",
+            "local_score": local["score"],
+        }
 
     @staticmethod
     def _trim_history(history: List[Dict[str, str]], limit: int) -> List[Dict[str, str]]:
         trimmed = history[-limit:] if limit and len(history) > limit else history
         return [msg.copy() for msg in trimmed]
 
+    @staticmethod
+    def _previous_assistant_message(history: List[Dict[str, str]]) -> Optional[str]:
+        assistant_messages = [msg.get("content", "") for msg in history if msg.get("role") == "assistant"]
+        return assistant_messages[-2] if len(assistant_messages) > 1 else None
+
     @staticmethod
     def _extract_last_role(history: List[Dict[str, str]], role: str) -> str:
         for message in reversed(history):
@@ -250,32 +414,7 @@ class ConversationAuditor:
 
     @staticmethod
     def _extract_json(text: str) -> Optional[Dict[str, Any]]:
-        if not text:
-            return None
-
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            pass
-
-        # Cerca un blocco JSON all'interno del testo
-        fenced = re.search(r"```json\s*(\{.*?\})\s*```", text, re.DOTALL | re.IGNORECASE)
-        if fenced:
-            try:
-                return json.loads(fenced.group(1))
-            except json.JSONDecodeError:
-                pass
-
-        # Fallback: trova la prima occorrenza di una struttura JSON
-        brace_match = re.search(r"(\{.*\})", text, re.DOTALL)
-        if brace_match:
-            candidate = brace_match.group(1)
-            try:
-                return json.loads(candidate)
-            except json.JSONDecodeError:
-                return None
-
-        return None
+        return extract_json(text, expect=dict)
 
     def _force_json_if_needed(
         self,
@@ -292,17 +431,9 @@ class ConversationAuditor:
         if not user_message and excerpt:
             user_message = self._extract_last_role(excerpt, "user")
 
-        user_lower = user_message.lower() if user_message else ""
-
-        user_finalization = self._user_requests_finalization(user_lower)
-        structured_finalization = self._detect_structured_finalization(module_name, assistant_message)
-        recent_json = self._assistant_recently_produced_json(excerpt)
-
-        expected_finalization = False
-        if expected_outcome:
-            expected_finalization = self._expected_requests_finalization(expected_outcome)
-            if expected_finalization and recent_json:
-                expected_finalization = False
+        user_finalization, expected_finalization, structured_finalization = self._finalization_signals(
+            module_name, expected_outcome, user_message, assistant_message, excerpt
+        )
 
         finalization_requested = user_finalization or expected_finalization
 
@@ -369,6 +500,47 @@ class ConversationAuditor:
             "confidence": "high"
         }
 
+    def _finalization_signals(
+        self,
+        module_name: str,
+        expected_outcome: Optional[str],
+        user_message: Optional[str],
+        assistant_message: str,
+        excerpt: Optional[List[Dict[str, str]]]
+    ) -> Tuple[bool, bool, bool]:
+        """Returns (user_finalization, expected_finalization, structured_finalization) of a turn"""
+        user_lower = user_message.lower() if user_message else ""
+
+        user_finalization = self._user_requests_finalization(user_lower)
+        structured_finalization = self._detect_structured_finalization(module_name, assistant_message)
+        recent_json = self._assistant_recently_produced_json(excerpt)
+
+        expected_finalization = False
+        if expected_outcome:
+            expected_finalization = self._expected_requests_finalization(expected_outcome)
+            if expected_finalization and recent_json:
+                expected_finalization = False
+
+        return user_finalization, expected_finalization, structured_finalization
+
+    def _is_finalization_turn(
+        self,
+        module_name: str,
+        expected_outcome: Optional[str],
+        last_user_message: Optional[str],
+        assistant_message: Optional[str],
+        excerpt: Optional[List[Dict[str, str]]]
+    ) -> bool:
+        """True for the turns checked by _force_json_if_needed (JSON report requested or declared)"""
+        if not assistant_message:
+            return False
+
+        user_message = last_user_message
+        if not user_message and excerpt:
+            user_message = self._extract_last_role(excerpt, "user")
+
+        return any(self._finalization_signals(module_name, expected_outcome, user_message, assistant_message, excerpt))
+
     def _detect_structured_finalization(self, module_name: str, assistant_message: str) -> bool:
         text = assistant_message.lower()
         markers = MODULE_STRUCTURED_MARKERS.get(module_name, [])
@@ -444,3 +616,44 @@ class ConversationAuditor:
                 return True
 
         return False
+
+
+def merge_audit_results(
+    audit_trail: List[Dict[str, Any]],
+    results: List[Tuple[int, Dict[str, Any]]]
+) -> Tuple[Dict[int, Dict[str, Any]], Optional[str]]:
+    """
+    Writes completed reviews into a page audit trail
+
+    Args:
+        audit_trail: Audit trail of the page (list of records, updated in place)
+        results: (message_index, result) pairs returned by collect_reviews
+
+    Returns:
+        (merged, error): the successful results by message index and the
+        last error message, if any
+    """
+    merged, error = {}, None
+    for message_index, result in results:
+        if not result:
+            continue
+        if "error" in result:
+            error = result["error"]
+            continue
+
+        audit_record = {
+            "message_index": message_index,
+            "result": result,
+            "timestamp": datetime.now().isoformat()
+        }
+        existing_entry = next(
+            (item for item in audit_trail if item.get("message_index") == message_index),
+            None
+        )
+        if existing_entry:
+            existing_entry.update(audit_record)
+        else:
+            audit_trail.append(audit_record)
+        merged[message_index] = result
+
+    return merged, error
@@ -0,0 +1,341 @@
+"""
+BdiEventStore - Event-sourced persistence of the BDI data of a session
+
+This module handles:
+- An append-only log of BDI mutations: item-level add/update/delete of
+  desires, beliefs and intentions, set/unset of the other fields
+  (domain_summary, beneficiario), one JSON event per line
+- Diffing the data written by the agents against the stored state, so a
+  save appends only the changed items instead of rewriting the document
+- The materialized view read by the pages, refreshed incrementally from
+  the bytes appended since the last read
+- Periodic compaction: a new log segment starts with a snapshot of the
+  full state (old segments are kept as mutation history) and the
+  current_bdi.json document of the session store is refreshed
+- Time travel: the state at any earlier event or timestamp, replayed
+  from the nearest segment snapshot
+
+Segments live in <session_dir>/bdi_events/segment_<first seq>.jsonl.
+Every segment starts with a "snapshot" event; sessions without segments
+are read from the current_bdi.json document until their first write.
+"""
+
+import os
+import copy
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.atomic_json import (
+    RevisionConflictError, content_revision, decode_jsonl_lines, file_lock, truncate_partial_line, write_text_atomic
+)
+from utils.session_store import SessionStore
+
+
+BDI_DOCUMENT = "current_bdi.json"
+BDI_COLLECTIONS = ("desires", "beliefs", "intentions")
+# Campi che identificano un elemento di una collezione (in ordine di priorità)
+ITEM_ID_FIELDS = ("desire_id", "belief_id", "intention_id", "id")
+
+EVENTS_DIRNAME = "bdi_events"
+SEGMENT_PREFIX = "segment_"
+# Eventi dopo i quali il log viene compattato in un nuovo segmento con snapshot
+COMPACT_EVERY_EVENTS = 200
+
+
+def item_key(item: Any) -> str:
+    """Identity of a collection item: its id field, or a hash of its content when it has none"""
+    if isinstance(item, dict):
+        for field in ITEM_ID_FIELDS:
+            value = item.get(field)
+            if value not in (None, ""):
+                return f"{field}:{value}"
+    return f"sha:{content_revision(item)}"
+
+
+def apply_event(state: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """Applies an event to the state (in place) and returns the resulting state"""
+    op = event["op"]
+    if op == "snapshot":
+        return event["data"]
+    if op == "set":
+        state[event["field"]] = event["data"]
+    elif op == "unset":
+        state.pop(event["field"], None)
+    else:
+        items = state.setdefault(event["collection"], [])
+        index = next((i for i, item in enumerate(items) if item_key(item) == event["key"]), None)
+        if op == "add":
+            if index is None:
+                items.append(event["data"])
+            else:
+                items[index] = event["data"]
+        elif op == "update" and index is not None:
+            items[index] = event["data"]
+        elif op == "delete" and index is not None:
+            del items[index]
+    return state
+
+
+def _diff_items(collection: str, old: List[Any], new: List[Any]) -> List[Dict[str, Any]]:
+    """Item-level events turning old into new (a single "set" when that is not possible)"""
+    if old == new:
+        return []
+
+    replace = [{"op": "set", "field": collection, "data": new}]
+    old_keys = [item_key(item) for item in old]
+    new_keys = [item_key(item) for item in new]
+    if len(set(old_keys)) < len(old_keys) or len(set(new_keys)) < len(new_keys):
+        # Id duplicati: gli eventi per elemento sarebbero ambigui
+        return replace
+
+    old_by_key = dict(zip(old_keys, old))
+    new_key_set = set(new_keys)
+    events = [
+        {"op": "delete", "collection": collection, "key": key}
+        for key in old_keys if key not in new_key_set
+    ]
+    for key, item in zip(new_keys, new):
+        if key not in old_by_key:
+            events.append({"op": "add", "collection": collection, "key": key, "data": item})
+        elif old_by_key[key] != item:
+            events.append({"op": "update", "collection": collection, "key": key, "data": item})
+
+    # L'ordine risultante deve coincidere con quello richiesto, altrimenti si riscrive la collezione
+    check = {collection: list(old)}
+    for event in events:
+        apply_event(check, event)
+    return events if check[collection] == new else replace
+
+
+def diff_events(current: Dict[str, Any], target: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Events turning the current BDI state into target"""
+    events = [{"op": "unset", "field": field} for field in current if field not in target]
+    for field, value in target.items():
+        old = current.get(field)
+        if field in BDI_COLLECTIONS and isinstance(old, list) and isinstance(value, list):
+            events.extend(_diff_items(field, old, value))
+        elif field not in current or old != value:
+            events.append({"op": "set", "field": field, "data": value})
+    return events
+
+
+class BdiEventStore:
+    """
+    Event-sourced BDI data of the sessions under base_dir
+
+    Writes (commit) append the diff against the current state to the active
+    segment under the log lock; reads (materialize) replay only the events
+    appended since the previous read. The current_bdi.json document of the
+    session store is the snapshot of the last compaction, used for exports,
+    backend migration and sessions never written through the log.
+    """
+
+    def __init__(self, base_dir: Path, store: SessionStore, compact_every: int = COMPACT_EVERY_EVENTS):
+        self.base_dir = Path(base_dir)
+        self.store = store
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        # Vista materializzata per sessione: segmento attivo, byte letti, stato, ultimo seq,
+        # eventi dopo lo snapshot, revisione dello stato (calcolata alla prima richiesta)
+        self._views: Dict[str, Dict[str, Any]] = {}
+
+    def _events_dir(self, session_id: str) -> Path:
+        return self.base_dir / session_id / EVENTS_DIRNAME
+
+    def _segments(self, session_id: str) -> List[Path]:
+        events_dir = self._events_dir(session_id)
+        if not events_dir.exists():
+            return []
+        return sorted(events_dir.glob(f"{SEGMENT_PREFIX}*.jsonl"))
+
+    @staticmethod
+    def _segment_start(segment: Path) -> int:
+        return int(segment.stem[len(SEGMENT_PREFIX):])
+
+    @staticmethod
+    def _read_events(segment: Path, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """Reads the complete event lines after offset; returns (events, new offset)"""
+        with open(segment, "rb") as f:
+            f.seek(offset)
+            chunk = f.read()
+        # Una riga senza newline finale è un append in corso: verrà letta alla prossima chiamata.
+        # Le righe non decodificabili (scritture interrotte di versioni precedenti) vengono saltate
+        end = chunk.rfind(b"\n") + 1
+        return decode_jsonl_lines(chunk[:end].splitlines(), str(segment)), offset + end
+
+    def _write_segment(self, session_id: str, state: Dict[str, Any], seq: int):
+        """Starts a new segment whose first event is the snapshot of state"""
+        snapshot = {"seq": seq, "ts": datetime.now().isoformat(), "op": "snapshot", "data": state}
+        segment = self._events_dir(session_id) / f"{SEGMENT_PREFIX}{seq:010d}.jsonl"
+        write_text_atomic(str(segment), json.dumps(snapshot, ensure_ascii=False) + "\n")
+
+    def _view(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Materialized view of the active segment, updated with the newly appended events"""
+        segments = self._segments(session_id)
+        if not segments:
+            return None
+
+        active = segments[-1]
+        view = self._views.get(session_id)
+        if view is None or view["segment"] != active:
+            view = {"segment": active, "offset": 0, "state": {}, "seq": 0, "events": 0, "revision": None}
+            self._views[session_id] = view
+
+        if active.stat().st_size > view["offset"]:
+            events, view["offset"] = self._read_events(active, view["offset"])
+            if events:
+                view["revision"] = None
+            for event in events:
+                view["state"] = apply_event(view["state"], event)
+                view["seq"] = event["seq"]
+                if event["op"] != "snapshot":
+                    view["events"] += 1
+        return view
+
+    def materialize(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Current BDI data of a session (None when it has none)"""
+        with self._lock:
+            view = self._view(session_id)
+            if view is not None:
+                return copy.deepcopy(view["state"])
+        return self.store.get_document(session_id, BDI_DOCUMENT)
+
+    def materialize_versioned(self, session_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Current BDI data of a session with its revision, hashed once per change of the view"""
+        with self._lock:
+            view = self._view(session_id)
+            if view is not None:
+                if view["revision"] is None:
+                    view["revision"] = content_revision(view["state"])
+                return copy.deepcopy(view["state"]), view["revision"]
+        data = self.store.get_document(session_id, BDI_DOCUMENT)
+        return data, content_revision(data)
+
+    def commit(
+        self,
+        session_id: str,
+        build: Callable[[Dict[str, Any]], Dict[str, Any]],
+        expected_revision: Optional[str] = None
+    ) -> Tuple[Dict[str, Any], Optional[str]]:
+        """
+        Appends the events that turn the current state into build(current state)
+
+        Args:
+            session_id: Session ID
+            build: Receives a copy of the current state and returns the new state
+            expected_revision: Revision read by the caller; RevisionConflictError if it changed
+
+        Returns:
+            (state, revision) after the write
+        """
+        events_dir = self._events_dir(session_id)
+        with file_lock(str(events_dir / "events")), self._lock:
+            view = self._view(session_id)
+            if view is None:
+                # Primo evento della sessione: il documento esistente diventa lo snapshot iniziale
+                self._write_segment(session_id, self.store.get_document(session_id, BDI_DOCUMENT) or {}, 0)
+                view = self._view(session_id)
+
+            if view["revision"] is None:
+                view["revision"] = content_revision(view["state"])
+            actual = view["revision"]
+            if expected_revision is not None and actual != expected_revision:
+                raise RevisionConflictError(f"{session_id}/{EVENTS_DIRNAME}", expected_revision, actual)
+
+            changes = diff_events(view["state"], build(copy.deepcopy(view["state"])))
+            if changes:
+                now = datetime.now().isoformat()
+                lines = [
+                    json.dumps({"seq": view["seq"] + number, "ts": now, **change}, ensure_ascii=False)
+                    for number, change in enumerate(changes, start=1)
+                ]
+                # Una riga troncata da un crash si fonderebbe con il primo evento nuovo
+                truncate_partial_line(str(view["segment"]))
+                with open(view["segment"], "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                view = self._view(session_id)
+
+                if view["events"] >= self.compact_every:
+                    view = self._compact(session_id, view)
+
+            if view["revision"] is None:
+                view["revision"] = content_revision(view["state"])
+            state, revision = copy.deepcopy(view["state"]), view["revision"]
+        return state, revision
+
+    def _compact(self, session_id: str, view: Dict[str, Any]) -> Dict[str, Any]:
+        self._write_segment(session_id, view["state"], view["seq"])
+        # Il documento dello store resta allineato all'ultimo snapshot (export, migrazione)
+        self.store.save_document(session_id, BDI_DOCUMENT, view["state"])
+        return self._view(session_id)
+
+    def compact(self, session_id: str) -> bool:
+        """Starts a new segment from the current state; False when there is nothing to compact"""
+        with file_lock(str(self._events_dir(session_id) / "events")), self._lock:
+            view = self._view(session_id)
+            if view is None or view["events"] == 0:
+                return False
+            self._compact(session_id, view)
+            return True
+
+    def history(self, session_id: str, limit: Optional[int] = 50,
+                collection: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Mutation history of a session, most recent first
+
+        Args:
+            session_id: Session ID
+            limit: Maximum number of events (None for all)
+            collection: Only the events of this collection or field
+
+        Returns:
+            List of events (seq, ts, op, collection/field, key, data)
+        """
+        history: List[Dict[str, Any]] = []
+        for segment in reversed(self._segments(session_id)):
+            events, _ = self._read_events(segment)
+            for event in reversed(events):
+                if event["op"] == "snapshot":
+                    continue
+                if collection and collection not in (event.get("collection"), event.get("field")):
+                    continue
+                history.append(event)
+                if limit is not None and len(history) >= limit:
+                    return history
+        return history
+
+    def state_at(self, session_id: str, seq: Optional[int] = None,
+                 timestamp: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        BDI data of a session as it was after event seq, or at timestamp (ISO format)
+
+        Returns:
+            The state, or None when the history does not go back that far
+        """
+        segments = self._segments(session_id)
+        if not segments:
+            return self.store.get_document(session_id, BDI_DOCUMENT) if seq is None and timestamp is None else None
+
+        def reached(event: Dict[str, Any]) -> bool:
+            return (seq is None or event["seq"] <= seq) and (timestamp is None or event["ts"] <= timestamp)
+
+        # Il segmento di partenza è l'ultimo il cui snapshot precede il punto richiesto
+        for segment in reversed(segments):
+            if seq is not None and self._segment_start(segment) > seq:
+                continue
+            events, _ = self._read_events(segment)
+            if not events or not reached(events[0]):
+                continue
+
+            state: Dict[str, Any] = {}
+            for event in events:
+                if not reached(event):
+                    break
+                state = apply_event(state, event)
+            return state
+        return None
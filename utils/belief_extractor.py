@@ -0,0 +1,346 @@
+"""
+BeliefBaseExtractor - Map-reduce extraction of the belief base of a context
+
+This module handles:
+- Streaming the chunks of a context in token-budgeted windows
+- Extracting a partial belief base per window (concurrent map calls)
+- Merging and de-duplicating the partial belief bases (reduce)
+- Checkpointing every window, so an interrupted run can be resumed
+
+The merge follows the strategy of MERGE_PROMPT in
+prompts/lorena/prompts_domain_beliefs.py: duplicates are merged keeping
+the most comprehensive definition, the union of list fields and the
+highest confidence; unique beliefs are preserved.
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional
+
+from utils.atomic_json import write_json_atomic
+
+
+# Budget di token per finestra (solo testo dei chunk, il prompt di sistema è escluso)
+DEFAULT_WINDOW_TOKENS = 24000
+DEFAULT_MAX_WORKERS = 4
+CHARS_PER_TOKEN = 4
+SCAN_PAGE_SIZE = 500
+CHECKPOINT_DIRNAME = "belief_extraction"
+
+BELIEF_PROMPT_PATH = "./prompts/belief_base_prompt.md"
+
+LIST_FIELDS = ["prerequisites", "related_concepts", "enables", "part_of", "sub_concepts", "tags"]
+SCORE_FIELDS = ["importance", "confidence"]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (about 4 characters per token), provider independent"""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class BeliefBaseExtractor:
+    """
+    Extracts the belief base of a context with a map-reduce pipeline.
+
+    Map calls run concurrently (up to max_workers); each completed window is
+    saved under <context>/belief_extraction/ so that a new run with the same
+    knowledge base skips it.
+    """
+
+    def __init__(
+        self,
+        llm_manager,
+        doc_processor,
+        context_path: str,
+        provider: str,
+        model: str,
+        window_tokens: int = DEFAULT_WINDOW_TOKENS,
+        max_workers: int = DEFAULT_MAX_WORKERS
+    ):
+        """
+        Initialize BeliefBaseExtractor.
+
+        Args:
+            llm_manager: LLMManager instance
+            doc_processor: DocumentProcessor of the context
+            context_path: Context directory (checkpoints are stored here)
+            provider: LLM provider
+            model: LLM model
+            window_tokens: Token budget of the chunks sent in a single map call
+            max_workers: Maximum number of concurrent map calls
+        """
+        self.llm_manager = llm_manager
+        self.doc_processor = doc_processor
+        self.provider = provider
+        self.model = model
+        self.window_tokens = window_tokens
+        self.max_workers = max(1, max_workers)
+        self.checkpoint_dir = os.path.join(context_path, CHECKPOINT_DIRNAME)
+
+        with open(BELIEF_PROMPT_PATH, 'r', encoding='utf-8') as f:
+            self.system_prompt = f.read()
+
+    # ==================== Windows ====================
+
+    def plan_windows(self) -> List[Dict]:
+        """
+        Scans the collection page by page and groups chunk ids into token-budgeted windows
+
+        Only ids and token estimates are kept in memory; the text of a window
+        is read again when its map call runs.
+
+        Returns:
+            List of windows: {'id', 'chunk_ids', 'tokens'}
+        """
+        collection = self.doc_processor.collection
+        if collection is None:
+            self.doc_processor.initialize_db()
+            collection = self.doc_processor.collection
+
+        windows = []
+        current_ids, current_tokens = [], 0
+        offset = 0
+
+        while True:
+            page = collection.get(limit=SCAN_PAGE_SIZE, offset=offset, include=["documents"])
+            ids = page.get("ids") or []
+            if not ids:
+                break
+
+            for chunk_id, document in zip(ids, page.get("documents") or []):
+                tokens = estimate_tokens(document or "")
+                if current_ids and current_tokens + tokens > self.window_tokens:
+                    windows.append(self._make_window(current_ids, current_tokens))
+                    current_ids, current_tokens = [], 0
+                current_ids.append(chunk_id)
+                current_tokens += tokens
+
+            offset += len(ids)
+
+        if current_ids:
+            windows.append(self._make_window(current_ids, current_tokens))
+
+        return windows
+
+    @staticmethod
+    def _make_window(chunk_ids: List[str], tokens: int) -> Dict:
+        window_id = hashlib.sha256("\n".join(chunk_ids).encode('utf-8')).hexdigest()[:16]
+        return {"id": window_id, "chunk_ids": list(chunk_ids), "tokens": tokens}
+
+    # ==================== Map ====================
+
+    def _extract_window(self, window: Dict) -> List[Dict]:
+        """Map step: extracts the beliefs of a single window"""
+        results = self.doc_processor.collection.get(ids=window["chunk_ids"], include=["documents"])
+        context = "\n\n---\n\n".join(doc for doc in results.get("documents") or [] if doc)
+
+        user_message = (
+            "Analizza la seguente porzione della base di conoscenza ed estrai tutti i belief di base "
+            f"secondo le istruzioni fornite.\n\nBASE DI CONOSCENZA:\n{context}"
+        )
+
+        # Modalità JSON nativa; un JSON troncato viene riparato solo nella parte finale
+        result = self.llm_manager.chat_structured(
+            provider=self.provider,
+            model=self.model,
+            messages=[{"role": "user", "content": user_message}],
+            system_prompt=self.system_prompt,
+            item_keys=["beliefs_base"],
+            agent="knol:beliefs"
+        )
+
+        return self._parse_beliefs(result["data"])
+
+    @staticmethod
+    def _parse_beliefs(belief_base: Dict) -> List[Dict]:
+        """Returns the 'beliefs_base' list of a parsed belief base"""
+        if 'beliefs_base' not in belief_base:
+            raise ValueError("JSON does not contain the 'beliefs_base' key")
+
+        return belief_base['beliefs_base']
+
+    # ==================== Checkpoints ====================
+
+    def _window_path(self, window: Dict) -> str:
+        return os.path.join(self.checkpoint_dir, f"window_{window['id']}.json")
+
+    def _load_window(self, window: Dict) -> Optional[List[Dict]]:
+        path = self._window_path(window)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("beliefs_base", [])
+        except Exception as e:
+            print(f"Error loading checkpoint {path}: {e}")
+            return None
+
+    def _save_window(self, window: Dict, beliefs: List[Dict]):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        checkpoint = {
+            "window_id": window["id"],
+            "chunk_count": len(window["chunk_ids"]),
+            "tokens": window["tokens"],
+            "completed_at": datetime.now().isoformat(),
+            "beliefs_base": beliefs
+        }
+        # Scrittura atomica: un'interruzione non lascia un checkpoint troncato
+        write_json_atomic(self._window_path(window), checkpoint)
+
+    def clear_checkpoints(self):
+        """Removes the checkpoints of the previous runs"""
+        if os.path.exists(self.checkpoint_dir):
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+    # ==================== Run ====================
+
+    def iter_run(self, resume: bool = True) -> Iterator[Dict]:
+        """
+        Runs the map step, yielding one progress event per window
+
+        Events are yielded in the caller's thread (safe for Streamlit updates):
+        {'window_id', 'done', 'total', 'beliefs', 'resumed', 'error'}
+
+        The map results are collected in self.partial_results; call merge()
+        (or run()) to obtain the final belief base.
+        """
+        if not resume:
+            self.clear_checkpoints()
+
+        windows = self.plan_windows()
+        total = len(windows)
+        self.partial_results = {}
+        self.errors = {}
+        done = 0
+
+        pending = []
+        for window in windows:
+            beliefs = self._load_window(window) if resume else None
+            if beliefs is None:
+                pending.append(window)
+                continue
+            self.partial_results[window["id"]] = beliefs
+            done += 1
+            yield {"window_id": window["id"], "done": done, "total": total,
+                   "beliefs": len(beliefs), "resumed": True, "error": None}
+
+        if not pending:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as executor:
+            futures = {executor.submit(self._extract_window, window): window for window in pending}
+
+            for future in as_completed(futures):
+                window = futures[future]
+                done += 1
+                try:
+                    beliefs = future.result()
+                    self._save_window(window, beliefs)
+                    self.partial_results[window["id"]] = beliefs
+                    yield {"window_id": window["id"], "done": done, "total": total,
+                           "beliefs": len(beliefs), "resumed": False, "error": None}
+                except Exception as e:
+                    self.errors[window["id"]] = str(e)
+                    yield {"window_id": window["id"], "done": done, "total": total,
+                           "beliefs": 0, "resumed": False, "error": str(e)}
+
+    def run(self, resume: bool = True,
+            progress_callback: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        Runs the full map-reduce extraction
+
+        Args:
+            resume: Reuse the windows completed by a previous (interrupted) run
+            progress_callback: Called with every progress event of iter_run
+
+        Returns:
+            Dict with 'beliefs_base' (merged), 'windows', 'errors' and 'complete'.
+            When some windows failed the belief base is partial and the
+            checkpoints are kept: running again only retries the failed windows.
+        """
+        for event in self.iter_run(resume=resume):
+            if progress_callback:
+                progress_callback(event)
+
+        merged = self.merge(list(self.partial_results.values()))
+        complete = not self.errors
+
+        if complete:
+            self.clear_checkpoints()
+
+        return {
+            "beliefs_base": merged,
+            "windows": len(self.partial_results) + len(self.errors),
+            "errors": dict(self.errors),
+            "complete": complete
+        }
+
+    # ==================== Reduce ====================
+
+    @staticmethod
+    def _normalize_key(value) -> str:
+        if isinstance(value, (list, dict)):
+            value = json.dumps(value, ensure_ascii=False, sort_keys=True)
+        text = str(value or "").casefold()
+        text = re.sub(r"[^\w\s]", " ", text)
+        return re.sub(r"\s+", " ", text).strip()
+
+    @classmethod
+    def merge(cls, partial_bases: List[List[Dict]]) -> List[Dict]:
+        """
+        Merges partial belief bases, de-duplicating equivalent beliefs
+
+        Two beliefs are duplicates when subject, relation and object match
+        after normalization (case, punctuation, whitespace). For duplicates:
+        the most comprehensive definition is kept, list fields are united
+        without repetitions, scores take the highest value and the sources
+        are combined.
+        """
+        merged = {}
+
+        for beliefs in partial_bases:
+            for belief in beliefs:
+                if not isinstance(belief, dict) or not belief.get("subject"):
+                    continue
+
+                key = (
+                    cls._normalize_key(belief.get("subject")),
+                    cls._normalize_key(belief.get("semantic_relations")),
+                    cls._normalize_key(belief.get("object"))
+                )
+
+                existing = merged.get(key)
+                if existing is None:
+                    merged[key] = dict(belief)
+                    continue
+
+                if len(str(belief.get("definition", ""))) > len(str(existing.get("definition", ""))):
+                    existing["definition"] = belief["definition"]
+
+                for field in LIST_FIELDS:
+                    values = list(existing.get(field) or [])
+                    seen = {cls._normalize_key(v) for v in values}
+                    for value in belief.get(field) or []:
+                        if cls._normalize_key(value) not in seen:
+                            seen.add(cls._normalize_key(value))
+                            values.append(value)
+                    existing[field] = values
+
+                for field in SCORE_FIELDS:
+                    scores = [s for s in (existing.get(field), belief.get(field)) if isinstance(s, (int, float))]
+                    if scores:
+                        existing[field] = max(scores)
+
+                source = belief.get("source")
+                if source and source not in str(existing.get("source", "")):
+                    existing["source"] = f"{existing.get('source', '')} | {source}".strip(" |")
+
+                if not existing.get("metadata") and belief.get("metadata"):
+                    existing["metadata"] = belief["metadata"]
+
+        return list(merged.values())
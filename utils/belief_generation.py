@@ -0,0 +1,190 @@
+"""
+Belief generation from scratch - Believer's desire-driven extraction from the knowledge base
+
+This module handles:
+- Retrieving the chunks of every desire with one batched query
+  (DocumentProcessor.query_many); a chunk retrieved by several desires
+  is sent once and referenced by the others
+- Building the from-scratch prompt (desires and chunks context)
+- Extracting the beliefs with a structured LLM call, numbered after the
+  beliefs already in the session
+- The summary message shown in the chat
+
+The page (pages/3_Believer.py) only renders the progress and saves the result.
+"""
+
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.prompts import get_prompt
+
+
+# Chunk recuperati per desire (preferenza utente: copertura bilanciata)
+FROM_SCRATCH_N_RESULTS = 10
+
+
+def _desire_id(desire: Dict, index: int) -> str:
+    return desire.get('id', f'D{index}')
+
+
+def _desire_description(desire: Dict) -> str:
+    return desire.get('description', desire.get('content', 'N/A'))
+
+
+def build_desires_context(desires: List[Dict]) -> str:
+    """Desires section of the from-scratch prompt"""
+    desires_context = "USER DESIRES:\n\n"
+    for idx, desire in enumerate(desires, 1):
+        desires_context += (
+            f"- **Desire {_desire_id(desire, idx)}**: {_desire_description(desire)} "
+            f"(Priority: {desire.get('priority', 'N/A')})\n"
+        )
+    return desires_context
+
+
+def build_chunks_context(desire_ids: List[str], query_results: List[Dict]) -> str:
+    """Chunks section of the from-scratch prompt, grouped by desire (shared chunks are only referenced)"""
+    chunks_context = "CHUNKS FROM KNOWLEDGE BASE:\n\n"
+    for desire_id, result in zip(desire_ids, query_results):
+        chunks_context += f"### [Desire {desire_id}]\n\n"
+        for i, chunk in enumerate(result['documents'], 1):
+            chunks_context += f"**Chunk {i}:**\n{chunk}\n\n"
+        if result['shared']:
+            shared_with = sorted({desire_ids[ref['owner']] for ref in result['shared']})
+            chunks_context += (
+                f"*Also relevant: {len(result['shared'])} chunk(s) listed under "
+                + ", ".join(f"Desire {d}" for d in shared_with) + "*\n\n"
+            )
+    return chunks_context
+
+
+def describe_queries(desire_ids: List[str], query_results: List[Dict]) -> List[str]:
+    """One progress line per desire with the number of chunks found"""
+    query_details = []
+    for desire_id, result in zip(desire_ids, query_results):
+        found = len(result['documents']) + len(result['shared'])
+        detail = f"- Desire {desire_id}: {found} chunks found"
+        if result['shared']:
+            detail += f" ({len(result['shared'])} shared with other desires)"
+        query_details.append(detail)
+    return query_details
+
+
+def count_chunks(query_results: List[Dict]) -> int:
+    """Distinct chunks sent to the LLM (shared chunks are counted once, under their owner)"""
+    return sum(len(result['documents']) for result in query_results)
+
+
+def number_beliefs(extracted_beliefs: List[Dict], existing_beliefs: List[Dict]) -> List[Dict]:
+    """Copies of the extracted beliefs with ids after the existing ones and a timestamp"""
+    existing_ids = [b.get("id", 0) for b in existing_beliefs]
+    next_id = max(existing_ids) + 1 if existing_ids else 1
+
+    new_beliefs = []
+    for i, belief in enumerate(extracted_beliefs):
+        belief_copy = belief.copy()
+        belief_copy["id"] = next_id + i
+        if "timestamp" not in belief_copy:
+            belief_copy["timestamp"] = datetime.now().isoformat()
+        new_beliefs.append(belief_copy)
+    return new_beliefs
+
+
+def format_summary(desires_count: int, chunks_processed: int, beliefs_count: int) -> str:
+    """Chat message of a completed generation"""
+    return f"""✅ **Generation from scratch completed!** {beliefs_count} new beliefs added.
+
+Beliefs have been extracted directly from knowledge base chunks and are now available in the sidebar. Each belief has been classified for relevance to desires and includes citation of the original source.
+
+📊 **Generation summary:**
+- Desires analyzed: {desires_count}
+- Chunks processed: {chunks_processed}
+- Beliefs extracted: {beliefs_count}
+
+You can view beliefs in the sidebar or export them using the button at the bottom of the page."""
+
+
+def generate_beliefs_from_scratch(
+    doc_processor,
+    llm_manager,
+    provider: str,
+    model: str,
+    desires: List[Dict],
+    existing_beliefs: List[Dict],
+    on_progress: Optional[Callable[[str, List[str]], None]] = None
+) -> Dict[str, Any]:
+    """
+    Generates beliefs for the desires directly from the knowledge base chunks
+
+    Args:
+        doc_processor: DocumentProcessor of the session context
+        llm_manager: LLMManager used for the structured call
+        provider, model: LLM of the session
+        desires: Desires of the session
+        existing_beliefs: Beliefs already in the session (for the numbering)
+        on_progress: Receives (status line, per-desire query details) at every step
+
+    Returns:
+        Dict with 'beliefs' (new numbered beliefs, empty when none was
+        extracted), 'chunks_processed', 'query_details' and 'summary'
+        (chat message, None when no belief was extracted)
+
+    Raises:
+        StructuredOutputError: The LLM response contains no JSON document
+    """
+    def progress(status: str, details: List[str]):
+        if on_progress:
+            on_progress(status, details)
+
+    # STEP 1: Desires context
+    desires_context = build_desires_context(desires)
+
+    # STEP 2: Un solo batch di embedding e una sola query ChromaDB per tutti i desire
+    progress("🔍 Querying knowledge base for desires...", [])
+    desire_ids = [_desire_id(desire, idx) for idx, desire in enumerate(desires, 1)]
+    query_results = doc_processor.query_many(
+        query_texts=[_desire_description(desire) for desire in desires],
+        n_results=FROM_SCRATCH_N_RESULTS
+    )
+    query_details = describe_queries(desire_ids, query_results)
+
+    # STEP 3: Chunks context
+    progress("📝 Formatting context...", query_details)
+    chunks_context = build_chunks_context(desire_ids, query_results)
+
+    # STEP 4: Prompt
+    from_scratch_template = get_prompt('believer', use_cache=False, prompt_suffix='from_scratch_prompt')
+    from_scratch_prompt = from_scratch_template.replace('{desires_context}', desires_context)
+    from_scratch_prompt = from_scratch_prompt.replace('{chunks_context}', chunks_context)
+
+    # STEP 5: Chiamata LLM, i belief vengono contati man mano che arrivano nello stream JSON
+    progress("🤖 Analyzing with LLM...", query_details)
+    received = []
+
+    def on_belief(key, belief):
+        received.append(belief)
+        progress(f"🤖 {len(received)} beliefs received...", query_details)
+
+    structured = llm_manager.chat_structured(
+        provider=provider,
+        model=model,
+        messages=[{"role": "user", "content": from_scratch_prompt}],
+        system_prompt=None,
+        item_keys=["beliefs"],
+        on_item=on_belief,
+        max_tokens=8192,
+        temperature=0.5,  # Balanced mode: medium-high relevance (user preference)
+        agent='believer'
+    )
+
+    # STEP 6: Numerazione dei belief estratti
+    extracted_beliefs = structured["data"].get("beliefs", [])
+    new_beliefs = number_beliefs(extracted_beliefs, existing_beliefs)
+    chunks_processed = count_chunks(query_results)
+
+    return {
+        "beliefs": new_beliefs,
+        "chunks_processed": chunks_processed,
+        "query_details": query_details,
+        "summary": format_summary(len(desires), chunks_processed, len(new_beliefs)) if new_beliefs else None
+    }
@@ -0,0 +1,218 @@
+"""
+ChatLog - Segmented append-only conversation logs of the agents
+
+This module handles:
+- One log per agent and session in <session_dir>/chat_history/<agent>/,
+  split into JSONL segments of at most SEGMENT_MAX_MESSAGES messages
+- An index (index.json) listing the segments with their first sequence
+  number and, once closed, their message count; it is rewritten only
+  when a new segment starts, so appending a message writes one line
+- Reading the last page of a conversation (and the pages before it)
+  from the newest segments only
+- Streaming the full log, of one agent or of the whole session merged
+  by time, e.g. for exports
+
+Chat histories saved by earlier versions as session documents
+(LEGACY_CHAT_DOCUMENTS) are imported once into the empty log of their
+agent by SessionManager.
+"""
+
+import os
+import json
+import heapq
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils.atomic_json import decode_jsonl_lines, file_lock, read_json, truncate_partial_line, write_json_atomic
+
+
+CHAT_LOG_DIRNAME = "chat_history"
+INDEX_FILE = "index.json"
+SEGMENT_PREFIX = "segment_"
+SEGMENT_MAX_MESSAGES = 200
+DEFAULT_PAGE_SIZE = 50
+# Cronologie salvate come documento di sessione dalle versioni precedenti, per agente
+LEGACY_CHAT_DOCUMENTS = {"believer": "chat_history_believer.json"}
+
+
+class ChatLog:
+    """Append-only conversation log of one agent in one session"""
+
+    def __init__(self, log_dir: Path, agent: str, segment_max_messages: int = SEGMENT_MAX_MESSAGES):
+        self.log_dir = Path(log_dir)
+        self.agent = agent
+        self.segment_max_messages = segment_max_messages
+        self.index_path = self.log_dir / INDEX_FILE
+
+    def _load_index(self) -> Dict[str, Any]:
+        return read_json(str(self.index_path)) or {"agent": self.agent, "segments": []}
+
+    @staticmethod
+    def _read_segment(segment_path: Path) -> List[Dict[str, Any]]:
+        if not segment_path.exists():
+            return []
+        with open(segment_path, "r", encoding="utf-8") as f:
+            # Una riga senza newline finale è un append in corso: viene ignorata
+            return decode_jsonl_lines((line for line in f if line.endswith("\n")), str(segment_path))
+
+    def _count_active(self, segment: Dict[str, Any]) -> int:
+        """Messages of the active segment (bounded by segment_max_messages)"""
+        segment_path = self.log_dir / segment["file"]
+        if not segment_path.exists():
+            return 0
+        with open(segment_path, "rb") as f:
+            return f.read().count(b"\n")
+
+    def append(self, messages: Iterable[Dict[str, Any]], if_empty: bool = False) -> int:
+        """
+        Appends messages to the log
+
+        Args:
+            messages: Chat messages (role, content and any extra field)
+            if_empty: Append only when the log has no messages yet (one-shot imports)
+
+        Returns:
+            Total number of messages in the log
+        """
+        messages = list(messages)
+        with file_lock(str(self.index_path)):
+            index = self._load_index()
+            if not index["segments"]:
+                index["segments"].append({"file": f"{SEGMENT_PREFIX}{1:06d}.jsonl", "first_seq": 1, "count": None})
+                write_json_atomic(str(self.index_path), index)
+
+            active = index["segments"][-1]
+            # Una riga troncata da un crash non è contata e si fonderebbe con il primo messaggio nuovo
+            truncate_partial_line(str(self.log_dir / active["file"]))
+            active_count = self._count_active(active)
+            next_seq = active["first_seq"] + active_count
+            if not messages or (if_empty and next_seq > 1):
+                return next_seq - 1
+
+            now = datetime.now().isoformat()
+            lines: List[str] = []
+            for message in messages:
+                if active_count >= self.segment_max_messages:
+                    self._write_lines(active, lines)
+                    lines = []
+                    # Segmento pieno: si chiude nell'indice e se ne apre uno nuovo
+                    active["count"] = active_count
+                    active = {
+                        "file": f"{SEGMENT_PREFIX}{len(index['segments']) + 1:06d}.jsonl",
+                        "first_seq": next_seq,
+                        "count": None
+                    }
+                    index["segments"].append(active)
+                    write_json_atomic(str(self.index_path), index)
+                    active_count = 0
+
+                record = {"seq": next_seq, "ts": now}
+                record.update({key: value for key, value in message.items() if key not in record})
+                lines.append(json.dumps(record, ensure_ascii=False, default=str))
+                next_seq += 1
+                active_count += 1
+
+            self._write_lines(active, lines)
+            return next_seq - 1
+
+    def _write_lines(self, segment: Dict[str, Any], lines: List[str]):
+        if not lines:
+            return
+        with open(self.log_dir / segment["file"], "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def count(self) -> int:
+        """Number of messages in the log"""
+        index = self._load_index()
+        if not index["segments"]:
+            return 0
+        active = index["segments"][-1]
+        return active["first_seq"] + self._count_active(active) - 1
+
+    def read_page(self, page_size: int = DEFAULT_PAGE_SIZE, before_seq: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Reads a page of messages, reading only the segments it spans
+
+        Args:
+            page_size: Maximum number of messages
+            before_seq: Only messages with a lower sequence number (None for the last page)
+
+        Returns:
+            Messages in chronological order
+        """
+        page: List[Dict[str, Any]] = []
+        for segment in reversed(self._load_index()["segments"]):
+            if before_seq is not None and segment["first_seq"] >= before_seq:
+                continue
+            messages = self._read_segment(self.log_dir / segment["file"])
+            if before_seq is not None:
+                messages = [message for message in messages if message["seq"] < before_seq]
+            page = messages[-(page_size - len(page)):] + page
+            if len(page) >= page_size:
+                break
+        return page
+
+    def iter_messages(self) -> Iterator[Dict[str, Any]]:
+        """Streams all the messages of the log, one segment at a time"""
+        for segment in self._load_index()["segments"]:
+            segment_path = self.log_dir / segment["file"]
+            if not segment_path.exists():
+                continue
+            with open(segment_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.endswith("\n"):
+                        yield from decode_jsonl_lines([line], str(segment_path))
+
+
+class ChatLogStore:
+    """Chat logs of all the agents of the sessions under base_dir"""
+
+    def __init__(self, base_dir: Path, segment_max_messages: int = SEGMENT_MAX_MESSAGES):
+        self.base_dir = Path(base_dir)
+        self.segment_max_messages = segment_max_messages
+
+    def get(self, session_id: str, agent: str) -> ChatLog:
+        """Log of an agent in a session"""
+        return ChatLog(self.base_dir / session_id / CHAT_LOG_DIRNAME / agent, agent, self.segment_max_messages)
+
+    def agents(self, session_id: str) -> List[str]:
+        """Agents that have a log in the session"""
+        log_root = self.base_dir / session_id / CHAT_LOG_DIRNAME
+        if not log_root.exists():
+            return []
+        return sorted(path.name for path in log_root.iterdir() if (path / INDEX_FILE).exists())
+
+    def iter_session(self, session_id: str, agent: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Streams the messages of one agent, or of all the agents merged by time
+
+        Every message carries an "agent" field.
+        """
+        agents = [agent] if agent else self.agents(session_id)
+
+        def tagged(name: str) -> Iterator[Tuple[str, int, Dict[str, Any]]]:
+            for message in self.get(session_id, name).iter_messages():
+                yield message["ts"], message["seq"], {"agent": name, **message}
+
+        for _, _, message in heapq.merge(*(tagged(name) for name in agents), key=lambda item: item[:2]):
+            yield message
+
+    def export(self, session_id: str, target_path: Path, agent: Optional[str] = None) -> Path:
+        """Writes the log (one agent or the whole session) to a JSONL file, streaming it"""
+        target_path = Path(target_path)
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=f".{target_path.name}.", suffix=".tmp", dir=str(target_path.parent))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for message in self.iter_session(session_id, agent):
+                    f.write(json.dumps(message, ensure_ascii=False, default=str) + "\n")
+            os.replace(temp_path, target_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return target_path
@@ -0,0 +1,59 @@
+"""
+Chat page helpers - Streamlit helpers shared by the agent chat pages (Alì, Believer, Cuma)
+
+This module handles:
+- Appending the messages added to a page's chat history since the last
+  sync to the session chat log
+- Polling the background Auditor reviews and reloading the page as soon
+  as one completes
+"""
+
+from typing import Optional
+
+import streamlit as st
+
+from utils.auditor import AUDIT_SCHEDULING_CONFIG
+
+
+def sync_chat_log(agent: str, history_key: Optional[str] = None, logged_key: Optional[str] = None):
+    """
+    Appends the messages of an agent added since the last sync to the session chat log
+
+    The log (``SessionManager.sync_chat_log``) is append-only: only the
+    messages after ``st.session_state[logged_key]`` are written, so a turn
+    costs one appended line instead of a rewrite of the whole conversation.
+
+    Args:
+        agent: Agent name of the log (e.g. "ali")
+        history_key: Session state key of the chat history (default "<agent>_chat_history")
+        logged_key: Session state key of the number of logged messages (default "<agent>_chat_logged")
+    """
+    history_key = history_key or f"{agent}_chat_history"
+    logged_key = logged_key or f"{agent}_chat_logged"
+    if st.session_state.get("active_session"):
+        st.session_state[logged_key] = st.session_state.session_manager.sync_chat_log(
+            st.session_state.active_session,
+            agent,
+            st.session_state[history_key],
+            st.session_state.get(logged_key, 0)
+        )
+
+
+def render_audit_poller(auditor):
+    """
+    Reloads the page as soon as a background review of auditor completes
+
+    Uses a Streamlit fragment that polls the auditor every
+    ``AUDIT_SCHEDULING_CONFIG["poll_interval_seconds"]``; on Streamlit
+    versions without fragments the card appears on the next rerun.
+    """
+    fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    if not auditor or fragment is None:
+        return
+
+    @fragment(run_every=AUDIT_SCHEDULING_CONFIG["poll_interval_seconds"])
+    def poll_reviews():
+        if auditor.has_completed_reviews():
+            st.rerun()
+
+    poll_reviews()
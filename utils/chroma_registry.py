@@ -0,0 +1,154 @@
+import os
+import threading
+from typing import Dict, Optional
+
+import chromadb
+
+
+class _ClientEntry:
+    """Registry entry: client of a persist directory, its users and resolved collections"""
+
+    def __init__(self, client):
+        self.client = client
+        self.refcount = 0
+        self.collections = {}  # nome preferito -> handle della collection
+
+
+_entries: Dict[str, _ClientEntry] = {}
+_registry_lock = threading.RLock()
+
+
+def _key(persist_directory: str) -> str:
+    return os.path.normcase(os.path.abspath(persist_directory))
+
+
+def acquire_client(persist_directory: str):
+    """
+    Returns the shared PersistentClient of a persist directory and increments its reference count
+
+    The client is created on first use and reused by every DocumentProcessor
+    (pages, sessions, reruns) pointing to the same directory.
+    """
+    key = _key(persist_directory)
+    with _registry_lock:
+        entry = _entries.get(key)
+        if entry is None:
+            os.makedirs(persist_directory, exist_ok=True)
+            entry = _ClientEntry(chromadb.PersistentClient(path=persist_directory))
+            _entries[key] = entry
+        entry.refcount += 1
+        return entry.client
+
+
+def release_client(persist_directory: str):
+    """
+    Decrements the reference count of a client
+
+    The client stays warm in the registry for the next user; use
+    close_client to actually evict it.
+    """
+    key = _key(persist_directory)
+    with _registry_lock:
+        entry = _entries.get(key)
+        if entry and entry.refcount > 0:
+            entry.refcount -= 1
+
+
+def get_collection(persist_directory: str, name: str, metadata: Optional[Dict] = None):
+    """
+    Returns the collection handle of a persist directory, resolved once and then reused
+
+    The collection is looked up by name. Databases migrated from v1 may hold
+    a single collection with a different name: in that case that collection
+    is used.
+
+    Args:
+        persist_directory: ChromaDB directory (the client must have been acquired)
+        name: Expected collection name
+        metadata: Metadata used when the collection has to be created
+    """
+    key = _key(persist_directory)
+    with _registry_lock:
+        entry = _entries.get(key)
+        if entry is None:
+            raise RuntimeError(f"No ChromaDB client acquired for {persist_directory}")
+
+        collection = entry.collections.get(name)
+        if collection is not None:
+            return collection
+
+        existing_names = [c if isinstance(c, str) else c.name for c in entry.client.list_collections()]
+        if name in existing_names:
+            collection = entry.client.get_collection(name=name)
+        elif existing_names:
+            # Retrocompatibilità con i dati migrati da v1
+            collection = entry.client.get_collection(name=existing_names[0])
+        else:
+            collection = entry.client.get_or_create_collection(name=name, metadata=metadata)
+
+        entry.collections[name] = collection
+        return collection
+
+
+def invalidate_collections(persist_directory: str):
+    """Drops the cached collection handles of a directory (e.g. after deleting collections)"""
+    with _registry_lock:
+        entry = _entries.get(_key(persist_directory))
+        if entry:
+            entry.collections.clear()
+
+
+def close_client(persist_directory: str, force: bool = False) -> bool:
+    """
+    Evicts the client of a persist directory from the registry and stops it
+
+    Args:
+        persist_directory: ChromaDB directory
+        force: Close even if other users still hold a reference
+
+    Returns:
+        True if the client was closed
+    """
+    key = _key(persist_directory)
+    with _registry_lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return False
+        if entry.refcount > 0 and not force:
+            return False
+        del _entries[key]
+
+    _stop_client(entry.client)
+    return True
+
+
+def close_all_clients():
+    """Evicts and stops every client in the registry"""
+    with _registry_lock:
+        entries = list(_entries.values())
+        _entries.clear()
+
+    for entry in entries:
+        _stop_client(entry.client)
+
+
+def get_registry_stats() -> Dict[str, int]:
+    """Returns the reference count of every registered persist directory"""
+    with _registry_lock:
+        return {key: entry.refcount for key, entry in _entries.items()}
+
+
+def _stop_client(client):
+    """Releases the SQLite/HNSW files held by a client (ChromaDB has no public close)"""
+    try:
+        system = getattr(client, "_system", None)
+        if system is not None:
+            system.stop()
+
+        from chromadb.api.client import SharedSystemClient
+        identifiers = getattr(SharedSystemClient, "_identifier_to_system", {})
+        for identifier, cached_system in list(identifiers.items()):
+            if cached_system is system:
+                identifiers.pop(identifier, None)
+    except Exception as e:
+        print(f"Error closing ChromaDB client: {e}")
@@ -4,6 +4,11 @@ import shutil
 from typing import List, Dict, Optional
 from datetime import datetime
 
+from utils import chroma_registry
+from utils.atomic_json import update_json, write_json_atomic
+from utils.metadata_cache import get_metadata_cache
+from utils.embedding_service import DEFAULT_EMBEDDING_BACKEND, validate_embedding_backend
+
 
 class ContextManager:
     """Manages the creation, selection, and deletion of multiple contexts"""
@@ -12,13 +17,15 @@ class ContextManager:
         self.base_directory = base_directory
         os.makedirs(base_directory, exist_ok=True)
 
-    def create_context(self, name: str, description: str = "") -> Dict:
+    def create_context(self, name: str, description: str = "",
+                       embedding_backend: str = DEFAULT_EMBEDDING_BACKEND) -> Dict:
         """
         Creates a new context with its folder structure
 
         Args:
             name: Context name (will be normalized)
             description: Optional context description
+            embedding_backend: Embedding backend used to build (and query) the index
 
         Returns:
             Dict with the created context information
@@ -31,6 +38,8 @@ class ContextManager:
         if os.path.exists(context_path):
             raise ValueError(f"The context '{name}' already exists")
 
+        validate_embedding_backend(embedding_backend)
+
         # Crea la struttura delle cartelle
         os.makedirs(context_path, exist_ok=True)
         os.makedirs(os.path.join(context_path, "chroma_db"), exist_ok=True)
@@ -43,12 +52,12 @@ class ContextManager:
             "created_at": datetime.now().isoformat(),
             "updated_at": datetime.now().isoformat(),
             "document_count": 0,
-            "belief_count": 0
+            "belief_count": 0,
+            "embedding_backend": embedding_backend
         }
 
         metadata_path = os.path.join(context_path, "context_metadata.json")
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        write_json_atomic(metadata_path, metadata)
 
         return metadata
 
@@ -64,17 +73,18 @@ class ContextManager:
         if not os.path.exists(self.base_directory):
             return contexts
 
+        # I metadati non modificati dall'ultimo rerun arrivano dalla cache (validata su mtime e dimensione)
+        cache = get_metadata_cache()
         for item in os.listdir(self.base_directory):
             context_path = os.path.join(self.base_directory, item)
             if os.path.isdir(context_path):
                 metadata_path = os.path.join(context_path, "context_metadata.json")
-                if os.path.exists(metadata_path):
-                    try:
-                        with open(metadata_path, 'r', encoding='utf-8') as f:
-                            metadata = json.load(f)
-                            contexts.append(metadata)
-                    except Exception as e:
-                        print(f"Error loading context {item}: {e}")
+                try:
+                    metadata = cache.read_json(metadata_path)
+                    if metadata is not None:
+                        contexts.append(metadata)
+                except Exception as e:
+                    print(f"Error loading context {item}: {e}")
 
         # Ordina per data di creazione (più recente prima)
         contexts.sort(key=lambda x: x.get('created_at', ''), reverse=True)
@@ -93,12 +103,10 @@ class ContextManager:
         context_path = os.path.join(self.base_directory, normalized_name)
         metadata_path = os.path.join(context_path, "context_metadata.json")
 
-        if os.path.exists(metadata_path):
-            try:
-                with open(metadata_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error loading context: {e}")
+        try:
+            return get_metadata_cache().read_json(metadata_path)
+        except Exception as e:
+            print(f"Error loading context: {e}")
 
         return None
 
@@ -120,16 +128,13 @@ class ContextManager:
             return False
 
         try:
-            with open(metadata_path, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
-
-            # Aggiorna i campi
-            metadata.update(updates)
-            metadata['updated_at'] = datetime.now().isoformat()
-
-            with open(metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            # Aggiorna i campi sotto il lock del file: aggiornamenti concorrenti non si perdono
+            def apply_updates(metadata: Dict) -> Dict:
+                metadata.update(updates)
+                metadata['updated_at'] = datetime.now().isoformat()
+                return metadata
 
+            update_json(metadata_path, apply_updates)
             return True
         except Exception as e:
             print(f"Error updating context: {e}")
@@ -150,6 +155,9 @@ class ContextManager:
         if not os.path.exists(context_path):
             return False
 
+        # Chiudi il client ChromaDB condiviso: i file del database devono essere rilasciati
+        chroma_registry.close_client(os.path.join(context_path, "chroma_db"), force=True)
+
         try:
             shutil.rmtree(context_path)
             return True
@@ -259,8 +267,7 @@ class ContextManager:
                 # Aggiorna i metadati
                 metadata['imported_at'] = datetime.now().isoformat()
                 metadata_path = os.path.join(context_path, "context_metadata.json")
-                with open(metadata_path, 'w', encoding='utf-8') as f:
-                    json.dump(metadata, f, ensure_ascii=False, indent=2)
+                write_json_atomic(metadata_path, metadata)
 
                 return metadata
         except Exception as e:
@@ -1,24 +1,186 @@
 import os
+import io
 import json
-from typing import List, Dict
+import hashlib
+from datetime import datetime
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Tuple, Iterable, Iterator
 import PyPDF2
 import requests
 from bs4 import BeautifulSoup
-import chromadb
 from chromadb.config import Settings
+from utils import chroma_registry
+from utils.atomic_json import write_json_atomic
+from utils.embedding_service import get_embedding_service, validate_embedding_backend, DEFAULT_EMBEDDING_BACKEND
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = 256
+DEFAULT_CHROMA_MAX_BATCH = 5000
+MANIFEST_FILENAME = "source_manifest.json"
+
+
+# I PDF oltre una di queste soglie vengono indicizzati in streaming (memoria limitata):
+# il numero di pagine conta più della dimensione, un PDF testuale di 1.500 pagine può pesare pochi MB
+STREAMING_THRESHOLD_BYTES = 20 * 1024 * 1024
+STREAMING_THRESHOLD_PAGES = 200
+STREAM_BUFFER_CHARS = CHUNK_SIZE * 8
+
+
+def _create_text_splitter() -> RecursiveCharacterTextSplitter:
+    """Creates the text splitter shared by all extraction paths"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+    )
+
+
+def _iter_pdf_pages(file) -> Iterator[Tuple[int, str]]:
+    """
+    Yields the text of a PDF one page at a time
+
+    Args:
+        file: PDF file object (or path)
+
+    Yields:
+        Tuple (page_number, page_text) with 1-based page numbers
+    """
+    pdf_reader = PyPDF2.PdfReader(file)
+    for page_number, page in enumerate(pdf_reader.pages, 1):
+        yield page_number, page.extract_text() or ""
+
+
+def _pdf_page_count(file) -> int:
+    """
+    Returns the number of pages of a PDF without extracting any text
+
+    Args:
+        file: PDF file object (the read position is restored)
+
+    Returns:
+        Page count, 0 when the PDF cannot be parsed (the extraction will report the error)
+    """
+    position = file.tell() if hasattr(file, 'tell') else None
+    try:
+        return len(PyPDF2.PdfReader(file).pages)
+    except Exception:
+        return 0
+    finally:
+        if position is not None:
+            file.seek(position)
+
+
+def _iter_page_chunks(pages: Iterable[Tuple[int, str]],
+                      text_splitter: RecursiveCharacterTextSplitter) -> Iterator[Dict]:
+    """
+    Splits a stream of pages into chunks keeping memory bounded
+
+    Pages are accumulated in a small buffer; once the buffer is large enough
+    it is split and every chunk except the last one is emitted. The last
+    chunk is carried over to the next round, so chunks crossing a page
+    boundary keep the same overlap they would have on the full text.
+
+    Args:
+        pages: Iterable of (page_number, page_text)
+        text_splitter: Splitter used to chunk the buffer
+
+    Yields:
+        Dicts with 'text', 'page_start' and 'page_end'
+    """
+    buffer = ""
+    page_offsets = []  # (offset nel buffer, numero di pagina)
+
+    def locate(chunks):
+        positions = []
+        search_from = 0
+        for chunk in chunks:
+            position = buffer.find(chunk, search_from)
+            if position == -1:
+                position = search_from
+            positions.append(position)
+            search_from = position + 1
+        return positions
+
+    def page_at(offset):
+        index = bisect_right([o for o, _ in page_offsets], offset) - 1
+        return page_offsets[max(index, 0)][1]
+
+    def build(chunk, start):
+        return {
+            "text": chunk,
+            "page_start": page_at(start),
+            "page_end": page_at(start + max(len(chunk) - 1, 0))
+        }
+
+    for page_number, page_text in pages:
+        if not page_text:
+            continue
+        page_offsets.append((len(buffer), page_number))
+        buffer += page_text
+
+        if len(buffer) < STREAM_BUFFER_CHARS:
+            continue
+
+        chunks = text_splitter.split_text(buffer)
+        if len(chunks) < 2:
+            continue
+
+        positions = locate(chunks)
+        for chunk, start in zip(chunks[:-1], positions[:-1]):
+            yield build(chunk, start)
+
+        # Mantieni l'ultimo chunk come inizio del buffer successivo
+        carry_start = positions[-1]
+        carry_page = page_at(carry_start)
+        buffer = buffer[carry_start:]
+        page_offsets = [(0, carry_page)] + [
+            (offset - carry_start, number) for offset, number in page_offsets if offset > carry_start
+        ]
+
+    if buffer:
+        chunks = text_splitter.split_text(buffer)
+        for chunk, start in zip(chunks, locate(chunks)):
+            yield build(chunk, start)
+
+
+def _extract_file_chunks(file_name: str, data: bytes) -> List[Dict]:
+    """
+    Extracts and chunks the content of a single file
+
+    Defined at module level so it can be executed inside a worker process
+    of the batch ingestion pool.
+
+    Args:
+        file_name: Original file name (the extension selects the extractor)
+        data: Raw file content
+
+    Returns:
+        List of chunk dicts with 'text' (and 'page_start'/'page_end' for PDFs)
+    """
+    text_splitter = _create_text_splitter()
+
+    if file_name.lower().endswith('.pdf'):
+        return list(_iter_page_chunks(_iter_pdf_pages(io.BytesIO(data)), text_splitter))
+
+    return [{"text": chunk} for chunk in text_splitter.split_text(data.decode('utf-8'))]
+
+
 class DocumentProcessor:
     """Manages document processing and indexing for multiple contexts"""
 
-    def __init__(self, context_name: str = None, persist_directory: str = None):
+    def __init__(self, context_name: str = None, persist_directory: str = None, embedding_backend: str = None):
         """
         Initializes the DocumentProcessor for a specific context
 
         Args:
             context_name: Normalized context name
             persist_directory: Directory where to save ChromaDB (optional, calculated from context_name)
+            embedding_backend: Embedding backend (optional, read from context_metadata.json so that
+                queries always use the encoder the index was built with)
         """
         self.context_name = context_name
 
@@ -31,11 +193,10 @@ class DocumentProcessor:
             # Fallback alla directory predefinita se non viene specificato nulla
             self.persist_directory = "./data/chroma_db"
 
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
+        self.embedding_backend = validate_embedding_backend(
+            embedding_backend or self._read_context_embedding_backend()
         )
+        self.text_splitter = _create_text_splitter()
         self._embeddings = None  # Lazy loading: carica solo quando necessario
         self.client = None
         self.collection = None
@@ -44,82 +205,110 @@ class DocumentProcessor:
     def embeddings(self):
         """Property for lazy loading of embedding model - loads only when needed"""
         if self._embeddings is None:
-            from langchain_huggingface import HuggingFaceEmbeddings
-            self._embeddings = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-            )
+            # Modello condiviso da tutte le istanze del processo (pagine, sessioni, contesti)
+            self._embeddings = get_embedding_service(self.embedding_backend)
         return self._embeddings
 
-    def initialize_db(self):
-        """Initializes the ChromaDB database for the current context"""
-        # Crea la directory se non esiste
-        os.makedirs(self.persist_directory, exist_ok=True)
+    def _read_context_embedding_backend(self) -> str:
+        """Reads the embedding backend recorded in the context metadata"""
+        metadata_path = os.path.join(os.path.dirname(os.path.abspath(self.persist_directory)), "context_metadata.json")
+        if not os.path.exists(metadata_path):
+            return DEFAULT_EMBEDDING_BACKEND
 
-        self.client = chromadb.PersistentClient(path=self.persist_directory)
+        try:
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("embedding_backend", DEFAULT_EMBEDDING_BACKEND)
+        except Exception as e:
+            print(f"Error reading context metadata: {e}")
+            return DEFAULT_EMBEDDING_BACKEND
 
-        # Prova prima a recuperare una collection esistente
-        # Questo è importante per la retrocompatibilità con i dati migrati da v1
-        existing_collections = self.client.list_collections()
+    def initialize_db(self):
+        """Initializes the ChromaDB database for the current context"""
+        # Il client è condiviso a livello di processo per directory: acquisito una sola volta per istanza
+        if self.client is None:
+            self.client = chroma_registry.acquire_client(self.persist_directory)
+
+        # Crea una nuova collection con nome specifico per il contesto
+        collection_name = f"knowledge_base_{self.context_name}" if self.context_name else "knowledge_base"
+        # Normalizza il nome della collection (ChromaDB ha restrizioni sui nomi)
+        collection_name = self._normalize_collection_name(collection_name)
+
+        # La collection viene risolta per nome una sola volta e poi riutilizzata
+        # (i dati migrati da v1 possono avere un nome diverso: vedi chroma_registry.get_collection)
+        self.collection = chroma_registry.get_collection(
+            self.persist_directory,
+            collection_name,
+            metadata={"hnsw:space": "cosine", "context": self.context_name or "default"}
+        )
 
-        if existing_collections:
-            # Usa la prima collection disponibile (per retrocompatibilità)
-            self.collection = existing_collections[0]
-        else:
-            # Crea una nuova collection con nome specifico per il contesto
-            collection_name = f"knowledge_base_{self.context_name}" if self.context_name else "knowledge_base"
-            # Normalizza il nome della collection (ChromaDB ha restrizioni sui nomi)
-            collection_name = self._normalize_collection_name(collection_name)
-
-            self.collection = self.client.get_or_create_collection(
-                name=collection_name,
-                metadata={"hnsw:space": "cosine", "context": self.context_name or "default"}
-            )
+    def release_connections(self, close: bool = False):
+        """
+        Releases this instance's reference to the shared ChromaDB client
 
-    def release_connections(self):
-        """Releases all connections to the ChromaDB database"""
+        Args:
+            close: Also evict and stop the client if no one else is using it
+                (e.g. before deleting the context directory)
+        """
         try:
-            if self.collection:
-                # Reset della collection
-                self.collection = None
+            self.collection = None
             if self.client:
-                # Forza la chiusura del client
-                # ChromaDB non ha un metodo close esplicito, ma possiamo resettare il riferimento
                 self.client = None
+                chroma_registry.release_client(self.persist_directory)
+            if close:
+                chroma_registry.close_client(self.persist_directory)
         except Exception as e:
             print(f"Error releasing connections: {e}")
 
     def clear_database(self):
         """Clears the existing database for the current context"""
-        # Prima rilascia tutte le connessioni
-        self.release_connections()
+        if self.client is None:
+            self.client = chroma_registry.acquire_client(self.persist_directory)
 
-        # Crea un nuovo client temporaneo per l'eliminazione
         try:
-            temp_client = chromadb.PersistentClient(path=self.persist_directory)
-            collections = temp_client.list_collections()
+            collections = self.client.list_collections()
 
             # Elimina tutte le collections esistenti per questo contesto
             for collection in collections:
+                collection_name = collection if isinstance(collection, str) else collection.name
                 try:
-                    temp_client.delete_collection(collection.name)
+                    self.client.delete_collection(collection_name)
                 except Exception as e:
-                    print(f"Error deleting collection {collection.name}: {e}")
-
-            # Reset del client temporaneo
-            temp_client = None
+                    print(f"Error deleting collection {collection_name}: {e}")
         except Exception as e:
             print(f"Error clearing database: {e}")
 
-        # Re-inizializza il database con un nuovo client
+        # Gli handle in cache puntano alle collection eliminate
+        chroma_registry.invalidate_collections(self.persist_directory)
+        self.collection = None
+
+        # Rimuovi il manifest delle fonti indicizzate
+        if os.path.exists(self.manifest_path):
+            try:
+                os.remove(self.manifest_path)
+            except Exception as e:
+                print(f"Error removing manifest: {e}")
+
+        # Ricrea la collection del contesto
         self.initialize_db()
 
     def process_pdf(self, file) -> List[str]:
         """Extracts text from a PDF file"""
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        return self.text_splitter.split_text(text)
+        return [chunk["text"] for chunk in self.iter_pdf_chunks(file)]
+
+    def iter_pdf_chunks(self, file) -> Iterator[Dict]:
+        """
+        Streams the chunks of a PDF file page by page
+
+        Only a few pages of text are held in memory at any time, regardless
+        of the document size.
+
+        Args:
+            file: PDF file object
+
+        Yields:
+            Dicts with 'text', 'page_start' and 'page_end'
+        """
+        return _iter_page_chunks(_iter_pdf_pages(file), self.text_splitter)
 
     def process_text(self, file) -> List[str]:
         """Processes text or markdown files"""
@@ -146,24 +335,272 @@ class DocumentProcessor:
         except Exception as e:
             raise Exception(f"Error retrieving URL: {str(e)}")
 
-    def add_documents(self, chunks: List[str], source: str):
-        """Adds documents to the vector database of the current context"""
+    def add_documents(self, chunks: List[str], source: str, chunk_metadatas: Optional[List[Dict]] = None) -> Dict:
+        """
+        Adds (or re-ingests) a source in the vector database of the current context
+
+        Chunks are keyed by content hash: when the source was already
+        ingested only new or changed chunks are embedded, and chunks that
+        disappeared from the source are deleted.
+
+        Args:
+            chunks: Text chunks of the source
+            source: Source name
+            chunk_metadatas: Optional extra metadata for each chunk (e.g. page range)
+
+        Returns:
+            Dict with the number of 'added', 'removed' and 'unchanged' chunks
+        """
+        records = [
+            dict(chunk_metadatas[i] if chunk_metadatas else {}, text=chunk)
+            for i, chunk in enumerate(chunks)
+        ]
+        return self.add_documents_batch([(source, records)])[source]
+
+    def add_document_stream(self, chunks: Iterable[Dict], source: str,
+                            batch_size: int = EMBED_BATCH_SIZE) -> Dict:
+        """
+        Adds (or re-ingests) a stream of chunks in fixed-size batches
+
+        Each batch is embedded and written to ChromaDB before the next one is
+        read, so memory usage does not depend on the document size. Chunks
+        already indexed for the source are not embedded again; chunks no
+        longer present are deleted once the stream is exhausted.
+
+        Args:
+            chunks: Iterable of chunk dicts with 'text' and optional page metadata
+            source: Source name
+            batch_size: Number of chunks embedded and inserted per batch
+
+        Returns:
+            Dict with the number of 'added', 'removed' and 'unchanged' chunks
+        """
         if not self.collection:
             self.initialize_db()
 
-        # Genera embeddings
-        embeddings = self.embeddings.embed_documents(chunks)
+        manifest = self._load_manifest()
+        existing_ids = set(self._get_source_chunk_ids(source, manifest))
+        seen_ids = []
+        seen_set = set()
+        stats = {"added": 0, "removed": 0, "unchanged": 0}
+
+        batch = []
+        index = 0
+
+        def flush(batch_records):
+            new_records = [r for r in batch_records if r["id"] not in existing_ids]
+            kept_records = [r for r in batch_records if r["id"] in existing_ids]
+            self._write_new_records(new_records, batch_size)
+            self._refresh_kept_records(kept_records)
+            stats["added"] += len(new_records)
+            stats["unchanged"] += len(kept_records)
+
+        for chunk in chunks:
+            record = self._build_record(source, index, chunk)
+            if record["id"] in seen_set:
+                continue
+            seen_set.add(record["id"])
+            seen_ids.append(record["id"])
+            batch.append(record)
+            index += 1
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+
+        if batch:
+            flush(batch)
+
+        removed_ids = [chunk_id for chunk_id in existing_ids if chunk_id not in seen_set]
+        if removed_ids:
+            self.collection.delete(ids=removed_ids)
+        stats["removed"] = len(removed_ids)
+
+        self._set_manifest_entry(manifest, source, seen_ids)
+        self._save_manifest(manifest)
+
+        return stats
+
+    def process_files_batch(
+        self,
+        files: List,
+        source_prefix: str,
+        max_workers: Optional[int] = None
+    ) -> Tuple[List[Tuple[str, List[Dict]]], List[Tuple[str, str]]]:
+        """
+        Extracts and chunks several uploaded files in parallel
 
-        # Aggiungi al database
-        ids = [f"{source}_{i}" for i in range(len(chunks))]
-        metadatas = [{"source": source, "chunk_id": i, "context": self.context_name or "default"} for i in range(len(chunks))]
+        Files are parsed in a process pool, since PDF parsing is CPU bound.
+        With a single file (or when the pool cannot be started) the files
+        are processed in the current process.
 
-        self.collection.add(
-            embeddings=embeddings,
-            documents=chunks,
-            metadatas=metadatas,
-            ids=ids
-        )
+        Args:
+            files: Uploaded files (objects exposing ``name`` and ``getvalue()``/``read()``)
+            source_prefix: Prefix used to build the source name (e.g. "PDF", "TXT", "MD")
+            max_workers: Maximum number of worker processes (default: CPU count)
+
+        Returns:
+            Tuple (documents, errors): documents is a list of (source, chunk dicts)
+            in upload order, errors is a list of (file_name, error_message)
+        """
+        payloads = []
+        for file in files:
+            data = file.getvalue() if hasattr(file, 'getvalue') else file.read()
+            payloads.append((file.name, data))
+
+        documents = []
+        errors = []
+
+        if not payloads:
+            return documents, errors
+
+        workers = max_workers or os.cpu_count() or 1
+        workers = min(workers, len(payloads))
+
+        results = None
+        if workers > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(_extract_file_chunks, name, data) for name, data in payloads]
+                    results = []
+                    for future in futures:
+                        try:
+                            results.append((future.result(), None))
+                        except Exception as e:
+                            results.append((None, str(e)))
+            except Exception as e:
+                # Il pool non è disponibile (es. ambiente senza fork): fallback seriale
+                print(f"Process pool not available, falling back to serial extraction: {e}")
+                results = None
+
+        if results is None:
+            results = []
+            for name, data in payloads:
+                try:
+                    results.append((_extract_file_chunks(name, data), None))
+                except Exception as e:
+                    results.append((None, str(e)))
+
+        for (name, _), (chunks, error) in zip(payloads, results):
+            if error is not None:
+                errors.append((name, error))
+            else:
+                documents.append((f"{source_prefix}: {name}", chunks))
+
+        return documents, errors
+
+    def add_documents_batch(self, documents: List[Tuple[str, List[Dict]]],
+                            embed_batch_size: int = EMBED_BATCH_SIZE) -> Dict[str, Dict]:
+        """
+        Adds (or re-ingests) several sources to the vector database in one commit
+
+        For every source the new chunk set is compared with the manifest of
+        the previous ingestion: only new or changed chunks are embedded (in
+        large batches across all sources) and written to ChromaDB once,
+        chunks that disappeared are deleted.
+
+        Args:
+            documents: List of (source, chunk dicts)
+            embed_batch_size: Number of chunks embedded per model call
+
+        Returns:
+            Dict source -> {'added', 'removed', 'unchanged'}
+        """
+        if not self.collection:
+            self.initialize_db()
+
+        manifest = self._load_manifest()
+
+        new_records = []
+        kept_records = []
+        removed_ids = []
+        source_ids = {}
+        stats = {}
+
+        for source, chunks in documents:
+            existing_ids = set(self._get_source_chunk_ids(source, manifest))
+
+            records = []
+            seen = set()
+            for chunk in chunks:
+                record = self._build_record(source, len(records), chunk)
+                if record["id"] in seen:
+                    continue  # Chunk duplicato all'interno della stessa fonte
+                seen.add(record["id"])
+                records.append(record)
+
+            source_new = [r for r in records if r["id"] not in existing_ids]
+            source_kept = [r for r in records if r["id"] in existing_ids]
+            source_removed = [chunk_id for chunk_id in existing_ids if chunk_id not in seen]
+
+            new_records.extend(source_new)
+            kept_records.extend(source_kept)
+            removed_ids.extend(source_removed)
+            source_ids[source] = [r["id"] for r in records]
+            stats[source] = {
+                "added": len(source_new),
+                "removed": len(source_removed),
+                "unchanged": len(source_kept)
+            }
+
+        self._write_new_records(new_records, embed_batch_size)
+        self._refresh_kept_records(kept_records)
+        if removed_ids:
+            self.collection.delete(ids=removed_ids)
+
+        for source, ids in source_ids.items():
+            self._set_manifest_entry(manifest, source, ids)
+        self._save_manifest(manifest)
+
+        return stats
+
+    def ingest_files(self, files: List, source_prefix: str, max_workers: Optional[int] = None) -> Dict:
+        """
+        Batch ingestion pipeline: parallel extraction, batched embedding, single commit
+
+        Args:
+            files: Uploaded files
+            source_prefix: Prefix used to build the source name (e.g. "PDF", "TXT", "MD")
+            max_workers: Maximum number of worker processes for extraction
+
+        Returns:
+            Dict with 'processed' (list of (source, chunk count)), 'changes'
+            (source -> added/removed/unchanged counts), 'errors'
+            (list of (file_name, error_message)) and 'total_chunks'
+        """
+        # I PDF molto grandi vengono indicizzati in streaming per mantenere la memoria limitata
+        large_pdfs = [f for f in files if self._should_stream(f)]
+        regular_files = [f for f in files if f not in large_pdfs]
+
+        documents, errors = self.process_files_batch(regular_files, source_prefix, max_workers=max_workers)
+
+        changes = {}
+        try:
+            changes = self.add_documents_batch(documents)
+        except Exception as e:
+            # Il commit è unico: se fallisce, nessuna delle fonti è stata indicizzata
+            errors.extend((source, str(e)) for source, _ in documents)
+            documents = []
+
+        processed = [
+            (source, changes[source]["added"] + changes[source]["unchanged"])
+            for source, _ in documents
+        ]
+
+        for pdf_file in large_pdfs:
+            source = f"{source_prefix}: {pdf_file.name}"
+            try:
+                source_changes = self.add_document_stream(self.iter_pdf_chunks(pdf_file), source)
+                changes[source] = source_changes
+                processed.append((source, source_changes["added"] + source_changes["unchanged"]))
+            except Exception as e:
+                errors.append((pdf_file.name, str(e)))
+
+        return {
+            "processed": processed,
+            "changes": changes,
+            "errors": errors,
+            "total_chunks": sum(count for _, count in processed)
+        }
 
     def query(self, query_text: str, n_results: int = 5) -> List[Dict]:
         """Queries the vector database of the current context"""
@@ -179,6 +616,77 @@ class DocumentProcessor:
 
         return results
 
+    def query_many(self, query_texts: List[str], n_results: int = 5, deduplicate: bool = True) -> List[Dict]:
+        """
+        Queries the vector database with several texts in one round trip
+
+        All query texts are embedded in a single batch and sent to ChromaDB
+        as one multi-embedding query.
+
+        Args:
+            query_texts: Query texts
+            n_results: Number of chunks per query
+            deduplicate: If True a chunk retrieved by several queries is kept only
+                in the query where it is closest; the other queries list it in 'shared'
+
+        Returns:
+            One dict per query text (same order) with flat lists 'ids', 'documents',
+            'metadatas', 'distances' and 'shared' (list of {'id', 'owner'}, where
+            owner is the index of the query that holds the chunk text)
+        """
+        if not query_texts:
+            return []
+
+        if not self.collection:
+            self.initialize_db()
+
+        # Con sentence-transformers query e documenti usano lo stesso encoder: un solo batch
+        query_embeddings = self.embeddings.embed_documents(list(query_texts))
+
+        raw = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results
+        )
+
+        results = []
+        for q in range(len(query_texts)):
+            def column(key):
+                values = raw.get(key) if raw else None
+                return list(values[q]) if values and values[q] is not None else []
+
+            ids = column("ids")
+            results.append({
+                "ids": ids,
+                "documents": column("documents") or [None] * len(ids),
+                "metadatas": column("metadatas") or [None] * len(ids),
+                "distances": column("distances") or [None] * len(ids),
+                "shared": []
+            })
+
+        if not deduplicate:
+            return results
+
+        # Ogni chunk resta nella query più vicina; nelle altre viene solo referenziato
+        owners = {}
+        for q, result in enumerate(results):
+            for chunk_id, distance in zip(result["ids"], result["distances"]):
+                current = owners.get(chunk_id)
+                if current is None or (distance is not None and current[1] is not None and distance < current[1]):
+                    owners[chunk_id] = (q, distance)
+
+        for q, result in enumerate(results):
+            kept = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+            for position, chunk_id in enumerate(result["ids"]):
+                owner = owners[chunk_id][0]
+                if owner == q:
+                    for key in kept:
+                        kept[key].append(result[key][position])
+                else:
+                    result["shared"].append({"id": chunk_id, "owner": owner})
+            result.update(kept)
+
+        return results
+
     def get_stats(self) -> Dict:
         """Returns statistics on the current context database"""
         if not self.collection:
@@ -239,6 +747,137 @@ class DocumentProcessor:
 
         return documents
 
+    @staticmethod
+    def _chunk_hash(source: str, text: str) -> str:
+        """Returns the content hash used as ChromaDB id of a chunk"""
+        return hashlib.sha256(f"{source}\x00{text}".encode('utf-8')).hexdigest()
+
+    def _build_record(self, source: str, index: int, chunk: Dict) -> Dict:
+        """Builds id, text and metadata of a chunk to be indexed"""
+        return {
+            "id": self._chunk_hash(source, chunk["text"]),
+            "text": chunk["text"],
+            "metadata": self._build_chunk_metadata(source, index, chunk)
+        }
+
+    def _write_new_records(self, records: List[Dict], embed_batch_size: int):
+        """Embeds new records in batches and adds them to ChromaDB"""
+        if not records:
+            return
+
+        texts = [r["text"] for r in records]
+
+        # Genera embeddings in batch
+        embeddings = []
+        for start in range(0, len(texts), embed_batch_size):
+            embeddings.extend(self.embeddings.embed_documents(texts[start:start + embed_batch_size]))
+
+        # Aggiungi al database (ChromaDB limita la dimensione massima di un batch)
+        max_batch = self._get_max_batch_size()
+        for start in range(0, len(records), max_batch):
+            end = start + max_batch
+            self.collection.add(
+                embeddings=embeddings[start:end],
+                documents=texts[start:end],
+                metadatas=[r["metadata"] for r in records[start:end]],
+                ids=[r["id"] for r in records[start:end]]
+            )
+
+    def _refresh_kept_records(self, records: List[Dict]):
+        """Updates the metadata (position, page range) of unchanged chunks without re-embedding them"""
+        max_batch = self._get_max_batch_size()
+        for start in range(0, len(records), max_batch):
+            batch = records[start:start + max_batch]
+            self.collection.update(
+                ids=[r["id"] for r in batch],
+                metadatas=[r["metadata"] for r in batch]
+            )
+
+    def _get_source_chunk_ids(self, source: str, manifest: Dict) -> List[str]:
+        """
+        Returns the ids of the chunks currently indexed for a source
+
+        Uses the manifest when available; sources ingested before the
+        manifest existed (ids like "<source>_<n>") are looked up by metadata.
+        """
+        entry = manifest.get("sources", {}).get(source)
+        if entry is not None:
+            return entry.get("chunk_ids", [])
+
+        try:
+            legacy = self.collection.get(where={"source": source}, include=[])
+            return legacy.get("ids", []) if legacy else []
+        except Exception as e:
+            print(f"Error reading chunks of source {source}: {e}")
+            return []
+
+    @property
+    def manifest_path(self) -> str:
+        """Path of the per-source ingestion manifest, stored in the context directory"""
+        return os.path.join(os.path.dirname(os.path.abspath(self.persist_directory)), MANIFEST_FILENAME)
+
+    def _load_manifest(self) -> Dict:
+        """Loads the ingestion manifest of the current context"""
+        if not os.path.exists(self.manifest_path):
+            return {"sources": {}}
+
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            manifest.setdefault("sources", {})
+            return manifest
+        except Exception as e:
+            print(f"Error loading manifest: {e}")
+            return {"sources": {}}
+
+    def _save_manifest(self, manifest: Dict):
+        """Saves the ingestion manifest of the current context"""
+        write_json_atomic(self.manifest_path, manifest)
+
+    @staticmethod
+    def _set_manifest_entry(manifest: Dict, source: str, chunk_ids: List[str]):
+        """Records the chunk ids of a source in the manifest"""
+        manifest.setdefault("sources", {})[source] = {
+            "chunk_ids": chunk_ids,
+            "chunk_count": len(chunk_ids),
+            "updated_at": datetime.now().isoformat()
+        }
+
+    def _build_chunk_metadata(self, source: str, chunk_id: int, chunk: Optional[Dict] = None) -> Dict:
+        """Builds the ChromaDB metadata of a chunk, including its page range when known"""
+        metadata = {"source": source, "chunk_id": chunk_id, "context": self.context_name or "default"}
+        if chunk:
+            for key in ("page_start", "page_end"):
+                if chunk.get(key) is not None:
+                    metadata[key] = chunk[key]
+        return metadata
+
+    @staticmethod
+    def _file_size(file) -> int:
+        """Returns the size in bytes of an uploaded file"""
+        size = getattr(file, 'size', None)
+        if size is not None:
+            return size
+        return len(file.getvalue()) if hasattr(file, 'getvalue') else 0
+
+    @classmethod
+    def _should_stream(cls, file) -> bool:
+        """True for PDFs over STREAMING_THRESHOLD_BYTES or STREAMING_THRESHOLD_PAGES pages"""
+        if not file.name.lower().endswith('.pdf'):
+            return False
+        if cls._file_size(file) > STREAMING_THRESHOLD_BYTES:
+            return True
+        return _pdf_page_count(file) > STREAMING_THRESHOLD_PAGES
+
+    def _get_max_batch_size(self) -> int:
+        """Returns the maximum number of records ChromaDB accepts in a single add"""
+        try:
+            if hasattr(self.client, 'get_max_batch_size'):
+                return self.client.get_max_batch_size()
+            return self.client.max_batch_size
+        except Exception:
+            return DEFAULT_CHROMA_MAX_BATCH
+
     @staticmethod
     def _normalize_collection_name(name: str) -> str:
         """
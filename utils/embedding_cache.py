@@ -0,0 +1,222 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import Dict, List, Optional
+
+
+DEFAULT_CACHE_PATH = "./data/embedding_cache.sqlite3"
+DEFAULT_MAX_ENTRIES = 200000
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache shared across contexts
+
+    Vectors are stored as float32 blobs in SQLite, keyed by (model name,
+    text hash). When the number of entries exceeds ``max_entries`` the least
+    recently used ones are evicted.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Una connessione per operazione: Streamlit esegue gli script su thread diversi
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """Returns the hash used as cache key for a text"""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[str, List[float]]:
+        """
+        Looks up the cached embeddings of a list of texts
+
+        Args:
+            model: Embedding model name
+            texts: Texts to look up
+
+        Returns:
+            Dict text hash -> vector for the texts found in cache
+        """
+        hashes = list({self.text_hash(text) for text in texts})
+        if not hashes:
+            return {}
+
+        found = {}
+        now = time.time()
+
+        with self._lock, self._connect() as conn:
+            # SQLite limita il numero di parametri per query
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model] + batch
+                ).fetchall()
+
+                for text_hash, blob in rows:
+                    vector = array('f')
+                    vector.frombytes(blob)
+                    found[text_hash] = vector.tolist()
+
+                if rows:
+                    conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                        [(now, model, text_hash) for text_hash, _ in rows]
+                    )
+
+        return found
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        """
+        Stores the embeddings of a list of texts and evicts the oldest entries if needed
+
+        Args:
+            model: Embedding model name
+            texts: Embedded texts
+            vectors: Embeddings, in the same order as texts
+        """
+        if not texts:
+            return
+
+        now = time.time()
+        rows = [
+            (model, self.text_hash(text), array('f', vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Removes the least recently used entries beyond max_entries"""
+        if not self.max_entries:
+            return
+
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            conn.execute(
+                """
+                DELETE FROM embeddings WHERE rowid IN (
+                    SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?
+                )
+                """,
+                (excess,)
+            )
+
+    def get_stats(self) -> Dict:
+        """Returns the number of cached embeddings per model"""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute("SELECT model, COUNT(*) FROM embeddings GROUP BY model").fetchall()
+
+        return {
+            "total_entries": sum(count for _, count in rows),
+            "max_entries": self.max_entries,
+            "models": {model: count for model, count in rows}
+        }
+
+    def clear(self, model: Optional[str] = None):
+        """Clears the cache, optionally only for one model"""
+        with self._lock, self._connect() as conn:
+            if model:
+                conn.execute("DELETE FROM embeddings WHERE model = ?", (model,))
+            else:
+                conn.execute("DELETE FROM embeddings")
+
+
+class CachedEmbeddings:
+    """
+    Wraps an embedding model (embed_documents / embed_query) with an EmbeddingCache
+
+    Only texts missing from the cache are sent to the underlying model.
+    """
+
+    def __init__(self, embeddings, model_name: str, cache: EmbeddingCache):
+        self._embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+
+    @property
+    def encoder(self):
+        """The wrapped model, for texts that must not be cached"""
+        return self._embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embeds a list of documents, reusing cached vectors"""
+        try:
+            cached = self.cache.get_many(self.model_name, texts)
+        except sqlite3.Error as e:
+            print(f"Error reading embedding cache: {e}")
+            return self._embeddings.embed_documents(texts)
+
+        missing = []
+        seen = set()
+        for text in texts:
+            text_hash = self.cache.text_hash(text)
+            if text_hash not in cached and text_hash not in seen:
+                seen.add(text_hash)
+                missing.append(text)
+
+        if missing:
+            vectors = self._embeddings.embed_documents(missing)
+            for text, vector in zip(missing, vectors):
+                cached[self.cache.text_hash(text)] = vector
+            try:
+                self.cache.put_many(self.model_name, missing, vectors)
+            except sqlite3.Error as e:
+                print(f"Error writing embedding cache: {e}")
+
+        return [cached[self.cache.text_hash(text)] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embeds a query, reusing the cached vector if available"""
+        # Namespace separato: alcuni modelli usano istruzioni diverse per query e documenti
+        query_model = f"{self.model_name}#query"
+        try:
+            cached = self.cache.get_many(query_model, [text])
+        except sqlite3.Error as e:
+            print(f"Error reading embedding cache: {e}")
+            return self._embeddings.embed_query(text)
+
+        text_hash = self.cache.text_hash(text)
+        if text_hash in cached:
+            return cached[text_hash]
+
+        vector = self._embeddings.embed_query(text)
+        try:
+            self.cache.put_many(query_model, [text], [vector])
+        except sqlite3.Error as e:
+            print(f"Error writing embedding cache: {e}")
+        return vector
@@ -0,0 +1,170 @@
+import os
+import threading
+from typing import List, Optional
+
+from utils.embedding_cache import EmbeddingCache, CachedEmbeddings
+
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+WARMUP_ENV_VAR = "LUMIA_EMBEDDINGS_WARMUP"
+
+# Backend di inferenza disponibili per lo stesso modello MiniLM.
+# I backend ONNX richiedono sentence-transformers>=3.2 con onnxruntime (pip install "sentence-transformers[onnx]")
+DEFAULT_EMBEDDING_BACKEND = "torch"
+EMBEDDING_BACKENDS = {
+    "torch": {
+        "label": "PyTorch (sentence-transformers)",
+        "model_kwargs": {}
+    },
+    "onnx": {
+        "label": "ONNX Runtime",
+        "model_kwargs": {"backend": "onnx"}
+    },
+    "onnx-int8": {
+        "label": "ONNX Runtime int8 (quantized)",
+        "model_kwargs": {
+            "backend": "onnx",
+            "model_kwargs": {"file_name": "onnx/model_quint8_avx2.onnx"}
+        }
+    }
+}
+
+_services = {}
+_service_lock = threading.Lock()
+
+
+def validate_embedding_backend(backend: str) -> str:
+    """Returns the backend name, raising ValueError if it is not supported"""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(
+            f"Unsupported embedding backend '{backend}'. Available: {', '.join(EMBEDDING_BACKENDS)}"
+        )
+    return backend
+
+
+class EmbeddingService:
+    """
+    Process-wide embedding model shared by all pages, sessions and contexts
+
+    The HuggingFace model is loaded once per backend (on first use or by
+    warm_up) and wrapped with the persistent EmbeddingCache. Calls to the
+    model are serialized, since Streamlit runs every browser session on its
+    own thread.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, backend: str = DEFAULT_EMBEDDING_BACKEND,
+                 cache: Optional[EmbeddingCache] = None):
+        self.model_name = model_name
+        self.backend = validate_embedding_backend(backend)
+        self._cache = cache
+        self._embeddings = None
+        self._load_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+        self._warmup_thread = None
+
+    @property
+    def is_loaded(self) -> bool:
+        """True when the model is already in memory"""
+        return self._embeddings is not None
+
+    @property
+    def cache_key(self) -> str:
+        """Model name used as cache namespace (vectors of different backends are not mixed)"""
+        if self.backend == DEFAULT_EMBEDDING_BACKEND:
+            return self.model_name
+        return f"{self.model_name}@{self.backend}"
+
+    def create_encoder(self):
+        """Creates a new, uncached HuggingFaceEmbeddings instance for this backend"""
+        model_kwargs = EMBEDDING_BACKENDS[self.backend]["model_kwargs"]
+        if model_kwargs.get("backend") == "onnx":
+            try:
+                import onnxruntime  # noqa: F401
+            except ImportError:
+                raise ImportError(
+                    f"The '{self.backend}' embedding backend requires onnxruntime. "
+                    "Run: pip install \"sentence-transformers[onnx]\""
+                )
+
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=self.model_name, model_kwargs=dict(model_kwargs))
+
+    def _get_embeddings(self) -> CachedEmbeddings:
+        """Loads the model on first use (only once per process)"""
+        if self._embeddings is None:
+            with self._load_lock:
+                if self._embeddings is None:
+                    self._embeddings = CachedEmbeddings(
+                        self.create_encoder(),
+                        model_name=self.cache_key,
+                        cache=self._cache or EmbeddingCache()
+                    )
+        return self._embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embeds a list of documents"""
+        embeddings = self._get_embeddings()
+        with self._encode_lock:
+            return embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embeds a query"""
+        embeddings = self._get_embeddings()
+        with self._encode_lock:
+            return embeddings.embed_query(text)
+
+    def embed_transient(self, texts: List[str]) -> List[List[float]]:
+        """Embeds texts without reading or writing the persistent cache (e.g. conversation turns)"""
+        embeddings = self._get_embeddings()
+        with self._encode_lock:
+            return embeddings.encoder.embed_documents(texts)
+
+    def warm_up(self, background: bool = True):
+        """
+        Loads the model and runs a first encoding so the first real query is fast
+
+        Args:
+            background: If True the warm-up runs in a daemon thread and the call returns immediately
+        """
+        def run():
+            try:
+                embeddings = self._get_embeddings()
+                with self._encode_lock:
+                    # Bypassa la cache: serve un'inferenza reale per inizializzare il modello
+                    embeddings.encoder.embed_query("LUMIA Studio warm-up")
+            except Exception as e:
+                print(f"Error warming up embedding model: {e}")
+
+        if not background:
+            run()
+            return
+
+        with self._load_lock:
+            if self._warmup_thread is not None or self._embeddings is not None:
+                return
+            self._warmup_thread = threading.Thread(target=run, name="embedding-warmup", daemon=True)
+            self._warmup_thread.start()
+
+
+def get_embedding_service(backend: str = DEFAULT_EMBEDDING_BACKEND) -> EmbeddingService:
+    """Returns the embedding service of a backend, shared by the whole process"""
+    service = _services.get(backend)
+    if service is None:
+        with _service_lock:
+            service = _services.get(backend)
+            if service is None:
+                service = EmbeddingService(backend=backend)
+                _services[backend] = service
+    return service
+
+
+def warm_up_embeddings():
+    """
+    Warm-up hook called at app start
+
+    Loads the default embedding model (pre-downloaded by setup_models.py)
+    in the background. Set LUMIA_EMBEDDINGS_WARMUP=0 to disable it.
+    """
+    if os.environ.get(WARMUP_ENV_VAR, "1").lower() in ("0", "false", "no"):
+        return
+    get_embedding_service().warm_up(background=True)
@@ -2,7 +2,8 @@
 GeniusEngine - Business logic for Genius agent (BDI Execution Coach)
 
 This module handles:
-- Loading BDI frameworks from data/bdi_frameworks/
+- Loading BDI frameworks from data/bdi_frameworks/ (through the shared
+  metadata cache, so unchanged framework files are not re-parsed)
 - Filtering beliefs by relevance level
 - Creating user profiles from conversation
 - Generating action plans (structure + details)
@@ -16,8 +17,11 @@ import os
 import json
 import uuid
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 from utils.prompts import get_prompt
+from utils.structured_output import extract_json
+from utils.atomic_json import update_json, write_json_atomic
+from utils.metadata_cache import get_metadata_cache
 
 
 class GeniusEngine:
@@ -70,6 +74,8 @@ class GeniusEngine:
         if not os.path.exists(self.bdi_frameworks_dir):
             return []
 
+        # Framework files unchanged since the last call are not re-parsed
+        cache = get_metadata_cache()
         for filename in os.listdir(self.bdi_frameworks_dir):
             if not filename.endswith('.json'):
                 continue
@@ -77,47 +83,9 @@ class GeniusEngine:
             filepath = os.path.join(self.bdi_frameworks_dir, filename)
 
             try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    bdi_data = json.load(f)
-
-                # Validate BDI structure
-                is_valid = self._validate_bdi_structure(bdi_data)
-
-                if not is_valid:
-                    # Skip invalid BDI files but log warning
-                    print(f"Warning: Invalid BDI structure in {filename}")
-                    continue
-
-                # Extract metadata
-                domain_summary = bdi_data.get('domain_summary', 'Unknown Domain')
-                desires = bdi_data.get('desires', [])
-                beliefs = bdi_data.get('beliefs', [])
-
-                # Extract tags from desires and beliefs
-                tags = set()
-                for desire in desires:
-                    tags.update(desire.get('tags', []))
-                for belief in beliefs:
-                    tags.update(belief.get('tags', []))
-
-                # Get file creation time
-                created_at = datetime.fromtimestamp(
-                    os.path.getctime(filepath)
-                ).isoformat()
-
-                # Create metadata dict
-                framework_metadata = {
-                    'filename': filename,
-                    'display_name': domain_summary[:50],  # Truncate if too long
-                    'domain': domain_summary,
-                    'desire_count': len(desires),
-                    'belief_count': len(beliefs),
-                    'tags': sorted(list(tags)) if tags else [],
-                    'created_at': created_at,
-                    'is_valid': True
-                }
-
-                frameworks.append(framework_metadata)
+                framework_metadata = cache.load(filepath, self._framework_metadata, namespace="bdi_framework")
+                if framework_metadata is not None:
+                    frameworks.append(framework_metadata)
 
             except json.JSONDecodeError as e:
                 print(f"Error: Invalid JSON in {filename}: {str(e)}")
@@ -131,6 +99,55 @@ class GeniusEngine:
 
         return frameworks
 
+    def _framework_metadata(self, filepath: str) -> Optional[Dict]:
+        """
+        Parse a BDI framework file into its listing metadata.
+
+        Args:
+            filepath: Path of the framework JSON file
+
+        Returns:
+            Framework metadata dict (see load_bdi_frameworks), or None if the
+            BDI structure is invalid
+        """
+        filename = os.path.basename(filepath)
+        with open(filepath, 'r', encoding='utf-8') as f:
+            bdi_data = json.load(f)
+
+        # Validate BDI structure
+        if not self._validate_bdi_structure(bdi_data):
+            # Skip invalid BDI files but log warning
+            print(f"Warning: Invalid BDI structure in {filename}")
+            return None
+
+        # Extract metadata
+        domain_summary = bdi_data.get('domain_summary', 'Unknown Domain')
+        desires = bdi_data.get('desires', [])
+        beliefs = bdi_data.get('beliefs', [])
+
+        # Extract tags from desires and beliefs
+        tags = set()
+        for desire in desires:
+            tags.update(desire.get('tags', []))
+        for belief in beliefs:
+            tags.update(belief.get('tags', []))
+
+        # Get file creation time
+        created_at = datetime.fromtimestamp(
+            os.path.getctime(filepath)
+        ).isoformat()
+
+        return {
+            'filename': filename,
+            'display_name': domain_summary[:50],  # Truncate if too long
+            'domain': domain_summary,
+            'desire_count': len(desires),
+            'belief_count': len(beliefs),
+            'tags': sorted(list(tags)) if tags else [],
+            'created_at': created_at,
+            'is_valid': True
+        }
+
     def load_bdi(self, filename: str) -> Optional[Dict]:
         """
         Load a specific BDI framework by filename.
@@ -154,8 +171,7 @@ class GeniusEngine:
             return None
 
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                bdi_data = json.load(f)
+            bdi_data = get_metadata_cache().read_json(filepath)
 
             # Validate structure
             if not self._validate_bdi_structure(bdi_data):
@@ -363,7 +379,8 @@ class GeniusEngine:
         desire_id: str,
         user_profile: Dict,
         llm_provider: str = "Gemini",
-        llm_model: str = "gemini-2.0-flash-exp"
+        llm_model: str = "gemini-2.0-flash-exp",
+        on_step: Optional[Callable[[Dict], None]] = None
     ) -> Optional[Dict]:
         """
         Generate action plan structure using LLM.
@@ -375,6 +392,7 @@ class GeniusEngine:
             user_profile: User context profile
             llm_provider: LLM provider to use
             llm_model: LLM model to use
+            on_step: Optional callback receiving every step as soon as it is generated
 
         Returns:
             Plan structure dict or None if generation fails
@@ -392,31 +410,19 @@ class GeniusEngine:
 
         # Call LLM
         try:
-            response = llm_manager.chat(
+            # Output JSON strutturato: gli step vengono notificati man mano che arrivano
+            result = llm_manager.chat_structured(
                 provider=llm_provider,
                 model=llm_model,
                 messages=[{"role": "user", "content": prompt}],
+                item_keys=["steps"],
+                on_item=(lambda key, step: on_step(step)) if on_step else None,
                 temperature=0.7,
-                max_tokens=4000  # Higher for plan generation
+                max_tokens=4000,  # Higher for plan generation
+                agent="genius"
             )
 
-            # Parse JSON response
-            import json
-            # Extract JSON from markdown code blocks if present
-            if "```json" in response:
-                json_start = response.find("```json") + 7
-                json_end = response.find("```", json_start)
-                json_str = response[json_start:json_end].strip()
-            elif "```" in response:
-                json_start = response.find("```") + 3
-                json_end = response.find("```", json_start)
-                json_str = response[json_start:json_end].strip()
-            else:
-                json_str = response.strip()
-
-            plan_structure = json.loads(json_str)
-
-            return plan_structure
+            return result["data"]
 
         except Exception as e:
             print(f"Error generating plan: {str(e)}")
@@ -673,33 +679,45 @@ class GeniusEngine:
         """
         enriched_plan = plan.copy()
 
-        for phase in enriched_plan['plan_structure']['phases']:
-            for step in phase.get('steps', []):
-                # Generate tips for this step
-                tips = self._generate_step_tips(
-                    llm_manager,
-                    step,
-                    plan['target_desire'],
-                    plan['user_profile'],
-                    llm_provider,
-                    llm_model
-                )
-
-                if tips:
-                    step['practical_tips'] = tips
+        steps = [
+            step
+            for phase in enriched_plan['plan_structure']['phases']
+            for step in phase.get('steps', [])
+        ]
+        if not steps:
+            return enriched_plan
+
+        # One request per step, executed concurrently (bounded, rate limited, with retry)
+        requests = [
+            {
+                "provider": llm_provider,
+                "model": llm_model,
+                "messages": [{
+                    "role": "user",
+                    "content": self._build_step_tips_prompt(step, plan['user_profile'])
+                }],
+                "temperature": 0.6,  # Slightly lower for focused tips
+                "max_tokens": 1000,
+                "agent": "genius"
+            }
+            for step in steps
+        ]
+
+        responses = llm_manager.chat_many(requests)
+
+        for step, response in zip(steps, responses):
+            if isinstance(response, Exception):
+                print(f"Error generating tips for step {step['step_id']}: {str(response)}")
+                continue
+
+            tips = self._parse_step_tips(step, response)
+            if tips:
+                step['practical_tips'] = tips
 
         return enriched_plan
 
-    def _generate_step_tips(
-        self,
-        llm_manager,
-        step: Dict,
-        desire: Dict,
-        user_profile: Dict,
-        llm_provider: str,
-        llm_model: str
-    ) -> List[str]:
-        """Generate practical tips for a specific step using LLM."""
+    def _build_step_tips_prompt(self, step: Dict, user_profile: Dict) -> str:
+        """Build the practical tips prompt for a specific step."""
 
         # Load prompt template
         prompt_template = get_prompt('genius', prompt_suffix='step_tips_prompt')
@@ -718,35 +736,17 @@ class GeniusEngine:
         for key, value in placeholders.items():
             prompt = prompt.replace(f'{{{key}}}', str(value))
 
-        try:
-            response = llm_manager.chat(
-                provider=llm_provider,
-                model=llm_model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.6,  # Slightly lower for focused tips
-                max_tokens=1000
-            )
-
-            # Parse JSON response
-            if "```json" in response:
-                json_start = response.find("```json") + 7
-                json_end = response.find("```", json_start)
-                json_str = response[json_start:json_end].strip()
-            elif "```" in response:
-                json_start = response.find("```") + 3
-                json_end = response.find("```", json_start)
-                json_str = response[json_start:json_end].strip()
-            else:
-                json_str = response.strip()
-
-            tips = json.loads(json_str)
-
-            return tips if isinstance(tips, list) else []
+        return prompt
 
-        except Exception as e:
-            print(f"Error generating tips for step {step['step_id']}: {str(e)}")
+    def _parse_step_tips(self, step: Dict, response: str) -> List[str]:
+        """Parse the list of practical tips from the LLM response."""
+        tips = extract_json(response, expect=list)
+        if tips is None:
+            print(f"Error generating tips for step {step['step_id']}: response does not contain a JSON array")
             return []
 
+        return tips
+
     def export_plan_to_markdown(self, plan: Dict) -> str:
         """
         Export plan to Markdown format.
@@ -896,7 +896,6 @@ class GeniusEngine:
         Returns:
             Path to saved plan file
         """
-        import json
         from datetime import datetime
 
         # Determine save location
@@ -916,8 +915,8 @@ class GeniusEngine:
         plan_filename = f"plan_{plan['plan_id']}.json"
         plan_path = os.path.join(plans_dir, plan_filename)
 
-        with open(plan_path, 'w', encoding='utf-8') as f:
-            json.dump(plan, f, indent=2, ensure_ascii=False)
+        # Scrittura atomica: un salvataggio concorrente non lascia il piano troncato
+        write_json_atomic(plan_path, plan)
 
         # Update active plan marker
         self._set_active_plan(plan['plan_id'], session_id)
@@ -1052,7 +1051,8 @@ class GeniusEngine:
         step_id: str,
         new_status: str,
         user_notes: str = "",
-        session_id: Optional[str] = None
+        session_id: Optional[str] = None,
+        expected_revision: Optional[str] = None
     ) -> bool:
         """
         Update step status in a plan.
@@ -1063,82 +1063,99 @@ class GeniusEngine:
             new_status: New status (pending|in_progress|completed)
             user_notes: Optional user notes
             session_id: Optional session ID
+            expected_revision: Optional revision of the plan the caller read;
+                RevisionConflictError is raised if the plan changed since
 
         Returns:
             True if updated successfully
         """
         from datetime import datetime
 
-        plan = self.load_plan(plan_id, session_id)
-        if not plan:
+        if session_id:
+            plan_path = os.path.join(self.sessions_dir, session_id, "genius_plans", f"plan_{plan_id}.json")
+        else:
+            plan_path = os.path.join(self.data_dir, "genius_plans", f"plan_{plan_id}.json")
+
+        if not os.path.exists(plan_path):
             return False
 
-        # Find and update step
-        step_found = False
-        for phase in plan['plan_structure']['phases']:
-            for step in phase['steps']:
-                if step['step_id'] == step_id:
-                    old_status = step.get('status', 'pending')
-                    step['status'] = new_status
-                    step['user_notes'] = user_notes
-
-                    # Update timestamps
-                    if new_status == 'in_progress' and old_status == 'pending':
-                        step['started_at'] = datetime.now().isoformat()
-                    elif new_status == 'completed' and old_status != 'completed':
-                        step['completed_at'] = datetime.now().isoformat()
-
-                    step_found = True
+        def apply_step_update(plan: Dict) -> Dict:
+            """Applies the step update to the plan as currently stored"""
+            # Find and update step
+            step_found = False
+            for phase in plan['plan_structure']['phases']:
+                for step in phase['steps']:
+                    if step['step_id'] == step_id:
+                        old_status = step.get('status', 'pending')
+                        step['status'] = new_status
+                        step['user_notes'] = user_notes
+
+                        # Update timestamps
+                        if new_status == 'in_progress' and old_status == 'pending':
+                            step['started_at'] = datetime.now().isoformat()
+                        elif new_status == 'completed' and old_status != 'completed':
+                            step['completed_at'] = datetime.now().isoformat()
+
+                        step_found = True
+                        break
+
+                if step_found:
+                    # Update phase status
+                    phase_steps = phase['steps']
+                    if all(s.get('status') == 'completed' for s in phase_steps):
+                        phase['status'] = 'completed'
+                        phase['completed_at'] = datetime.now().isoformat()
+                    elif any(s.get('status') in ['in_progress', 'completed'] for s in phase_steps):
+                        if phase.get('status') == 'pending':
+                            phase['status'] = 'in_progress'
+                            phase['started_at'] = datetime.now().isoformat()
                     break
 
-            if step_found:
-                # Update phase status
-                phase_steps = phase['steps']
-                if all(s.get('status') == 'completed' for s in phase_steps):
-                    phase['status'] = 'completed'
-                    phase['completed_at'] = datetime.now().isoformat()
-                elif any(s.get('status') in ['in_progress', 'completed'] for s in phase_steps):
-                    if phase.get('status') == 'pending':
-                        phase['status'] = 'in_progress'
-                        phase['started_at'] = datetime.now().isoformat()
-                break
-
-        if not step_found:
-            return False
+            if not step_found:
+                raise KeyError(step_id)
+
+            # Recalculate overall progress
+            all_steps = []
+            for phase in plan['plan_structure']['phases']:
+                all_steps.extend(phase['steps'])
+
+            completed = sum(1 for s in all_steps if s.get('status') == 'completed')
+            in_progress = sum(1 for s in all_steps if s.get('status') == 'in_progress')
+            total = len(all_steps)
+
+            plan['overall_progress'] = {
+                'total_steps': total,
+                'completed_steps': completed,
+                'in_progress_steps': in_progress,
+                'pending_steps': total - completed - in_progress,
+                'percentage_complete': round((completed / total) * 100, 2) if total > 0 else 0,
+                'current_phase': None,  # Will determine below
+                'current_step': step_id if new_status == 'in_progress' else None
+            }
 
-        # Recalculate overall progress
-        all_steps = []
-        for phase in plan['plan_structure']['phases']:
-            all_steps.extend(phase['steps'])
-
-        completed = sum(1 for s in all_steps if s.get('status') == 'completed')
-        in_progress = sum(1 for s in all_steps if s.get('status') == 'in_progress')
-        total = len(all_steps)
-
-        plan['overall_progress'] = {
-            'total_steps': total,
-            'completed_steps': completed,
-            'in_progress_steps': in_progress,
-            'pending_steps': total - completed - in_progress,
-            'percentage_complete': round((completed / total) * 100, 2) if total > 0 else 0,
-            'current_phase': None,  # Will determine below
-            'current_step': step_id if new_status == 'in_progress' else None
-        }
+            # Determine current phase
+            for phase in plan['plan_structure']['phases']:
+                if phase.get('status') == 'in_progress':
+                    plan['overall_progress']['current_phase'] = phase['phase_id']
+                    break
 
-        # Determine current phase
-        for phase in plan['plan_structure']['phases']:
-            if phase.get('status') == 'in_progress':
-                plan['overall_progress']['current_phase'] = phase['phase_id']
-                break
+            plan['last_updated'] = datetime.now().isoformat()
+            return plan
 
-        # Save updated plan
-        self.save_plan(plan, session_id)
+        # Lettura-modifica-scrittura sotto il lock del piano: gli aggiornamenti
+        # concorrenti di step diversi si applicano in sequenza senza perdite
+        try:
+            update_json(plan_path, apply_step_update, expected_revision=expected_revision)
+        except KeyError:
+            return False
+
+        # Update active plan marker
+        self._set_active_plan(plan_id, session_id)
 
         return True
 
     def _set_active_plan(self, plan_id: str, session_id: Optional[str] = None):
         """Set active plan marker."""
-        import json
         from datetime import datetime
 
         # Determine location
@@ -1156,8 +1173,7 @@ class GeniusEngine:
             'set_at': datetime.now().isoformat()
         }
 
-        with open(marker_path, 'w', encoding='utf-8') as f:
-            json.dump(marker_data, f, indent=2)
+        write_json_atomic(marker_path, marker_data)
 
     # ==================== Helper Methods ====================
 
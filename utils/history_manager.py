@@ -0,0 +1,272 @@
+"""
+HistoryCompactor - Keeps the chat history sent to the LLM within a token budget
+
+This module handles:
+- Token counting per provider (tiktoken for OpenAI when installed, estimate otherwise)
+- Keeping the most recent turns verbatim
+- Replacing older turns with a rolling summary, cached in the session
+  directory and refreshed incrementally
+- Pinning the saved BDI artefacts (JSON reports) so they are never summarized away
+- Sending the fixed session context of the agent (e.g. Believer's desires)
+  once in the system addendum, so that the summary does not restate it
+"""
+
+import os
+import json
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from utils.llm_manager_config import HISTORY_COMPACTION_CONFIG
+from utils.atomic_json import write_json_atomic
+
+
+CHARS_PER_TOKEN = 4
+ARTEFACT_KEYS = ('"desires"', '"beliefs"', '"intentions"', '"beliefs_base"')
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You summarize conversations between a user and an assistant. "
+    "Keep decisions, facts about the user and the domain, open questions and the current goal. "
+    "Be concise and write in the language of the conversation. Return only the summary."
+)
+
+_encodings = {}
+
+
+def summary_file_name(agent: str) -> str:
+    """Name of the session file caching the rolling summary of an agent"""
+    return f"history_summary_{agent}.json"
+
+
+def count_tokens(text: str, provider: Optional[str] = None, model: Optional[str] = None) -> int:
+    """
+    Counts the tokens of a text for a provider
+
+    OpenAI models use tiktoken when it is installed; other providers (and
+    OpenAI without tiktoken) use an estimate of 4 characters per token.
+    """
+    if not text:
+        return 0
+
+    if provider == "OpenAI":
+        encoding = _get_openai_encoding(model)
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _get_openai_encoding(model: Optional[str]):
+    if model in _encodings:
+        return _encodings[model]
+
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except ImportError:
+        encoding = None
+
+    _encodings[model] = encoding
+    return encoding
+
+
+class HistoryCompactor:
+    """
+    Compacts the chat history of an agent before it is sent to the LLM.
+
+    Usage:
+        summary_path = session_manager.get_session_path(session_id, summary_file_name("ali"))
+        compacted = HistoryCompactor("ali", llm_manager, summary_path).compact(history, provider, model)
+        messages = compacted["messages"]
+        system_prompt = base_prompt + compacted["system_addendum"]
+
+    Fixed context the conversation is based on (e.g. the desires of the
+    session) is passed as pinned_context instead of being added to the base
+    prompt: it is sent once, ahead of the summary, and left out of it.
+    """
+
+    def __init__(self, agent: str, llm_manager, summary_path: Optional[str] = None, config: Optional[Dict] = None):
+        """
+        Initialize HistoryCompactor.
+
+        Args:
+            agent: Agent name (key of HISTORY_COMPACTION_CONFIG)
+            llm_manager: LLMManager used to write the summary
+            summary_path: File where the rolling summary is cached (None: no cache)
+            config: Optional overrides of the agent configuration
+        """
+        self.agent = agent
+        self.llm_manager = llm_manager
+        self.summary_path = str(summary_path) if summary_path else None
+        self.config = dict(HISTORY_COMPACTION_CONFIG.get(agent, HISTORY_COMPACTION_CONFIG["default"]))
+        if config:
+            self.config.update(config)
+
+    def compact(self, history: List[Dict], provider: str, model: str, pinned_context: str = "") -> Dict:
+        """
+        Returns the history to send to the LLM
+
+        Args:
+            history: Full chat history (not modified)
+            provider: LLM provider (for token counting and the summary call)
+            model: LLM model
+            pinned_context: Fixed session context, sent verbatim in the system addendum
+
+        Returns:
+            Dict with:
+            - messages: copies of the messages to send (recent turns verbatim,
+              preceded by the older turns the summary could not cover)
+            - system_addendum: text to append to the system prompt (pinned
+              context, summary and pinned artefacts)
+            - compacted: True if older turns were summarized
+            - tokens: estimated tokens of the original history
+        """
+        messages = [{"role": m.get("role"), "content": m.get("content", "")} for m in history]
+        total_tokens = sum(count_tokens(m["content"], provider, model) for m in messages)
+
+        cut = self._recent_turns_start(messages)
+        if total_tokens <= self.config["max_history_tokens"] or cut == 0:
+            return {"messages": messages, "system_addendum": pinned_context, "compacted": False, "tokens": total_tokens}
+
+        older, recent = messages[:cut], messages[cut:]
+
+        pinned_indexes = self._artefact_indexes(older)[-self.config["pinned_artefacts"]:] \
+            if self.config["pinned_artefacts"] else []
+        summary, covered = self._rolling_summary(older, pinned_indexes, provider, model, pinned_context)
+        if covered == 0:
+            # Riassunto non disponibile: la cronologia viene inviata per intero
+            return {"messages": messages, "system_addendum": pinned_context, "compacted": False, "tokens": total_tokens}
+
+        addendum = pinned_context
+        if summary:
+            addendum += f"\n\n## SUMMARY OF THE EARLIER CONVERSATION\n{summary}\n"
+        for index in pinned_indexes:
+            if index < covered:
+                addendum += f"\n\n## SAVED ARTEFACT (from earlier in the conversation)\n{older[index]['content']}\n"
+
+        # I turni non coperti dal riassunto (chiamata fallita) restano integrali
+        return {
+            "messages": older[covered:] + recent,
+            "system_addendum": addendum,
+            "compacted": True,
+            "tokens": total_tokens
+        }
+
+    def _recent_turns_start(self, messages: List[Dict]) -> int:
+        """Index of the first message of the last keep_last_turns turns (a turn starts with a user message)"""
+        turns = 0
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index]["role"] == "user":
+                turns += 1
+                if turns == self.config["keep_last_turns"]:
+                    return index
+        return 0
+
+    @staticmethod
+    def _artefact_indexes(messages: List[Dict]) -> List[int]:
+        """Indexes of the assistant messages containing a BDI JSON report"""
+        indexes = []
+        for index, message in enumerate(messages):
+            content = message["content"] or ""
+            if message["role"] == "assistant" and "{" in content and any(key in content for key in ARTEFACT_KEYS):
+                indexes.append(index)
+        return indexes
+
+    @staticmethod
+    def _fingerprint(messages: List[Dict]) -> str:
+        payload = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _rolling_summary(
+        self, older: List[Dict], pinned_indexes: List[int], provider: str, model: str, pinned_context: str = ""
+    ) -> Tuple[str, int]:
+        """
+        Returns the summary of the older turns, updating the cached one incrementally
+
+        The cache stores how many messages it covers and their fingerprint:
+        when the history only grew, only the new messages are summarized
+        together with the previous summary.
+
+        Returns:
+            (summary, number of older messages it covers); when the summary
+            call fails the previous summary and its coverage are returned
+        """
+        cached = self._load_summary()
+        covered = 0
+        previous_summary = ""
+
+        if cached and cached.get("summarized_count", 0) <= len(older):
+            count = cached["summarized_count"]
+            if cached.get("fingerprint") == self._fingerprint(older[:count]):
+                covered = count
+                previous_summary = cached.get("summary", "")
+
+        if covered == len(older) and previous_summary:
+            return previous_summary, covered
+
+        # Gli artefatti fissati sono inviati integralmente: non serve riassumerli
+        new_messages = [
+            message for index, message in enumerate(older)
+            if index >= covered and index not in pinned_indexes
+        ]
+        if not new_messages:
+            return previous_summary, len(older)
+
+        transcript = "\n\n".join(f"{m['role'].upper()}: {m['content']}" for m in new_messages)
+        if previous_summary:
+            prompt = (
+                f"CURRENT SUMMARY:\n{previous_summary}\n\n"
+                f"NEW MESSAGES:\n{transcript}\n\n"
+                "Update the summary so that it also covers the new messages."
+            )
+        else:
+            prompt = f"CONVERSATION:\n{transcript}\n\nSummarize this conversation."
+        if pinned_context:
+            # Il contesto fisso è già inviato a ogni richiesta: il riassunto non deve ripeterlo
+            prompt += (
+                "\n\nThe assistant always receives the following context separately, "
+                f"do not repeat it in the summary:\n{pinned_context.strip()}"
+            )
+
+        try:
+            summary = self.llm_manager.chat(
+                provider=provider,
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                system_prompt=SUMMARY_SYSTEM_PROMPT,
+                temperature=0.2,
+                max_tokens=self.config["summary_max_tokens"],
+                agent=f"{self.agent}:history"
+            ).strip()
+        except Exception as e:
+            print(f"Error summarizing {self.agent} history: {e}")
+            return previous_summary, covered if previous_summary else 0
+
+        self._save_summary({
+            "agent": self.agent,
+            "summarized_count": len(older),
+            "fingerprint": self._fingerprint(older),
+            "summary": summary,
+            "updated_at": datetime.now().isoformat()
+        })
+        return summary, len(older)
+
+    def _load_summary(self) -> Optional[Dict]:
+        path = self.summary_path
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading {path}: {e}")
+            return None
+
+    def _save_summary(self, data: Dict):
+        path = self.summary_path
+        if not path:
+            return
+        write_json_atomic(path, data)
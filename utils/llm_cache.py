@@ -0,0 +1,140 @@
+"""
+LLMResponseCache - Persistent cache of LLM responses (chat and streaming calls)
+
+This module handles:
+- The key scheme: SHA-256 of the canonical JSON (sorted keys) of
+  ChatRequest.cache_payload(), i.e. provider, model, system prompt, final
+  messages (RAG context included) and sampling parameters, plus the
+  response format and schema of the structured calls
+- Storage in a SQLite database in WAL mode (LLM_CACHE_CONFIG["path"]),
+  one connection per operation
+- Eviction: entries older than ttl_seconds are dropped when read, and
+  beyond max_entries the least recently used ones are removed on write
+- Hit/miss counters since process start (get_stats)
+
+The cache is disabled by default: it is enabled by LLM_CACHE_CONFIG["enabled"]
+or by the LUMIA_LLM_CACHE environment variable (1/true/yes), which takes
+precedence, and is created by llm_manager.get_response_cache(). Single
+calls bypass it with use_cache=False (LLMManager.chat/chat_stream/send).
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+
+class LLMResponseCache:
+    """
+    Persistent cache of LLM responses
+
+    Responses are stored in SQLite keyed by a canonical hash of the request
+    (provider, model, system prompt, messages, sampling parameters). Entries
+    older than ttl_seconds are ignored; beyond max_entries the least
+    recently used ones are evicted.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: Optional[float] = None, max_entries: int = 5000):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Una connessione per operazione: Streamlit esegue gli script su thread diversi
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def make_key(request: Dict[str, Any]) -> str:
+        """Returns the canonical hash of a request (independent of dict ordering)"""
+        canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached response of a request key, or None (expired entries are removed)"""
+        now = time.time()
+
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+
+            if row and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, provider: str, model: str, response: str):
+        """Stores a response and evicts the least recently used entries beyond max_entries"""
+        if not response:
+            return
+
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, provider, model, response, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, provider, model, response, now, now)
+            )
+
+            if self.max_entries:
+                count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                excess = count - self.max_entries
+                if excess > 0:
+                    conn.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY last_used ASC LIMIT ?)",
+                        (excess,)
+                    )
+
+    def get_stats(self) -> Dict:
+        """Returns entries, hit/miss counters (since process start) and hit rate"""
+        with self._lock, self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            hits, misses = self.hits, self.misses
+
+        lookups = hits + misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0
+        }
+
+    def clear(self):
+        """Removes every cached response and resets the counters"""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+            self.hits = 0
+            self.misses = 0
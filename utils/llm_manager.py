@@ -1,13 +1,252 @@
 import os
-from typing import Dict, List, Optional
+import json
+import time
+import hashlib
+import random
+import asyncio
+import threading
+import dataclasses
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Union
 from dotenv import load_dotenv
 import google.generativeai as genai
 from openai import OpenAI
-from utils.llm_manager_config import MODEL_PARAMETERS
+from utils.llm_manager_config import (
+    MODEL_PARAMETERS,
+    PROVIDER_RATE_LIMITS,
+    DEFAULT_MAX_CONCURRENCY,
+    RETRY_POLICY,
+    LLM_CACHE_CONFIG,
+    HTTP_POOL_CONFIG,
+    GEMINI_MODEL_CACHE_SIZE
+)
+from utils.llm_cache import LLMResponseCache
+from utils.llm_request import ChatRequest
+from utils.llm_telemetry import record_call, estimate_cost
+from utils.llm_router import LLMRouter, routing_enabled
+from utils.structured_output import (
+    IncrementalJSONParser,
+    StructuredOutputError,
+    extract_json,
+    split_valid_prefix,
+    close_valid_prefix
+)
 
 # Carica le variabili d'ambiente dal file .env
 load_dotenv()
 
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+LLM_CACHE_ENV_VAR = "LUMIA_LLM_CACHE"
+
+# Riparazione mirata del JSON: caratteri del prefisso valido inviati come contesto e lunghezza massima della coda
+JSON_REPAIR_CONTEXT_CHARS = 1500
+JSON_REPAIR_MAX_TOKENS = 4096
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+# Registry di processo dei client dei provider: condivisi da tutte le sessioni Streamlit
+_provider_clients: Dict[str, Any] = {}
+_gemini_models: "OrderedDict[tuple, Any]" = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def get_openai_client(api_key: str) -> OpenAI:
+    """Returns the process-wide OpenAI client of an API key (pooled keep-alive HTTP connections)"""
+    key = "OpenAI:" + hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+    with _clients_lock:
+        client = _provider_clients.get(key)
+        if client is None:
+            import httpx
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=HTTP_POOL_CONFIG["max_connections"],
+                    max_keepalive_connections=HTTP_POOL_CONFIG["max_keepalive_connections"],
+                    keepalive_expiry=HTTP_POOL_CONFIG["keepalive_expiry"]
+                ),
+                timeout=HTTP_POOL_CONFIG["timeout"]
+            )
+            client = OpenAI(api_key=api_key, http_client=http_client)
+            _provider_clients[key] = client
+        return client
+
+
+def get_gemini_client(api_key: str):
+    """Configures the Gemini SDK once per API key and returns the module"""
+    key = "Gemini:" + hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+    with _clients_lock:
+        if key not in _provider_clients:
+            # genai.configure è globale: riconfigurarlo scarta il client (e la connessione) esistente
+            genai.configure(api_key=api_key)
+            _provider_clients[key] = genai
+        return _provider_clients[key]
+
+
+def get_gemini_model(model: str, system_prompt: Optional[str], generation_config: Optional[Dict]):
+    """
+    Returns a configured GenerativeModel, cached by (model, system prompt hash, generation config)
+
+    The cache is bounded (GEMINI_MODEL_CACHE_SIZE, least recently used evicted).
+    """
+    key = (
+        model,
+        hashlib.sha256((system_prompt or "").encode('utf-8')).hexdigest() if system_prompt else None,
+        json.dumps(generation_config, sort_keys=True) if generation_config else None
+    )
+    with _clients_lock:
+        genai_model = _gemini_models.get(key)
+        if genai_model is not None:
+            _gemini_models.move_to_end(key)
+            return genai_model
+
+        genai_model = genai.GenerativeModel(
+            model_name=model,
+            system_instruction=system_prompt,
+            generation_config=generation_config
+        )
+        _gemini_models[key] = genai_model
+        while len(_gemini_models) > GEMINI_MODEL_CACHE_SIZE:
+            _gemini_models.popitem(last=False)
+        return genai_model
+
+
+def get_response_cache() -> Optional[LLMResponseCache]:
+    """Returns the process-wide LLM response cache, or None when the cache is disabled"""
+    global _response_cache
+    env_value = os.environ.get(LLM_CACHE_ENV_VAR)
+    enabled = LLM_CACHE_CONFIG["enabled"] if env_value is None else env_value.lower() in ("1", "true", "yes")
+    if not enabled:
+        return None
+
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = LLMResponseCache(
+                    LLM_CACHE_CONFIG["path"],
+                    ttl_seconds=LLM_CACHE_CONFIG["ttl_seconds"],
+                    max_entries=LLM_CACHE_CONFIG["max_entries"]
+                )
+    return _response_cache
+
+
+class _RateLimiter:
+    """
+    Client-side rate limiter (requests per minute) shared by threads and event loops
+
+    Every call reserves the next free slot and returns how long the caller
+    has to wait before sending its request.
+    """
+
+    def __init__(self, requests_per_minute: int):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            return slot - now
+
+
+def _error_status_code(exc: Exception) -> Optional[int]:
+    """Extracts the HTTP status code from an OpenAI or Google API exception"""
+    for attr in ("status_code", "code", "http_status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+        # google.api_core espone il codice come attributo o metodo
+        if callable(value):
+            try:
+                value = value()
+            except Exception:
+                value = None
+            if isinstance(value, int):
+                return value
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable_error(exc: Exception) -> bool:
+    """True for rate limit (429), server (5xx) and transient connection errors"""
+    status = _error_status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+
+    name = type(exc).__name__
+    if name in ("APIConnectionError", "APITimeoutError", "ResourceExhausted",
+                "ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "TooManyRequests"):
+        return True
+
+    text = str(exc).lower()
+    return any(marker in text for marker in ("429", "rate limit", "quota", "503", "overloaded", "unavailable"))
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for the given retry attempt (0-based)"""
+    ceiling = min(RETRY_POLICY["max_delay"], RETRY_POLICY["base_delay"] * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+class ChatStream:
+    """
+    Streaming response of LLMManager.chat_stream
+
+    Iterating yields the text deltas; after the iteration 'text' holds the
+    complete response, 'usage' the token usage reported by the provider
+    (input_tokens, output_tokens, total_tokens) and 'done' is True.
+    'provider', 'model' and 'route' describe the call that answered, which
+    differs from the requested one after a failover or a hedge.
+    """
+
+    def __init__(self, deltas, request: Optional[ChatRequest] = None):
+        self._deltas = deltas
+        self.text = ""
+        self.usage: Dict[str, Optional[int]] = {}
+        self.done = False
+        self.cache_hit = False
+        self.provider = request.provider if request else None
+        self.model = request.model if request else None
+        self.route = request.route if request else None
+
+    def __iter__(self):
+        if self.done:
+            return
+        parts = []
+        try:
+            while True:
+                delta = next(self._deltas)
+                parts.append(delta)
+                yield delta
+        except StopIteration as stop:
+            # I generatori dei provider restituiscono l'utilizzo di token come valore di ritorno
+            self.usage = stop.value or {}
+        finally:
+            self.text = "".join(parts)
+            self.done = True
+
+    def consume(self) -> str:
+        """Reads the whole stream and returns the complete response"""
+        for _ in self:
+            pass
+        return self.text
+
+    @property
+    def rerouted(self) -> bool:
+        """True when the response comes from a fallback or hedge provider/model"""
+        return self.route in ("fallback", "hedge")
+
+    def close(self):
+        """Abandons the stream, releasing the provider connection"""
+        close = getattr(self._deltas, "close", None)
+        if close is not None:
+            close()
+        self.done = True
+
+
 class LLMManager:
     """Manages interactions with different LLM models"""
 
@@ -32,18 +271,29 @@ class LLMManager:
 
     def __init__(self):
         self.clients = {}
+        self.telemetry_session_id: Optional[str] = None
+        self._rate_limiters = {
+            provider: _RateLimiter(limits.get("requests_per_minute", 0))
+            for provider, limits in PROVIDER_RATE_LIMITS.items()
+        }
         self._initialize_clients()
+        self._router = LLMRouter(
+            available_providers=self.get_available_providers,
+            send_direct=self._send_direct,
+            send_stream_direct=self._send_stream_direct,
+            is_retryable=is_retryable_error
+        )
 
     def _initialize_clients(self):
         """Initializes clients for different providers"""
+        # I client sono condivisi a livello di processo: creare un LLMManager per sessione non costa nulla
         # OpenAI
         if os.getenv("OPENAI_API_KEY"):
-            self.clients["OpenAI"] = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            self.clients["OpenAI"] = get_openai_client(os.getenv("OPENAI_API_KEY"))
 
         # Gemini
         if os.getenv("GOOGLE_API_KEY"):
-            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-            self.clients["Gemini"] = genai
+            self.clients["Gemini"] = get_gemini_client(os.getenv("GOOGLE_API_KEY"))
 
 
     def get_available_providers(self) -> List[str]:
@@ -68,18 +318,21 @@ class LLMManager:
         return MODEL_PARAMETERS.get(model, {})
 
     def chat(self, provider: str, model: str, messages: List[Dict],
-             system_prompt: Optional[str] = None, context: Optional[str] = None,
+             system_prompt: Optional[str] = None, context: Optional[Union[str, List[str]]] = None,
              temperature: float = 1.0, max_tokens: int = 65536, top_p: float = 1,
-             reasoning_effort: Optional[str] = 'medium', use_defaults: bool = False) -> str:
+             reasoning_effort: Optional[str] = 'medium', use_defaults: bool = False,
+             max_output_tokens: Optional[int] = None, use_cache: bool = True,
+             agent: Optional[str] = None, response_format: Optional[str] = None,
+             response_schema: Optional[Dict] = None) -> str:
         """
         Sends a chat request to the selected model
 
         Args:
             provider: LLM provider (Gemini, OpenAI)
             model: Model name
-            messages: List of conversation messages
+            messages: List of conversation messages (not modified)
             system_prompt: System prompt (optional)
-            context: Additional context from RAG (optional)
+            context: Additional context from RAG, a string or a list of blocks (optional)
             temperature: Creativity control (0.0-2.0, default 0.7) - Ignored for GPT-5/GPT-5.1/o1/o3 models
             max_tokens: Maximum response length (default 2000) - Ignored for GPT-5/GPT-5.1/o1/o3 models
             top_p: Nucleus sampling (0.0-1.0, default 0.9) - Ignored for GPT-5/GPT-5.1/o1/o3 models
@@ -87,30 +340,279 @@ class LLMManager:
                 - "none": Disables reasoning (GPT-5.1 behaves like a standard model)
                 - "low", "medium", "high": Enables reasoning with different levels
             use_defaults: If True, uses provider default parameters and ignores temperature/max_tokens/top_p
+            max_output_tokens: Alias of max_tokens (Gemini naming, used by the page settings)
+            use_cache: If False bypasses the response cache (when enabled, see LLM_CACHE_CONFIG)
+            agent: Name of the calling agent, recorded in the telemetry
+            response_format: "json" to enable the provider-native JSON mode (see chat_structured)
+            response_schema: Optional JSON schema of the response (with response_format="json")
 
         Returns:
             LLM model response
         """
 
+        request = self.build_request(provider, model, messages, system_prompt, context, temperature,
+                                     max_tokens, top_p, reasoning_effort, use_defaults, max_output_tokens, agent,
+                                     response_format, response_schema)
+        return self.send(request, use_cache=use_cache)
+
+    def build_request(self, provider: str, model: str, messages: List[Dict],
+                      system_prompt: Optional[str] = None, context: Optional[Union[str, List[str]]] = None,
+                      temperature: float = 1.0, max_tokens: int = 65536, top_p: float = 1,
+                      reasoning_effort: Optional[str] = 'medium', use_defaults: bool = False,
+                      max_output_tokens: Optional[int] = None, agent: Optional[str] = None,
+                      response_format: Optional[str] = None,
+                      response_schema: Optional[Dict] = None) -> ChatRequest:
+        """
+        Assembles the immutable ChatRequest of a call (same parameters as chat)
+
+        The messages are copied, so the caller's list (e.g. a chat history in
+        st.session_state) is never modified. The context (a string or a list
+        of blocks) becomes a separate RAG segment, de-duplicated and capped
+        at RAG_CONTEXT_CONFIG["max_chars"]. The agent and the current
+        telemetry session are attached to the request for the telemetry.
+        response_format="json" enables the provider-native JSON mode
+        (optionally constrained by response_schema).
+        """
         if provider not in self.clients:
             raise ValueError(f"Provider {provider} not available. Check your API keys.")
 
-        # Prepara il contesto se disponibile
-        if context:
-            context_message = f"\n\nContesto RAG:\n{context}\n\n"
-            if messages:
-                messages[0]["content"] = context_message + messages[0]["content"]
+        if max_output_tokens is not None:
+            max_tokens = max_output_tokens
+
+        return ChatRequest.create(
+            provider, model, messages, context=context,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            reasoning_effort=reasoning_effort,
+            use_defaults=use_defaults,
+            agent=agent,
+            session_id=self.telemetry_session_id,
+            response_format=response_format,
+            response_schema=json.dumps(response_schema, sort_keys=True) if response_schema else None
+        )
+
+    def send(self, request: ChatRequest, use_cache: bool = True) -> str:
+        """
+        Sends a ChatRequest and returns the complete response
 
-        if provider == "Gemini":
-            return self._chat_gemini(model, messages, system_prompt, temperature, max_tokens, top_p, use_defaults)
-        elif provider == "OpenAI":
-            return self._chat_openai(model, messages, system_prompt, temperature, max_tokens, top_p, reasoning_effort, use_defaults)
+        When routing is enabled (LLM_ROUTING_CONFIG) and more than one
+        provider is configured, the request can fail over to, or be hedged
+        with, the next providers of the agent's fallback chain.
+        """
+        if routing_enabled():
+            return self._router.send(request, use_cache)
+        return self._send_direct(request, use_cache)
 
-        raise ValueError(f"Provider {provider} not supported")
+    def _send_direct(self, request: ChatRequest, use_cache: bool = True) -> str:
+        """Sends a ChatRequest to its own provider (no routing)"""
+        started = time.perf_counter()
+        cache = get_response_cache() if use_cache else None
+        cache_key = None
+        if cache:
+            cache_key = LLMResponseCache.make_key(request.cache_payload())
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self._record(request, started, started, {}, cache_hit=True)
+                return cached
 
-    def _chat_gemini(self, model: str, messages: List[Dict], system_prompt: Optional[str],
-                     temperature: float, max_tokens: int, top_p: float, use_defaults: bool = False) -> str:
-        """Chat with Gemini"""
+        messages = request.to_messages()
+        try:
+            if request.provider == "Gemini":
+                response, usage = self._chat_gemini(request.model, messages, request.system_prompt,
+                                                    request.temperature, request.max_tokens, request.top_p,
+                                                    request.use_defaults, json_mode=request.response_format == "json",
+                                                    json_schema=request.schema)
+            elif request.provider == "OpenAI":
+                response, usage = self._chat_openai(request.model, messages, request.system_prompt,
+                                                    request.temperature, request.max_tokens, request.top_p,
+                                                    request.reasoning_effort, request.use_defaults,
+                                                    json_mode=request.response_format == "json",
+                                                    json_schema=request.schema)
+            else:
+                raise ValueError(f"Provider {request.provider} not supported")
+        except Exception as exc:
+            self._record(request, started, None, {}, error=exc)
+            raise
+
+        # Senza streaming il primo token arriva insieme alla risposta completa
+        self._record(request, started, time.perf_counter(), usage)
+
+        if cache:
+            cache.put(cache_key, request.provider, request.model, response)
+
+        return response
+
+    def set_telemetry_session(self, session_id: Optional[str]):
+        """Sets the session whose telemetry file receives the records of the next calls"""
+        self.telemetry_session_id = session_id
+
+    @staticmethod
+    def _record(request: ChatRequest, started: float, first_token_at: Optional[float],
+                usage: Dict[str, Optional[int]], cache_hit: bool = False,
+                error: Optional[Exception] = None, stream: bool = False, completed: bool = True):
+        """Writes the telemetry record of a call"""
+        now = time.perf_counter()
+        prompt_tokens = usage.get("input_tokens")
+        completion_tokens = usage.get("output_tokens")
+
+        if error is not None:
+            status = "error"
+        elif not completed:
+            status = "incomplete"
+        else:
+            status = "ok"
+
+        record_call(request.session_id, {
+            "agent": request.agent or "unknown",
+            "provider": request.provider,
+            "model": request.model,
+            "stream": stream,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": usage.get("total_tokens"),
+            "ttft_ms": round((first_token_at - started) * 1000, 1) if first_token_at is not None else None,
+            "latency_ms": round((now - started) * 1000, 1),
+            "retries": request.retries,
+            "route": request.route,
+            "requested_model": request.requested_model,
+            "cache_hit": cache_hit,
+            "cost_usd": None if cache_hit else estimate_cost(request.model, prompt_tokens, completion_tokens),
+            "status": status,
+            "error": str(error) if error is not None else None
+        })
+
+    def chat_stream(self, provider: str, model: str, messages: List[Dict],
+                    system_prompt: Optional[str] = None, context: Optional[Union[str, List[str]]] = None,
+                    temperature: float = 1.0, max_tokens: int = 65536, top_p: float = 1,
+                    reasoning_effort: Optional[str] = 'medium', use_defaults: bool = False,
+                    max_output_tokens: Optional[int] = None, use_cache: bool = True,
+                    agent: Optional[str] = None, response_format: Optional[str] = None,
+                    response_schema: Optional[Dict] = None) -> "ChatStream":
+        """
+        Streaming variant of chat: same parameters, returns a ChatStream
+
+        Iterating the ChatStream yields the text deltas as they arrive (it can
+        be passed directly to st.write_stream); once exhausted, ChatStream.text
+        holds the complete response and ChatStream.usage the token usage.
+        """
+        request = self.build_request(provider, model, messages, system_prompt, context, temperature,
+                                     max_tokens, top_p, reasoning_effort, use_defaults, max_output_tokens, agent,
+                                     response_format, response_schema)
+        return self.send_stream(request, use_cache=use_cache)
+
+    def send_stream(self, request: ChatRequest, use_cache: bool = True) -> "ChatStream":
+        """
+        Sends a ChatRequest in streaming mode (see chat_stream)
+
+        With routing enabled, failover and hedging apply until the first
+        text delta arrives.
+        """
+        if not routing_enabled():
+            return self._send_stream_direct(request, use_cache)
+
+        stream, iterator, first_delta = self._router.send_stream(request, use_cache)
+        routed = ChatStream(self._resume_stream(stream, iterator, first_delta))
+        routed.cache_hit = stream.cache_hit
+        # Il modello che ha risposto (diverso da quello richiesto dopo failover/hedge)
+        routed.provider, routed.model, routed.route = stream.provider, stream.model, stream.route
+        return routed
+
+    @staticmethod
+    def _resume_stream(stream: "ChatStream", iterator, first_delta: Optional[str]):
+        """Yields the first delta (already received) and the rest of a started stream"""
+        if first_delta is not None:
+            yield first_delta
+        for delta in iterator:
+            yield delta
+        return stream.usage
+
+    def _send_stream_direct(self, request: ChatRequest, use_cache: bool = True) -> "ChatStream":
+        """Sends a ChatRequest in streaming mode to its own provider (no routing)"""
+        started = time.perf_counter()
+        cache = get_response_cache() if use_cache else None
+        cache_key = None
+        if cache:
+            cache_key = LLMResponseCache.make_key(request.cache_payload())
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self._record(request, started, started, {}, cache_hit=True, stream=True)
+                stream = ChatStream(self._replay_cached(cached), request)
+                stream.cache_hit = True
+                return stream
+
+        messages = request.to_messages()
+        if request.provider == "Gemini":
+            deltas = self._stream_gemini(request.model, messages, request.system_prompt, request.temperature,
+                                         request.max_tokens, request.top_p, request.use_defaults,
+                                         json_mode=request.response_format == "json", json_schema=request.schema)
+        elif request.provider == "OpenAI":
+            deltas = self._stream_openai(request.model, messages, request.system_prompt, request.temperature,
+                                         request.max_tokens, request.top_p, request.reasoning_effort,
+                                         request.use_defaults, json_mode=request.response_format == "json",
+                                         json_schema=request.schema)
+        else:
+            raise ValueError(f"Provider {request.provider} not supported")
+
+        if cache:
+            deltas = self._store_stream(deltas, cache, cache_key, request.provider, request.model)
+
+        return ChatStream(self._track_stream(deltas, request, started), request)
+
+    def _track_stream(self, deltas, request: ChatRequest, started: float):
+        """Passes the deltas through and writes the telemetry record when the stream ends"""
+        first_token_at = None
+        usage = {}
+        error = None
+        completed = False
+        try:
+            while True:
+                try:
+                    delta = next(deltas)
+                except StopIteration as stop:
+                    usage = stop.value or {}
+                    completed = True
+                    return usage
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                yield delta
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            if not completed:
+                # Stream abbandonato (errore, lettura interrotta o hedge perdente): si chiude la connessione
+                close = getattr(deltas, "close", None)
+                if close is not None:
+                    close()
+            # Anche uno stream interrotto (errore o lettura abbandonata) produce il suo record
+            self._record(request, started, first_token_at, usage, error=error, stream=True, completed=completed)
+
+    @staticmethod
+    def _replay_cached(response: str):
+        """Replays a cached response as a single delta"""
+        yield response
+        return {}
+
+    @staticmethod
+    def _store_stream(deltas, cache: LLMResponseCache, cache_key: str, provider: str, model: str):
+        """Passes the deltas through and caches the complete response once the stream ends"""
+        parts = []
+        while True:
+            try:
+                delta = next(deltas)
+            except StopIteration as stop:
+                # Raggiunto solo se lo stream è stato letto fino in fondo
+                cache.put(cache_key, provider, model, "".join(parts))
+                return stop.value
+            parts.append(delta)
+            yield delta
+
+    def _build_gemini_chat(self, model: str, messages: List[Dict], system_prompt: Optional[str],
+                           temperature: float, max_tokens: int, top_p: float, use_defaults: bool = False,
+                           json_mode: bool = False, json_schema: Optional[Dict] = None):
+        """Builds the Gemini chat session and returns it with the last message to send"""
         # Configura i parametri di generazione solo se use_defaults è False
         generation_config = None
         if not use_defaults:
@@ -120,11 +622,15 @@ class LLMManager:
                 "top_p": top_p,
             }
 
-        genai_model = genai.GenerativeModel(
-            model_name=model,
-            system_instruction=system_prompt,
-            generation_config=generation_config
-        )
+        # Modalità JSON nativa (ed eventuale schema della risposta)
+        if json_mode:
+            generation_config = dict(generation_config or {})
+            generation_config["response_mime_type"] = "application/json"
+            if json_schema:
+                generation_config["response_schema"] = json_schema
+
+        # Il modello configurato viene riutilizzato tra le chiamate
+        genai_model = get_gemini_model(model, system_prompt, generation_config)
 
         # Converti messaggi
         chat_history = []
@@ -133,14 +639,54 @@ class LLMManager:
             chat_history.append({"role": role, "parts": [msg["content"]]})
 
         chat = genai_model.start_chat(history=chat_history)
-        response = chat.send_message(messages[-1]["content"])
+        return chat, messages[-1]["content"]
+
+    def _chat_gemini(self, model: str, messages: List[Dict], system_prompt: Optional[str],
+                     temperature: float, max_tokens: int, top_p: float, use_defaults: bool = False,
+                     json_mode: bool = False, json_schema: Optional[Dict] = None):
+        """Chat with Gemini: returns the response text and the token usage"""
+        chat, last_message = self._build_gemini_chat(model, messages, system_prompt, temperature, max_tokens, top_p,
+                                                     use_defaults, json_mode, json_schema)
+        response = chat.send_message(last_message)
 
-        return response.text
+        return response.text, self._gemini_usage(getattr(response, "usage_metadata", None))
 
-    def _chat_openai(self, model: str, messages: List[Dict], system_prompt: Optional[str],
-                     temperature: float, max_tokens: int, top_p: float,
-                     reasoning_effort: Optional[str] = None, use_defaults: bool = False) -> str:
-        """Chat with OpenAI"""
+    def _stream_gemini(self, model: str, messages: List[Dict], system_prompt: Optional[str],
+                       temperature: float, max_tokens: int, top_p: float, use_defaults: bool = False,
+                       json_mode: bool = False, json_schema: Optional[Dict] = None):
+        """Streaming chat with Gemini: yields text deltas, returns the usage"""
+        chat, last_message = self._build_gemini_chat(model, messages, system_prompt, temperature, max_tokens, top_p,
+                                                     use_defaults, json_mode, json_schema)
+        response = chat.send_message(last_message, stream=True)
+
+        usage_metadata = None
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk senza parti di testo (es. solo metadati di fine generazione)
+                text = ""
+            if text:
+                yield text
+            usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata
+
+        usage_metadata = getattr(response, "usage_metadata", None) or usage_metadata
+        return self._gemini_usage(usage_metadata)
+
+    @staticmethod
+    def _gemini_usage(usage_metadata) -> Dict[str, Optional[int]]:
+        """Token usage of a Gemini response"""
+        return {
+            "input_tokens": getattr(usage_metadata, "prompt_token_count", None),
+            "output_tokens": getattr(usage_metadata, "candidates_token_count", None),
+            "total_tokens": getattr(usage_metadata, "total_token_count", None),
+        }
+
+    def _build_openai_kwargs(self, model: str, messages: List[Dict], system_prompt: Optional[str],
+                             temperature: float, max_tokens: int, top_p: float,
+                             reasoning_effort: Optional[str] = None, use_defaults: bool = False,
+                             json_mode: bool = False, json_schema: Optional[Dict] = None) -> Dict:
+        """Builds the OpenAI chat completion parameters"""
         if system_prompt:
             messages = [{"role": "system", "content": system_prompt}] + messages
 
@@ -166,10 +712,24 @@ class LLMManager:
                 kwargs["temperature"] = temperature
                 kwargs["top_p"] = top_p
 
+        # Modalità JSON nativa: con uno schema usa json_schema (non strict), altrimenti json_object
+        if json_mode:
+            if json_schema:
+                kwargs["response_format"] = {
+                    "type": "json_schema",
+                    "json_schema": {"name": "response", "schema": json_schema, "strict": False}
+                }
+            else:
+                kwargs["response_format"] = {"type": "json_object"}
+
+        return kwargs
+
+    def _create_openai_completion(self, kwargs: Dict):
+        """Calls chat.completions.create, retrying without max_tokens if the model rejects it"""
         client = self.clients["OpenAI"]
 
         try:
-            response = client.chat.completions.create(**kwargs)
+            return client.chat.completions.create(**kwargs)
         except Exception as exc:  # pylint: disable=broad-except
             error_text = str(exc)
             needs_completion_tokens = (
@@ -181,8 +741,298 @@ class LLMManager:
 
             if needs_completion_tokens or needs_output_tokens:
                 kwargs.pop("max_tokens", None)
-                response = client.chat.completions.create(**kwargs)
-            else:
-                raise
+                return client.chat.completions.create(**kwargs)
+            raise
+
+    def _chat_openai(self, model: str, messages: List[Dict], system_prompt: Optional[str],
+                     temperature: float, max_tokens: int, top_p: float,
+                     reasoning_effort: Optional[str] = None, use_defaults: bool = False,
+                     json_mode: bool = False, json_schema: Optional[Dict] = None):
+        """Chat with OpenAI: returns the response text and the token usage"""
+        kwargs = self._build_openai_kwargs(model, messages, system_prompt, temperature, max_tokens, top_p,
+                                           reasoning_effort, use_defaults, json_mode, json_schema)
+        response = self._create_openai_completion(kwargs)
+
+        return response.choices[0].message.content, self._openai_usage(getattr(response, "usage", None))
+
+    def _stream_openai(self, model: str, messages: List[Dict], system_prompt: Optional[str],
+                       temperature: float, max_tokens: int, top_p: float,
+                       reasoning_effort: Optional[str] = None, use_defaults: bool = False,
+                       json_mode: bool = False, json_schema: Optional[Dict] = None):
+        """Streaming chat with OpenAI: yields text deltas, returns the usage"""
+        kwargs = self._build_openai_kwargs(model, messages, system_prompt, temperature, max_tokens, top_p,
+                                           reasoning_effort, use_defaults, json_mode, json_schema)
+        kwargs["stream"] = True
+        kwargs["stream_options"] = {"include_usage": True}
+
+        usage = None
+        for chunk in self._create_openai_completion(kwargs):
+            if chunk.choices:
+                text = chunk.choices[0].delta.content
+                if text:
+                    yield text
+            # L'ultimo chunk (senza choices) contiene l'utilizzo di token
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+
+        return self._openai_usage(usage)
+
+    @staticmethod
+    def _openai_usage(usage) -> Dict[str, Optional[int]]:
+        """Token usage of an OpenAI completion"""
+        return {
+            "input_tokens": getattr(usage, "prompt_tokens", None),
+            "output_tokens": getattr(usage, "completion_tokens", None),
+            "total_tokens": getattr(usage, "total_tokens", None),
+        }
+
+    # ==================== STRUCTURED OUTPUT ====================
+
+    def chat_structured(self, provider: str, model: str, messages: List[Dict],
+                        response_schema: Optional[Dict] = None, item_keys: Optional[List[str]] = None,
+                        on_item: Optional[Callable[[str, Any], None]] = None, json_mode: bool = True,
+                        repair: bool = True, expect: Optional[type] = dict, **kwargs) -> Dict[str, Any]:
+        """
+        Sends a request whose response is a JSON document and returns it parsed
+
+        The response is streamed and parsed incrementally: every element of
+        the arrays named in item_keys (e.g. "beliefs", "steps") is passed to
+        on_item(key, item) as soon as it is complete, so callers can save
+        early objects. With json_mode the provider-native JSON mode is used
+        (Gemini response_mime_type, OpenAI response_format); the optional
+        response_schema constrains the document. A malformed or truncated
+        document is fixed by parse_structured, repairing only its tail.
+
+        Args:
+            provider, model, messages: As in chat
+            response_schema: Optional JSON schema of the response
+            item_keys: Names of the arrays whose elements are emitted incrementally
+            on_item: Callback receiving (array name, element)
+            json_mode: Use the provider-native JSON mode
+            repair: Allow the targeted repair call for a malformed tail
+            expect: Required type of the document (dict, list or None for any)
+            **kwargs: Other chat parameters (system_prompt, temperature, agent, use_cache, ...)
+
+        Returns:
+            Dict with 'data' (parsed document), 'text' (raw response), 'items'
+            (elements emitted incrementally) and 'repaired' (None, "llm" or "local")
+
+        Raises:
+            StructuredOutputError: if no valid JSON document can be obtained
+        """
+        use_cache = kwargs.pop("use_cache", True)
+        # OpenAI json_object produce solo oggetti: per le liste la modalità nativa non si applica
+        native_json = json_mode and (expect is dict or response_schema is not None)
+        request = self.build_request(provider, model, messages,
+                                     response_format="json" if native_json else None,
+                                     response_schema=response_schema if native_json else None, **kwargs)
+
+        parser = IncrementalJSONParser(item_keys or [])
+        stream = self.send_stream(request, use_cache=use_cache)
+        for delta in stream:
+            for key, item in parser.feed(delta):
+                if on_item:
+                    on_item(key, item)
+
+        result = self.parse_structured(stream.text, request.provider, request.model, expect=expect,
+                                       repair=repair, agent=request.agent)
+        result["items"] = [item for _, item in parser.items]
+        return result
+
+    def parse_structured(self, text: str, provider: Optional[str] = None, model: Optional[str] = None,
+                         expect: Optional[type] = dict, repair: bool = True,
+                         agent: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Parses the JSON document of an LLM response, repairing it if malformed
+
+        The document is extracted from plain JSON, code fences or prose. If
+        it is malformed or truncated, the valid prefix is kept and only the
+        tail is sent to the model (provider/model) with a short repair
+        request; if that fails too, the complete elements of the prefix are
+        kept and the open containers closed locally.
+
+        Returns:
+            Dict with 'data', 'text' and 'repaired' (None, "llm" or "local")
+
+        Raises:
+            StructuredOutputError: if no valid JSON document can be obtained
+        """
+        data = extract_json(text, expect=expect)
+        if data is not None:
+            return {"data": data, "text": text, "repaired": None}
+
+        split = split_valid_prefix(text or "")
+        if split is None:
+            raise StructuredOutputError("LLM response does not contain JSON", text)
+
+        prefix, tail, open_containers = split
+        if repair and provider and model and provider in self.clients:
+            try:
+                repaired_tail = self._repair_tail(prefix, tail, open_containers, provider, model, agent)
+                # Il documento riparato deve essere valido per intero, non solo in un suo frammento
+                data = json.loads(prefix + repaired_tail)
+                if expect is not None and not isinstance(data, expect):
+                    data = None
+            except Exception as e:
+                print(f"Error repairing JSON response: {e}")
+                data = None
+            if data is not None:
+                return {"data": data, "text": text, "repaired": "llm"}
+
+        data = close_valid_prefix(text)
+        if data is not None and (expect is None or isinstance(data, expect)):
+            return {"data": data, "text": text, "repaired": "local"}
+
+        raise StructuredOutputError("LLM response contains malformed JSON", text)
+
+    def _repair_tail(self, prefix: str, tail: str, open_containers: List[str],
+                     provider: str, model: str, agent: Optional[str]) -> str:
+        """Targeted repair call: asks the model to rewrite only the malformed tail of a JSON document"""
+        closing = "".join(reversed(open_containers))
+        prompt = (
+            "A JSON document is valid up to the marker <<<CUT>>> and malformed or truncated after it.\n"
+            "Rewrite ONLY the text after the marker so that the whole document becomes valid JSON: "
+            "fix or complete the last element if possible, otherwise drop it, and close the open "
+            f"containers ({closing}). Return only the replacement text, without code fences or comments.\n\n"
+            f"END OF THE VALID PART:\n{prefix[-JSON_REPAIR_CONTEXT_CHARS:]}<<<CUT>>>{tail}"
+        )
+        repaired = self.chat(
+            provider=provider,
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            system_prompt="You repair malformed JSON. Output only JSON text.",
+            temperature=0,
+            max_tokens=JSON_REPAIR_MAX_TOKENS,
+            use_cache=False,
+            agent=f"{agent or 'unknown'}:repair"
+        ).strip()
+
+        # Rimuove l'eventuale blocco ``` aggiunto dal modello
+        if repaired.startswith("```"):
+            repaired = repaired.split("\n", 1)[1] if "\n" in repaired else ""
+            repaired = repaired.rsplit("```", 1)[0]
+        return repaired
+
+    # ==================== ASYNC / CONCURRENT EXECUTION ====================
+
+    async def achat(self, provider: str, model: str, messages: List[Dict],
+                    max_retries: Optional[int] = None,
+                    semaphore: Optional[asyncio.Semaphore] = None, **kwargs) -> str:
+        """
+        Async version of chat with per-provider rate limiting and retry
+
+        The provider SDK call runs in a worker thread. Errors 429/5xx and
+        transient connection errors are retried with exponential backoff and
+        full jitter (see RETRY_POLICY).
+
+        Args:
+            provider: LLM provider (Gemini, OpenAI)
+            model: Model name
+            messages: List of conversation messages (not modified)
+            max_retries: Maximum number of retries (default RETRY_POLICY["max_retries"])
+            semaphore: Optional semaphore bounding the concurrent requests
+            **kwargs: Other chat parameters (system_prompt, context, temperature, agent, use_cache, ...)
+
+        Returns:
+            LLM model response
+        """
+        if provider not in self.clients:
+            raise ValueError(f"Provider {provider} not available. Check your API keys.")
+
+        retries = RETRY_POLICY["max_retries"] if max_retries is None else max_retries
+        limiter = self._rate_limiters.get(provider)
+        use_cache = kwargs.pop("use_cache", True)
+        request = self.build_request(provider, model, messages, **kwargs)
+        attempt = 0
+
+        while True:
+            if limiter:
+                wait = limiter.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+            try:
+                # Ogni tentativo registra nella telemetria il numero di retry che lo hanno preceduto
+                attempt_request = dataclasses.replace(request, retries=attempt)
+                if semaphore is not None:
+                    async with semaphore:
+                        return await asyncio.to_thread(self.send, attempt_request, use_cache)
+                return await asyncio.to_thread(self.send, attempt_request, use_cache)
+            except Exception as exc:  # pylint: disable=broad-except
+                if attempt >= retries or not is_retryable_error(exc):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+
+    async def achat_many(self, requests: List[Dict[str, Any]],
+                         max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                         return_exceptions: bool = True) -> List[Union[str, Exception]]:
+        """
+        Runs several chat requests concurrently (async)
+
+        Concurrency is bounded globally by max_concurrency and per provider by
+        PROVIDER_RATE_LIMITS[provider]["max_concurrency"].
+
+        Args:
+            requests: List of achat keyword arguments (provider, model, messages, ...)
+            max_concurrency: Maximum number of requests in flight
+            return_exceptions: If True failed requests return their exception instead of raising
+
+        Returns:
+            Responses in the same order as requests
+        """
+        global_semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        provider_semaphores = {
+            provider: asyncio.Semaphore(max(1, limits.get("max_concurrency", max_concurrency)))
+            for provider, limits in PROVIDER_RATE_LIMITS.items()
+        }
+
+        async def run(request: Dict[str, Any]) -> str:
+            provider_semaphore = provider_semaphores.get(request.get("provider"))
+            async with global_semaphore:
+                return await self.achat(semaphore=provider_semaphore, **request)
+
+        return await asyncio.gather(*(run(request) for request in requests),
+                                    return_exceptions=return_exceptions)
+
+    def chat_many(self, requests: List[Dict[str, Any]],
+                  max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                  return_exceptions: bool = True) -> List[Union[str, Exception]]:
+        """
+        Runs several chat requests concurrently and waits for all of them
+
+        Synchronous entry point for Streamlit pages and engines (see achat_many).
+
+        Args:
+            requests: List of chat keyword arguments (provider, model, messages, ...)
+            max_concurrency: Maximum number of requests in flight
+            return_exceptions: If True failed requests return their exception instead of raising
+
+        Returns:
+            Responses (or exceptions) in the same order as requests
+        """
+        if not requests:
+            return []
+
+        coroutine = self.achat_many(requests, max_concurrency=max_concurrency,
+                                    return_exceptions=return_exceptions)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+
+        # Già dentro un event loop: esegui in un thread dedicato con un loop proprio
+        result = {}
+
+        def runner():
+            try:
+                result["value"] = asyncio.run(coroutine)
+            except Exception as exc:  # pylint: disable=broad-except
+                result["error"] = exc
 
-        return response.choices[0].message.content
+        thread = threading.Thread(target=runner)
+        thread.start()
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["value"]
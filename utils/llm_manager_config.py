@@ -202,3 +202,191 @@ MODEL_PARAMETERS = {
         }
     }
 }
+
+
+# ==================== CONCORRENZA E RETRY ====================
+
+# Limiti per provider usati da LLMManager.achat / chat_many:
+# - requests_per_minute: richieste avviate al minuto (rate limit lato client)
+# - max_concurrency: richieste contemporanee verso lo stesso provider
+PROVIDER_RATE_LIMITS = {
+    "Gemini": {
+        "requests_per_minute": 60,
+        "max_concurrency": 8
+    },
+    "OpenAI": {
+        "requests_per_minute": 120,
+        "max_concurrency": 8
+    }
+}
+
+# Numero massimo di richieste contemporanee di una singola chat_many
+DEFAULT_MAX_CONCURRENCY = 6
+
+# Retry con backoff esponenziale e jitter su errori 429 / 5xx
+RETRY_POLICY = {
+    "max_retries": 4,
+    "base_delay": 1.0,   # secondi
+    "max_delay": 30.0    # secondi
+}
+
+
+# ==================== CACHE DELLE RISPOSTE ====================
+
+# Cache su disco delle risposte LLM (opt-in).
+# Si abilita con "enabled": True oppure con la variabile d'ambiente LUMIA_LLM_CACHE=1;
+# ogni chiamata può bypassarla con use_cache=False.
+LLM_CACHE_CONFIG = {
+    "enabled": False,
+    "path": "./data/llm_cache.sqlite3",
+    "ttl_seconds": 7 * 24 * 3600,
+    "max_entries": 5000
+}
+
+
+# ==================== CONNESSIONI ====================
+
+# Pool HTTP condiviso dal client OpenAI di processo (keep-alive tra le chiamate)
+HTTP_POOL_CONFIG = {
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 60.0,   # secondi
+    "timeout": 600.0            # secondi (le risposte dei modelli reasoning possono essere lunghe)
+}
+
+# Numero massimo di GenerativeModel Gemini configurati tenuti in cache
+GEMINI_MODEL_CACHE_SIZE = 32
+
+
+# ==================== COMPATTAZIONE DELLA CRONOLOGIA ====================
+
+# Configurazione per agente di utils/history_manager.HistoryCompactor:
+# - max_history_tokens: oltre questa soglia la cronologia viene compattata
+# - keep_last_turns: turni recenti (messaggio utente + risposte) inviati integralmente
+# - summary_max_tokens: lunghezza massima del riassunto dei turni precedenti
+# - pinned_artefacts: numero di messaggi con artefatti BDI (report JSON) mantenuti integralmente
+HISTORY_COMPACTION_CONFIG = {
+    "default": {
+        "max_history_tokens": 16000,
+        "keep_last_turns": 6,
+        "summary_max_tokens": 1200,
+        "pinned_artefacts": 1
+    },
+    "ali": {
+        "max_history_tokens": 16000,
+        "keep_last_turns": 6,
+        "summary_max_tokens": 1200,
+        "pinned_artefacts": 1
+    },
+    "believer": {
+        "max_history_tokens": 20000,
+        "keep_last_turns": 6,
+        "summary_max_tokens": 1500,
+        "pinned_artefacts": 1
+    },
+    "cuma": {
+        "max_history_tokens": 20000,
+        "keep_last_turns": 6,
+        "summary_max_tokens": 1500,
+        "pinned_artefacts": 2
+    }
+}
+
+
+# ==================== CONTESTO RAG ====================
+
+# Segmento di contesto RAG aggiunto alle richieste (utils/llm_request.py):
+# i blocchi duplicati vengono rimossi e il segmento è troncato a max_chars
+RAG_CONTEXT_CONFIG = {
+    "max_chars": 32000,
+    "header": "Contesto RAG:"
+}
+
+
+# ==================== TELEMETRIA ====================
+
+# Un record JSONL per chiamata LLM (utils/llm_telemetry.py), scritto nella
+# cartella della sessione attiva; le chiamate senza sessione vanno in global_path
+LLM_TELEMETRY_CONFIG = {
+    "enabled": True,
+    "sessions_dir": "./data/sessions",
+    "file_name": "llm_telemetry.jsonl",
+    "global_path": "./data/llm_telemetry.jsonl"
+}
+
+# Prezzi indicativi in USD per milione di token (input, output), usati per la stima dei costi
+LLM_PRICING = {
+    "gemini-2.5-flash-lite": {"input": 0.10, "output": 0.40},
+    "gemini-2.5-flash": {"input": 0.30, "output": 2.50},
+    "gemini-2.5-pro": {"input": 1.25, "output": 10.00},
+    "gemini-3-pro-preview": {"input": 2.00, "output": 12.00},
+    "gpt-5": {"input": 1.25, "output": 10.00},
+    "gpt-5-nano": {"input": 0.05, "output": 0.40},
+    "gpt-5-mini": {"input": 0.25, "output": 2.00},
+    "gpt-5.1": {"input": 1.25, "output": 10.00},
+    "gpt-5.1-chat-latest": {"input": 1.25, "output": 10.00},
+    "gpt-5.2": {"input": 1.75, "output": 14.00},
+    "gpt-5.2-pro": {"input": 21.00, "output": 168.00},
+    "gpt-5.2-chat-latest": {"input": 1.75, "output": 14.00}
+}
+
+
+# ==================== ROUTING E FAILOVER ====================
+
+# Politica di routing di LLMManager (utils/llm_router.py), applicata a chat e chat_stream.
+# - chain: provider (o "Provider:modello") da provare, in ordine, dopo quello richiesto
+# - failover_timeout_seconds: se la risposta (o il primo token in streaming) non arriva
+#   entro questo tempo parte il candidato successivo; vince la prima risposta
+# - hedge_enabled / hedge_after_seconds: richiesta "hedged", il secondo candidato parte
+#   già dopo hedge_after_seconds (opt-in: la copia va a un altro provider/modello e costa
+#   una seconda chiamata; il modello che risponde è registrato nella telemetria)
+# - health: i provider con punteggio sotto unhealthy_below vengono spostati in fondo alla catena
+# Si disattiva con "enabled": False oppure con LUMIA_LLM_ROUTING=0
+LLM_ROUTING_CONFIG = {
+    "enabled": True,
+    "chain": ["Gemini", "OpenAI"],
+    "failover_timeout_seconds": 180.0,
+    "hedge_enabled": False,
+    "hedge_after_seconds": 20.0,
+    # Configurazione per agente (il nome "auditor:ali" usa anche la voce "auditor")
+    "agents": {
+        "auditor": {
+            "failover_timeout_seconds": 60.0,
+            "hedge_enabled": False,
+            "hedge_after_seconds": 15.0
+        },
+        "genius": {
+            "hedge_enabled": False,
+            "hedge_after_seconds": 30.0
+        }
+    },
+    "health": {
+        "window": 20,                    # esiti recenti considerati per provider
+        "max_age_seconds": 300.0,        # gli esiti più vecchi vengono ignorati (il provider recupera)
+        "min_calls": 3,                  # sotto questo numero di esiti il provider è considerato sano
+        "latency_target_seconds": 30.0,  # latenza media oltre la quale il punteggio cala
+        "unhealthy_below": 0.5
+    }
+}
+
+# Modello equivalente da usare quando si passa a un altro provider
+MODEL_EQUIVALENTS = {
+    "gemini-2.5-flash-lite": {"OpenAI": "gpt-5-nano"},
+    "gemini-2.5-flash": {"OpenAI": "gpt-5-mini"},
+    "gemini-2.5-pro": {"OpenAI": "gpt-5"},
+    "gemini-3-pro-preview": {"OpenAI": "gpt-5.2"},
+    "gpt-5-nano": {"Gemini": "gemini-2.5-flash-lite"},
+    "gpt-5-mini": {"Gemini": "gemini-2.5-flash"},
+    "gpt-5": {"Gemini": "gemini-2.5-pro"},
+    "gpt-5.1": {"Gemini": "gemini-2.5-pro"},
+    "gpt-5.1-chat-latest": {"Gemini": "gemini-2.5-flash"},
+    "gpt-5.2": {"Gemini": "gemini-3-pro-preview"},
+    "gpt-5.2-pro": {"Gemini": "gemini-3-pro-preview"},
+    "gpt-5.2-chat-latest": {"Gemini": "gemini-2.5-flash"}
+}
+
+# Modello di ripiego di un provider quando non esiste un equivalente
+FALLBACK_MODELS = {
+    "Gemini": "gemini-2.5-flash",
+    "OpenAI": "gpt-5-mini"
+}
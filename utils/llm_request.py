@@ -0,0 +1,146 @@
+"""
+ChatRequest - Immutable description of a single LLM chat call
+
+This module handles:
+- Snapshotting the caller's messages (the caller's list is never modified)
+- Building the RAG context segment: blocks de-duplicated and size-capped
+- Rendering the provider messages, with the RAG segment prepended to the
+  first message, freshly for every call
+- The canonical payload used as response cache key
+"""
+
+import re
+import json
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from utils.llm_manager_config import RAG_CONTEXT_CONFIG
+
+
+def build_rag_segment(context: Optional[Union[str, Sequence[str]]],
+                      max_chars: Optional[int] = None) -> Optional[str]:
+    """
+    Builds the RAG context segment of a request
+
+    The context (a string, or a list of blocks such as retrieved chunks) is
+    split into blocks separated by blank lines; repeated blocks (compared
+    ignoring case and whitespace) are kept once, in their first position.
+    Blocks are added until max_chars is reached; a block that does not fit
+    is truncated only when it is the first one.
+
+    Returns:
+        The segment text, or None when there is no context
+    """
+    if not context:
+        return None
+
+    max_chars = RAG_CONTEXT_CONFIG["max_chars"] if max_chars is None else max_chars
+    parts = [context] if isinstance(context, str) else list(context)
+
+    blocks = []
+    seen = set()
+    for part in parts:
+        for block in re.split(r"\n\s*\n", part or ""):
+            block = block.strip()
+            key = re.sub(r"\s+", " ", block).casefold()
+            if not block or key in seen:
+                continue
+            seen.add(key)
+            blocks.append(block)
+
+    segment = ""
+    for block in blocks:
+        candidate = f"{segment}\n\n{block}" if segment else block
+        if max_chars and len(candidate) > max_chars:
+            if not segment:
+                segment = block[:max_chars]
+            break
+        segment = candidate
+
+    return segment or None
+
+
+@dataclass(frozen=True)
+class ChatMessage:
+    """A single conversation message"""
+    role: str
+    content: str
+
+
+@dataclass(frozen=True)
+class ChatRequest:
+    """
+    Immutable chat request, assembled once per call by LLMManager.build_request
+
+    The RAG context is kept as a separate segment and merged into the
+    messages only when they are rendered for the provider.
+    """
+    provider: str
+    model: str
+    messages: Tuple[ChatMessage, ...]
+    system_prompt: Optional[str] = None
+    rag_context: Optional[str] = None
+    temperature: float = 1.0
+    max_tokens: int = 65536
+    top_p: float = 1
+    reasoning_effort: Optional[str] = 'medium'
+    use_defaults: bool = False
+    # Output strutturato: "json" attiva la modalità JSON nativa del provider,
+    # response_schema è lo schema JSON serializzato (stringa, per mantenere la richiesta immutabile)
+    response_format: Optional[str] = None
+    response_schema: Optional[str] = None
+    # Metadati di telemetria: non fanno parte della chiave di cache
+    agent: Optional[str] = None
+    session_id: Optional[str] = None
+    retries: int = 0
+    route: Optional[str] = None
+    # "Provider/modello" chiesto dal chiamante, impostato solo sui candidati di failover/hedge
+    requested_model: Optional[str] = None
+
+    @classmethod
+    def create(cls, provider: str, model: str, messages: List[Dict],
+               context: Optional[Union[str, Sequence[str]]] = None, **params) -> "ChatRequest":
+        """Builds a request from the caller's messages (copied) and raw RAG context"""
+        snapshot = tuple(
+            ChatMessage(role=message.get("role"), content=message.get("content") or "")
+            for message in messages
+        )
+        return cls(
+            provider=provider,
+            model=model,
+            messages=snapshot,
+            rag_context=build_rag_segment(context),
+            **params
+        )
+
+    @property
+    def schema(self) -> Optional[Dict]:
+        """The response JSON schema as a dict (None when not set)"""
+        return json.loads(self.response_schema) if self.response_schema else None
+
+    def to_messages(self) -> List[Dict]:
+        """Returns new provider messages, with the RAG segment prepended to the first one"""
+        messages = [{"role": message.role, "content": message.content} for message in self.messages]
+        if self.rag_context and messages:
+            header = RAG_CONTEXT_CONFIG["header"]
+            messages[0]["content"] = f"\n\n{header}\n{self.rag_context}\n\n" + messages[0]["content"]
+        return messages
+
+    def cache_payload(self) -> Dict:
+        """Canonical description of the request used as response cache key"""
+        payload = {
+            "provider": self.provider,
+            "model": self.model,
+            "system_prompt": self.system_prompt,
+            "messages": self.to_messages(),
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "top_p": self.top_p,
+            "reasoning_effort": self.reasoning_effort,
+            "use_defaults": self.use_defaults
+        }
+        # Campi aggiunti solo se usati: le chiavi delle richieste testuali restano invariate
+        if self.response_format:
+            payload["response_format"] = self.response_format
+            payload["response_schema"] = self.response_schema
+        return payload
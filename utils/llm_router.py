@@ -0,0 +1,302 @@
+"""
+LLMRouter - Provider failover, hedged requests and health scoring for LLMManager
+
+This module handles:
+- The ordered fallback chain of every agent (requested provider first,
+  then the providers of LLM_ROUTING_CONFIG, with equivalent models)
+- Failover on retryable errors and on timeouts (the next candidate starts,
+  the first answer wins)
+- Optional hedged requests: the next candidate starts after a latency threshold
+- Process-wide provider health, scored on recent errors and latency;
+  unhealthy providers are moved to the end of the chain
+"""
+
+import os
+import time
+import threading
+import dataclasses
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional
+
+from utils.llm_manager_config import LLM_ROUTING_CONFIG, MODEL_EQUIVALENTS, FALLBACK_MODELS
+from utils.llm_request import ChatRequest
+
+
+LLM_ROUTING_ENV_VAR = "LUMIA_LLM_ROUTING"
+ROUTER_MAX_WORKERS = 16
+
+# Esecutore condiviso: le richieste abbandonate (timeout/hedge) terminano in background
+_executor = ThreadPoolExecutor(max_workers=ROUTER_MAX_WORKERS, thread_name_prefix="llm-router")
+
+
+def routing_enabled() -> bool:
+    """True when the routing policy is active (LLM_ROUTING_CONFIG, LUMIA_LLM_ROUTING overrides)"""
+    env_value = os.environ.get(LLM_ROUTING_ENV_VAR)
+    if env_value is None:
+        return LLM_ROUTING_CONFIG["enabled"]
+    return env_value.lower() in ("1", "true", "yes")
+
+
+class ProviderHealth:
+    """
+    Recent outcomes of the providers, shared by every LLMManager of the process
+
+    The score of a provider is its success rate over the last calls,
+    reduced when the mean latency exceeds latency_target_seconds
+    (1.0 = healthy). Outcomes older than max_age_seconds are ignored and
+    providers with fewer than min_calls recent outcomes score 1.0, so a
+    demoted provider is tried first again after a while.
+    """
+
+    def __init__(self, window: int, latency_target_seconds: float,
+                 max_age_seconds: float = 300.0, min_calls: int = 3):
+        self.window = window
+        self.latency_target_seconds = latency_target_seconds
+        self.max_age_seconds = max_age_seconds
+        self.min_calls = min_calls
+        self._outcomes: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, ok: bool, latency_seconds: float):
+        with self._lock:
+            outcomes = self._outcomes.setdefault(provider, deque(maxlen=self.window))
+            outcomes.append((ok, latency_seconds, time.monotonic()))
+
+    def _recent(self, provider: str) -> List[tuple]:
+        cutoff = time.monotonic() - self.max_age_seconds
+        with self._lock:
+            return [(ok, latency) for ok, latency, at in self._outcomes.get(provider, ()) if at >= cutoff]
+
+    def score(self, provider: str) -> float:
+        outcomes = self._recent(provider)
+        if len(outcomes) < self.min_calls:
+            return 1.0
+
+        success_rate = sum(1 for ok, _ in outcomes if ok) / len(outcomes)
+        latencies = [latency for ok, latency in outcomes if ok]
+        if not latencies:
+            return success_rate
+
+        mean_latency = sum(latencies) / len(latencies)
+        latency_factor = min(1.0, self.latency_target_seconds / mean_latency) if mean_latency else 1.0
+        return success_rate * latency_factor
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Returns recent calls, errors, mean latency and score of every provider"""
+        with self._lock:
+            providers = list(self._outcomes)
+
+        stats = {}
+        for provider in providers:
+            outcomes = self._recent(provider)
+            latencies = [latency for ok, latency in outcomes if ok]
+            stats[provider] = {
+                "calls": len(outcomes),
+                "errors": sum(1 for ok, _ in outcomes if not ok),
+                "mean_latency_seconds": sum(latencies) / len(latencies) if latencies else None,
+                "score": self.score(provider)
+            }
+        return stats
+
+
+_health = ProviderHealth(
+    window=LLM_ROUTING_CONFIG["health"]["window"],
+    latency_target_seconds=LLM_ROUTING_CONFIG["health"]["latency_target_seconds"],
+    max_age_seconds=LLM_ROUTING_CONFIG["health"]["max_age_seconds"],
+    min_calls=LLM_ROUTING_CONFIG["health"]["min_calls"]
+)
+
+
+def get_provider_health() -> ProviderHealth:
+    """Returns the process-wide provider health registry"""
+    return _health
+
+
+class LLMRouter:
+    """
+    Routes a ChatRequest over its fallback chain
+
+    send_direct/send_stream_direct are the LLMManager methods that call a
+    single provider; is_retryable decides which errors trigger a failover
+    (other errors are raised immediately).
+    """
+
+    def __init__(self, available_providers: Callable[[], List[str]],
+                 send_direct: Callable, send_stream_direct: Callable,
+                 is_retryable: Callable[[Exception], bool]):
+        self._available_providers = available_providers
+        self._send_direct = send_direct
+        self._send_stream_direct = send_stream_direct
+        self._is_retryable = is_retryable
+
+    # ==================== Policy ====================
+
+    @staticmethod
+    def agent_policy(agent: Optional[str]) -> Dict:
+        """Routing settings of an agent ("auditor:ali" falls back to "auditor")"""
+        policy = {key: value for key, value in LLM_ROUTING_CONFIG.items() if key not in ("agents", "health")}
+        agents = LLM_ROUTING_CONFIG.get("agents", {})
+        if agent:
+            base_agent = agent.split(":", 1)[0]
+            policy.update(agents.get(base_agent, {}))
+            if agent != base_agent:
+                policy.update(agents.get(agent, {}))
+        return policy
+
+    @staticmethod
+    def _model_for(provider: str, requested: ChatRequest) -> str:
+        if provider == requested.provider:
+            return requested.model
+        return MODEL_EQUIVALENTS.get(requested.model, {}).get(provider) or FALLBACK_MODELS[provider]
+
+    def plan(self, request: ChatRequest) -> List[ChatRequest]:
+        """
+        Returns the candidate requests, in the order they will be tried
+
+        The requested provider/model comes first, followed by the chain of
+        the agent; entries can be "Provider" (equivalent model) or
+        "Provider:model". Unavailable providers are skipped and unhealthy
+        ones are moved to the end.
+        """
+        policy = self.agent_policy(request.agent)
+        available = set(self._available_providers())
+
+        targets = [(request.provider, request.model)]
+        for entry in policy.get("chain", []):
+            provider, _, model = entry.partition(":")
+            targets.append((provider, model or self._model_for(provider, request)))
+
+        seen = set()
+        candidates = []
+        for provider, model in targets:
+            if provider not in available or (provider, model) in seen:
+                continue
+            seen.add((provider, model))
+            candidates.append((provider, model))
+
+        threshold = LLM_ROUTING_CONFIG["health"]["unhealthy_below"]
+        healthy = [c for c in candidates if _health.score(c[0]) >= threshold]
+        unhealthy = [c for c in candidates if _health.score(c[0]) < threshold]
+
+        planned = []
+        for provider, model in healthy + unhealthy:
+            if (provider, model) == (request.provider, request.model):
+                planned.append(dataclasses.replace(request, route="primary"))
+            else:
+                planned.append(dataclasses.replace(
+                    request, provider=provider, model=model, route="fallback",
+                    requested_model=f"{request.provider}/{request.model}"
+                ))
+        return planned
+
+    @staticmethod
+    def _launch_delay(policy: Dict) -> float:
+        """Seconds after which the next candidate starts while the current ones are still running"""
+        if policy.get("hedge_enabled"):
+            return min(policy["hedge_after_seconds"], policy["failover_timeout_seconds"])
+        return policy["failover_timeout_seconds"]
+
+    # ==================== Execution ====================
+
+    def _submit(self, function: Callable, candidate: ChatRequest, *args):
+        """Runs a candidate in the executor and records its outcome in the provider health"""
+        started = time.perf_counter()
+        future = _executor.submit(function, candidate, *args)
+
+        def on_done(done_future):
+            ok = done_future.exception() is None
+            _health.record(candidate.provider, ok, time.perf_counter() - started)
+
+        future.add_done_callback(on_done)
+        return future
+
+    def _race(self, candidates: List[ChatRequest], function: Callable, *args,
+              discard: Optional[Callable] = None):
+        """
+        Runs the candidates with failover/hedging and returns the first successful result
+
+        A candidate starts when the previous ones failed with a retryable
+        error or did not answer within the launch delay; results of the
+        abandoned candidates are passed to discard (e.g. to close a stream)
+        as soon as they arrive. A non-retryable error stops the failover
+        (candidates already running can still answer).
+        """
+        policy = self.agent_policy(candidates[0].agent)
+        delay = self._launch_delay(policy)
+
+        pending = {}
+        errors = []
+        fatal_error = None
+        next_index = 0
+
+        def launch_next():
+            nonlocal next_index
+            candidate = candidates[next_index]
+            if next_index > 0 and pending:
+                candidate = dataclasses.replace(candidate, route="hedge")
+            pending[self._submit(function, candidate, *args)] = candidate
+            next_index += 1
+
+        launch_next()
+        while pending:
+            can_launch = next_index < len(candidates) and not fatal_error
+            done, _ = wait(list(pending), timeout=delay if can_launch else None, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Timeout: parte il candidato successivo, quelli in corso continuano a concorrere
+                launch_next()
+                continue
+
+            for future in done:
+                candidate = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    if discard is not None:
+                        for loser in pending:
+                            loser.add_done_callback(
+                                lambda lost: discard(lost.result()) if lost.exception() is None else None
+                            )
+                    return future.result()
+                if not self._is_retryable(error) and not isinstance(error, TimeoutError):
+                    fatal_error = error
+                    continue
+                print(f"LLM call failed on {candidate.provider}/{candidate.model}, trying fallback: {error}")
+                errors.append(error)
+
+            if not pending and next_index < len(candidates) and not fatal_error:
+                launch_next()
+
+        raise fatal_error or errors[-1]
+
+    def send(self, request: ChatRequest, use_cache: bool = True) -> str:
+        """Sends a request over its fallback chain and returns the first response"""
+        candidates = self.plan(request)
+        if len(candidates) <= 1:
+            return self._send_direct(candidates[0] if candidates else request, use_cache)
+        return self._race(candidates, self._send_direct, use_cache)
+
+    def send_stream(self, request: ChatRequest, use_cache: bool = True):
+        """
+        Streaming variant of send
+
+        Failover and hedging apply until the first text delta arrives; the
+        winning stream is returned already started: (stream, iterator, first_delta).
+        """
+        candidates = self.plan(request)
+        if len(candidates) <= 1:
+            return self._open_stream(candidates[0] if candidates else request, use_cache)
+        return self._race(candidates, self._open_stream, use_cache, discard=self._close_stream)
+
+    @staticmethod
+    def _close_stream(opened):
+        """Closes a stream that lost the race (its telemetry is recorded as incomplete)"""
+        stream, _, _ = opened
+        stream.close()
+
+    def _open_stream(self, candidate: ChatRequest, use_cache: bool):
+        """Starts a stream and waits for its first delta (None for an empty response)"""
+        stream = self._send_stream_direct(candidate, use_cache)
+        iterator = iter(stream)
+        first_delta = next(iterator, None)
+        return stream, iterator, first_delta
@@ -0,0 +1,133 @@
+"""
+LLM telemetry - One record per LLM call, appended to a JSONL file per session
+
+This module handles:
+- Writing the call records (agent, provider, model, tokens, time to first
+  token, latency, retries, cache hit, outcome)
+- Reading the records of a session
+- Aggregating them per agent (p50/p95 latency, tokens, estimated cost)
+"""
+
+import os
+import json
+import math
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from utils.llm_manager_config import LLM_TELEMETRY_CONFIG, LLM_PRICING
+
+
+_write_lock = threading.Lock()
+
+
+def telemetry_path(session_id: Optional[str]) -> Optional[str]:
+    """Returns the telemetry file of a session (the global file when session_id is None)"""
+    if not session_id:
+        return LLM_TELEMETRY_CONFIG["global_path"]
+
+    session_dir = os.path.join(LLM_TELEMETRY_CONFIG["sessions_dir"], session_id)
+    if not os.path.isdir(session_dir):
+        return None
+    return os.path.join(session_dir, LLM_TELEMETRY_CONFIG["file_name"])
+
+
+def estimate_cost(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> Optional[float]:
+    """Estimated cost in USD of a call (None when the model has no price or the usage is unknown)"""
+    pricing = LLM_PRICING.get(model)
+    if not pricing or (prompt_tokens is None and completion_tokens is None):
+        return None
+    return ((prompt_tokens or 0) * pricing["input"] + (completion_tokens or 0) * pricing["output"]) / 1_000_000
+
+
+def record_call(session_id: Optional[str], record: Dict):
+    """
+    Appends a call record to the telemetry file of the session
+
+    Telemetry never interrupts a chat: write errors are only logged.
+    """
+    if not LLM_TELEMETRY_CONFIG["enabled"]:
+        return
+
+    path = telemetry_path(session_id)
+    if not path:
+        return
+
+    record = {"timestamp": datetime.now().isoformat(), "session_id": session_id, **record}
+    line = json.dumps(record, ensure_ascii=False, default=str)
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with _write_lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+    except Exception as e:
+        print(f"Error writing telemetry to {path}: {e}")
+
+
+def load_records(session_id: Optional[str]) -> List[Dict]:
+    """Returns the call records of a session (malformed lines are skipped)"""
+    path = telemetry_path(session_id)
+    if not path or not os.path.exists(path):
+        return []
+
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Percentile (0-100) with linear interpolation, None for an empty list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * p / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    if lower == upper:
+        return ordered[lower]
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize_by_agent(records: List[Dict]) -> List[Dict]:
+    """
+    Aggregates the call records per agent
+
+    Returns:
+        One dict per agent (sorted by total latency, slowest first) with calls,
+        errors, cache_hits, retries, prompt/completion tokens, p50/p95
+        latency, p50 time to first token and estimated cost
+    """
+    groups: Dict[str, List[Dict]] = {}
+    for record in records:
+        groups.setdefault(record.get("agent") or "unknown", []).append(record)
+
+    summary = []
+    for agent, items in groups.items():
+        latencies = [r["latency_ms"] for r in items if isinstance(r.get("latency_ms"), (int, float))]
+        ttfts = [r["ttft_ms"] for r in items if isinstance(r.get("ttft_ms"), (int, float))]
+        costs = [r["cost_usd"] for r in items if isinstance(r.get("cost_usd"), (int, float))]
+
+        summary.append({
+            "agent": agent,
+            "calls": len(items),
+            "errors": sum(1 for r in items if r.get("status") == "error"),
+            "cache_hits": sum(1 for r in items if r.get("cache_hit")),
+            "retries": sum(r.get("retries") or 0 for r in items),
+            "prompt_tokens": sum(r.get("prompt_tokens") or 0 for r in items),
+            "completion_tokens": sum(r.get("completion_tokens") or 0 for r in items),
+            "p50_latency_ms": percentile(latencies, 50),
+            "p95_latency_ms": percentile(latencies, 95),
+            "p50_ttft_ms": percentile(ttfts, 50),
+            "total_latency_ms": sum(latencies),
+            "cost_usd": sum(costs) if costs else None
+        })
+
+    summary.sort(key=lambda item: item["total_latency_ms"], reverse=True)
+    return summary
@@ -0,0 +1,130 @@
+"""
+MetadataCache - In-process cache of the JSON metadata files
+
+This module handles:
+- Parsed JSON files (session, context and BDI framework metadata) cached
+  by path and validated on every access against the file (mtime, size),
+  so a change made by another process is picked up at the next read
+- Explicit invalidation: the shared atomic writes of utils/atomic_json.py
+  drop the entry of the written file, so the writing process never sees
+  stale data even within the mtime resolution
+- Values derived from a file (e.g. the summary of a BDI framework),
+  cached under a namespace with the same validation
+- Hit, miss and invalidation counters
+
+Cached values are returned as copies: callers may modify them freely.
+"""
+
+import os
+import copy
+import json
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+# Numero massimo di file in cache (oltre si eliminano le voci più vecchie)
+MAX_CACHE_ENTRIES = 4096
+
+
+def _parse_json(path: str) -> Any:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class MetadataCache:
+    """
+    Cache of file-derived values keyed by (namespace, path)
+
+    An entry is valid while the file keeps the (mtime, size) it had when
+    it was loaded; the inode is checked too, since atomic writes replace
+    the file.
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: Dict[Tuple[str, str], Tuple[Tuple[int, int, int], Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _signature(path: str) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def load(self, path: str, loader: Callable[[str], Any], namespace: str = "json") -> Any:
+        """
+        Returns loader(path), reusing the cached value while the file is unchanged
+
+        Args:
+            path: File the value is derived from
+            loader: Function reading the file (its exceptions are propagated, nothing is cached)
+            namespace: Kind of value, so different loaders of the same file do not collide
+
+        Returns:
+            A copy of the value, None when the file does not exist
+        """
+        key = (namespace, os.path.abspath(path))
+        signature = self._signature(path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if signature is None:
+                self._entries.pop(key, None)
+                return None
+            if entry is not None and entry[0] == signature:
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+
+        value = loader(path)
+
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                # Eliminazione FIFO: le voci sono in ordine di inserimento
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (signature, value)
+        return copy.deepcopy(value)
+
+    def read_json(self, path: str, default: Any = None) -> Any:
+        """Parsed JSON file (default when it does not exist); JSON errors are propagated"""
+        value = self.load(path, _parse_json)
+        return default if value is None else value
+
+    def invalidate(self, path: str):
+        """Drops the cached values of a file (all namespaces)"""
+        absolute_path = os.path.abspath(path)
+        with self._lock:
+            keys = [key for key in self._entries if key[1] == absolute_path]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+    def clear(self):
+        """Drops every cached value"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/invalidation counters and number of cached entries"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
+_metadata_cache = MetadataCache()
+
+
+def get_metadata_cache() -> MetadataCache:
+    """Returns the process-wide metadata cache"""
+    return _metadata_cache
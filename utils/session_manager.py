@@ -1,17 +1,37 @@
-import os
-import json
 import uuid
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Any, Tuple
 from pathlib import Path
 
+from utils.atomic_json import read_json, write_json_atomic
+from utils.bdi_event_store import BDI_DOCUMENT, BdiEventStore
+from utils.chat_log import DEFAULT_PAGE_SIZE, LEGACY_CHAT_DOCUMENTS, ChatLogStore
+from utils.session_store import SessionStore, create_session_store
+
+
+# last_accessed viene riscritto al più una volta per intervallo, non a ogni lettura
+LAST_ACCESSED_UPDATE_SECONDS = 60
+
 
 class SessionManager:
-    """Manages user sessions for LUMIA Studio"""
+    """Manages user sessions for LUMIA Studio
 
-    def __init__(self, base_dir: str = "./data/sessions"):
+    Sessions are persisted through a SessionStore: JSON directories by
+    default, SQLite with LUMIA_SESSION_STORE=sqlite (see utils/session_store.py).
+    Every session keeps its directory under base_dir for side files.
+    BDI data are event-sourced (see utils/bdi_event_store.py): saves append
+    the changed items to a log and reads return its materialized view.
+    Conversations are kept in per-agent segmented logs (see utils/chat_log.py).
+    """
+
+    def __init__(self, base_dir: str = "./data/sessions", store: Optional[SessionStore] = None):
         self.base_dir = Path(base_dir)
         self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.store = store or create_session_store(self.base_dir)
+        self.bdi_events = BdiEventStore(self.base_dir, self.store)
+        self.chat_logs = ChatLogStore(self.base_dir)
+        # Sessioni di cui è già stata controllata la cronologia legacy (in questo processo)
+        self._legacy_chat_checked = set()
 
     def create_session(
         self,
@@ -68,44 +88,40 @@ class SessionManager:
             }
         }
 
-        # Salva i file
-        self._save_json(session_dir / "metadata.json", metadata)
-        self._save_json(session_dir / "config.json", config)
-
-        # Inizializza file vuoti
-        self._save_json(session_dir / "belief_base.json", {"beliefs": []})
-        self._save_json(session_dir / "current_bdi.json", {
-            "domain_summary": "",
-            "beneficiario": {},
-            "desires": [],
-            "beliefs": [],
-            "intentions": []
+        # Salva la sessione con i documenti inizializzati vuoti
+        self.store.create(session_id, metadata, config, {
+            "belief_base.json": {"beliefs": []},
+            "current_bdi.json": {
+                "domain_summary": "",
+                "beneficiario": {},
+                "desires": [],
+                "beliefs": [],
+                "intentions": []
+            }
         })
 
         return session_id
 
     def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Retrieves complete session data"""
-        session_dir = self.base_dir / session_id
-
-        if not session_dir.exists():
-            return None
-
-        metadata = self._load_json(session_dir / "metadata.json")
-        config = self._load_json(session_dir / "config.json")
+        metadata = self.store.get_metadata(session_id)
+        config = self.store.get_config(session_id)
 
         if metadata is None or config is None:
             return None
 
-        # Aggiorna last_accessed
-        metadata["last_accessed"] = datetime.now().isoformat()
-        self._save_json(session_dir / "metadata.json", metadata)
+        # Aggiorna last_accessed (al più una volta per LAST_ACCESSED_UPDATE_SECONDS)
+        now = datetime.now()
+        threshold = (now - timedelta(seconds=LAST_ACCESSED_UPDATE_SECONDS)).isoformat()
+        if metadata.get("last_accessed", "") < threshold:
+            metadata["last_accessed"] = now.isoformat()
+            self.store.save_metadata(session_id, metadata)
 
         return {
             "session_id": session_id,
             "metadata": metadata,
             "config": config,
-            "session_dir": str(session_dir)
+            "session_dir": str(self.base_dir / session_id)
         }
 
     def get_all_sessions(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
@@ -118,48 +134,85 @@ class SessionManager:
         Returns:
             List of sessions sorted by date (most recent first)
         """
-        sessions = []
-
-        for session_dir in self.base_dir.iterdir():
-            if session_dir.is_dir():
-                metadata = self._load_json(session_dir / "metadata.json")
-                config = self._load_json(session_dir / "config.json")
-
-                if metadata and config:
-                    if status is None or metadata.get("status") == status:
-                        sessions.append({
-                            "session_id": session_dir.name,
-                            "metadata": metadata,
-                            "config": config,
-                            "session_dir": str(session_dir)
-                        })
-
-        # Ordina per data di ultimo accesso (più recenti prima)
-        sessions.sort(
-            key=lambda x: x["metadata"].get("last_accessed", ""),
-            reverse=True
-        )
+        return self.list_sessions(status=status)
+
+    def list_sessions(
+        self,
+        status: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        accessed_since: Optional[datetime] = None,
+        limit: Optional[int] = None,
+        offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieves a page of sessions, most recently accessed first
 
+        Args:
+            status: Filter by status (active, archived, draft). None for all.
+            tags: Only sessions having all these tags
+            accessed_since: Only sessions accessed after this time
+            limit: Maximum number of sessions (None for all)
+            offset: Number of sessions to skip
+
+        Returns:
+            List of sessions (session_id, metadata, config, session_dir)
+        """
+        sessions = self.store.list_sessions(
+            status=status,
+            tags=tags,
+            accessed_since=accessed_since.isoformat() if accessed_since else None,
+            limit=limit,
+            offset=offset
+        )
+        for session in sessions:
+            session["session_dir"] = str(self.base_dir / session["session_id"])
         return sessions
 
+    def count_sessions(
+        self,
+        status: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        accessed_since: Optional[datetime] = None
+    ) -> int:
+        """Counts the sessions matching the list_sessions filters"""
+        return self.store.count_sessions(
+            status=status,
+            tags=tags,
+            accessed_since=accessed_since.isoformat() if accessed_since else None
+        )
+
+    def export_session(self, session_id: str, target_dir: str = "./data/exports") -> Optional[Path]:
+        """
+        Exports a session in the JSON directory layout (metadata.json, config.json, documents)
+
+        The conversations of all the agents are exported to chat_log.jsonl.
+
+        Returns:
+            The exported session directory, None if the session does not exist
+        """
+        export_dir = self.store.export_session(session_id, Path(target_dir))
+        bdi_data = self.get_bdi_data(session_id)
+        if export_dir is not None and bdi_data is not None:
+            # Lo store contiene l'ultimo snapshot: si esporta la vista materializzata corrente
+            write_json_atomic(str(export_dir / BDI_DOCUMENT), bdi_data)
+        if export_dir is not None and self.list_chat_agents(session_id):
+            self.chat_logs.export(session_id, export_dir / "chat_log.jsonl")
+        return export_dir
+
     def update_session_metadata(
         self,
         session_id: str,
         name: Optional[str] = None,
         description: Optional[str] = None,
         tags: Optional[List[str]] = None,
-        status: Optional[str] = None,
-        chat_history_believer: Optional[List[Dict[str, Any]]] = None
+        status: Optional[str] = None
     ) -> bool:
         """Updates session metadata"""
-        session_dir = self.base_dir / session_id
-        metadata_file = session_dir / "metadata.json"
+        metadata = self.store.get_metadata(session_id)
 
-        if not metadata_file.exists():
+        if metadata is None:
             return False
 
-        metadata = self._load_json(metadata_file)
-
         if name is not None:
             metadata["name"] = name
         if description is not None:
@@ -171,13 +224,7 @@ class SessionManager:
 
         metadata["last_accessed"] = datetime.now().isoformat()
 
-        self._save_json(metadata_file, metadata)
-
-        # Salva la chat history di Believer in un file separato se fornita
-        if chat_history_believer is not None:
-            chat_file = session_dir / "chat_history_believer.json"
-            self._save_json(chat_file, {"messages": chat_history_believer})
-
+        self.store.save_metadata(session_id, metadata)
         return True
 
     def update_session_config(
@@ -189,14 +236,11 @@ class SessionManager:
         llm_settings: Optional[Dict[str, Any]] = None
     ) -> bool:
         """Updates session configuration"""
-        session_dir = self.base_dir / session_id
-        config_file = session_dir / "config.json"
+        config = self.store.get_config(session_id)
 
-        if not config_file.exists():
+        if config is None:
             return False
 
-        config = self._load_json(config_file)
-
         if context is not None:
             config["context"] = context
         if llm_provider is not None:
@@ -206,25 +250,16 @@ class SessionManager:
         if llm_settings is not None:
             config["llm_settings"] = llm_settings
 
-        self._save_json(config_file, config)
+        self.store.save_config(session_id, config)
         return True
 
     def get_belief_base(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Retrieves the belief base of a session"""
-        session_dir = self.base_dir / session_id
-        belief_file = session_dir / "belief_base.json"
-
-        if not belief_file.exists():
-            return None
-
-        return self._load_json(belief_file)
+        return self.store.get_document(session_id, "belief_base.json")
 
     def update_belief_base(self, session_id: str, beliefs: List[Dict[str, Any]]) -> bool:
         """Updates the belief base of a session"""
-        session_dir = self.base_dir / session_id
-        belief_file = session_dir / "belief_base.json"
-
-        self._save_json(belief_file, {"beliefs": beliefs})
+        self.store.save_document(session_id, "belief_base.json", {"beliefs": beliefs})
         return True
 
     def delete_session(self, session_id: str) -> bool:
@@ -233,13 +268,71 @@ class SessionManager:
 
     def get_bdi_data(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Retrieves the BDI data (Beliefs, Desires, Intentions) of a session"""
-        session_dir = self.base_dir / session_id
-        bdi_file = session_dir / "current_bdi.json"
+        return self.bdi_events.materialize(session_id)
 
-        if not bdi_file.exists():
-            return None
+    def get_bdi_data_versioned(self, session_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Retrieves the BDI data of a session together with its revision
+
+        The revision is passed back as expected_revision to update_bdi_data
+        by editors that save after the user has edited the loaded data.
+        """
+        return self.bdi_events.materialize_versioned(session_id)
+
+    def get_bdi_history(
+        self,
+        session_id: str,
+        limit: Optional[int] = 50,
+        collection: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieves the BDI mutation events of a session, most recent first
+
+        Args:
+            session_id: Session ID
+            limit: Maximum number of events (None for all)
+            collection: Only events of this collection or field (e.g. "beliefs")
+        """
+        return self.bdi_events.history(session_id, limit=limit, collection=collection)
+
+    def get_bdi_data_at(
+        self,
+        session_id: str,
+        seq: Optional[int] = None,
+        timestamp: Optional[datetime] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Retrieves the BDI data of a session as they were at an earlier point
+
+        Args:
+            session_id: Session ID
+            seq: Sequence number of the last event to include (see get_bdi_history)
+            timestamp: Point in time to restore
+
+        Returns:
+            The BDI data, None if the history does not go back that far
+        """
+        return self.bdi_events.state_at(
+            session_id,
+            seq=seq,
+            timestamp=timestamp.isoformat() if timestamp else None
+        )
+
+    def compact_bdi_data(self, session_id: str) -> bool:
+        """Compacts the BDI event log into a snapshot (also refreshing current_bdi.json)"""
+        return self.bdi_events.compact(session_id)
 
-        return self._load_json(bdi_file)
+    @staticmethod
+    def _normalize_bdi(current_bdi: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Normalizes BDI data to the single-beneficiary schema"""
+        current_bdi = current_bdi or {}
+        return {
+            "domain_summary": current_bdi.get("domain_summary", ""),
+            "beneficiario": current_bdi.get("beneficiario") or current_bdi.get("persona", {}),
+            "desires": current_bdi.get("desires", []),
+            "beliefs": current_bdi.get("beliefs", []),
+            "intentions": current_bdi.get("intentions", [])
+        }
 
     def update_bdi_data(
         self,
@@ -248,42 +341,159 @@ class SessionManager:
         beliefs: List[Dict[str, Any]] = None,
         intentions: List[Dict[str, Any]] = None,
         beneficiario: Dict[str, Any] = None,
-        domain_summary: Optional[str] = None
+        domain_summary: Optional[str] = None,
+        expected_revision: Optional[str] = None
     ) -> bool:
         """
         Updates the BDI data of a session by normalizing them to the single-beneficiary model.
 
         Any legacy structure (e.g., domains/beneficiaries) is discarded in favor of the
         new schema: domain_summary, beneficiario, desires, beliefs, intentions.
-        """
-        session_dir = self.base_dir / session_id
-        bdi_file = session_dir / "current_bdi.json"
+        Only the provided fields change, and only the items that differ from
+        the stored data are appended to the BDI event log; the write runs under
+        the log lock, so concurrent updates of different fields are not lost.
 
-        # Carica dati esistenti o inizializza
-        current_bdi = self.get_bdi_data(session_id) or {}
-        normalized_bdi = {
-            "domain_summary": current_bdi.get("domain_summary", ""),
-            "beneficiario": current_bdi.get("beneficiario") or current_bdi.get("persona", {}),
-            "desires": current_bdi.get("desires", []),
-            "beliefs": current_bdi.get("beliefs", []),
-            "intentions": current_bdi.get("intentions", [])
+        Raises:
+            RevisionConflictError: expected_revision is given and the stored
+                data changed since it was read
+        """
+        updates = {
+            "desires": desires,
+            "beliefs": beliefs,
+            "intentions": intentions,
+            "beneficiario": beneficiario,
+            "domain_summary": domain_summary
         }
+        return self.merge_bdi_data(
+            session_id,
+            lambda current: {key: value for key, value in updates.items() if value is not None},
+            expected_revision=expected_revision
+        )
 
-        # Aggiorna solo i campi forniti
-        if desires is not None:
-            normalized_bdi["desires"] = desires
-        if beliefs is not None:
-            normalized_bdi["beliefs"] = beliefs
-        if intentions is not None:
-            normalized_bdi["intentions"] = intentions
-        if beneficiario is not None:
-            normalized_bdi["beneficiario"] = beneficiario
-        if domain_summary is not None:
-            normalized_bdi["domain_summary"] = domain_summary
-
-        self._save_json(bdi_file, normalized_bdi)
+    def merge_bdi_data(
+        self,
+        session_id: str,
+        merge: Callable[[Dict[str, Any]], Dict[str, Any]],
+        expected_revision: Optional[str] = None
+    ) -> bool:
+        """
+        Updates BDI fields computed from the stored data, under the event log lock
+
+        Args:
+            session_id: Session ID
+            merge: Receives the current normalized BDI data and returns the
+                fields to update (e.g. existing desires plus new ones)
+            expected_revision: Optional revision read by the caller
+
+        Raises:
+            RevisionConflictError: the stored data changed since expected_revision
+        """
+        def apply(current_bdi: Dict[str, Any]) -> Dict[str, Any]:
+            normalized_bdi = self._normalize_bdi(current_bdi)
+            normalized_bdi.update(merge(normalized_bdi) or {})
+            return normalized_bdi
+
+        self.bdi_events.commit(session_id, apply, expected_revision)
         return True
 
+    def _migrate_legacy_chat(self, session_id: str):
+        """
+        Imports once the chat histories saved as session documents by earlier versions
+
+        Conversations are file-based logs for every store backend: a legacy
+        history (JSON file, or the copy migrated into SQLite) is appended to
+        the log of its agent only while that log is still empty.
+        """
+        if session_id in self._legacy_chat_checked:
+            return
+        self._legacy_chat_checked.add(session_id)
+
+        for agent, document in LEGACY_CHAT_DOCUMENTS.items():
+            legacy = self.store.get_document(session_id, document) or read_json(str(self.base_dir / session_id / document))
+            messages = (legacy or {}).get("messages") or []
+            if messages:
+                self.chat_logs.get(session_id, agent).append(messages, if_empty=True)
+
+    def append_chat_messages(self, session_id: str, agent: str, messages: List[Dict[str, Any]]) -> int:
+        """
+        Appends messages to the conversation log of an agent
+
+        Returns:
+            Total number of messages in the log
+        """
+        self._migrate_legacy_chat(session_id)
+        return self.chat_logs.get(session_id, agent).append(messages)
+
+    def sync_chat_log(self, session_id: str, agent: str, history: List[Dict[str, Any]], logged: int) -> int:
+        """
+        Appends the messages of a chat history not yet logged
+
+        Args:
+            session_id: Session ID
+            agent: Agent name (e.g. "ali", "believer", "cuma")
+            history: Chat history of the page
+            logged: Number of history messages already in the log
+
+        Returns:
+            The new number of logged messages (len(history))
+        """
+        if len(history) > logged:
+            self.append_chat_messages(session_id, agent, history[logged:])
+        return len(history)
+
+    def get_chat_page(
+        self,
+        session_id: str,
+        agent: str,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        before_seq: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieves a page of an agent conversation (the last one by default)
+
+        Args:
+            session_id: Session ID
+            agent: Agent name
+            page_size: Maximum number of messages
+            before_seq: Only messages before this sequence number (previous pages)
+
+        Returns:
+            Messages (seq, ts, role, content) in chronological order
+        """
+        self._migrate_legacy_chat(session_id)
+        return self.chat_logs.get(session_id, agent).read_page(page_size, before_seq)
+
+    def count_chat_messages(self, session_id: str, agent: str) -> int:
+        """Number of logged messages of an agent in a session"""
+        self._migrate_legacy_chat(session_id)
+        return self.chat_logs.get(session_id, agent).count()
+
+    def list_chat_agents(self, session_id: str) -> List[str]:
+        """Agents with a conversation log in the session"""
+        self._migrate_legacy_chat(session_id)
+        return self.chat_logs.agents(session_id)
+
+    def iter_chat_log(self, session_id: str, agent: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Streams the conversation log of an agent, or of all the agents merged by time"""
+        self._migrate_legacy_chat(session_id)
+        return self.chat_logs.iter_session(session_id, agent)
+
+    def export_chat_log(
+        self,
+        session_id: str,
+        agent: Optional[str] = None,
+        target_dir: str = "./data/exports"
+    ) -> Path:
+        """
+        Exports a conversation log to JSONL (all the agents when agent is None)
+
+        Returns:
+            The exported file, <target_dir>/<session_id>/chat_log[_<agent>].jsonl
+        """
+        file_name = f"chat_log_{agent}.jsonl" if agent else "chat_log.jsonl"
+        self._migrate_legacy_chat(session_id)
+        return self.chat_logs.export(session_id, Path(target_dir) / session_id / file_name, agent)
+
     def get_session_path(self, session_id: str, file_name: str) -> Optional[Path]:
         """Returns the complete path of a file in the session"""
         session_dir = self.base_dir / session_id
@@ -292,20 +502,3 @@ class SessionManager:
             return None
 
         return session_dir / file_name
-
-    def _save_json(self, file_path: Path, data: Dict[str, Any]):
-        """Saves data in JSON format"""
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-
-    def _load_json(self, file_path: Path) -> Optional[Dict[str, Any]]:
-        """Loads data from JSON file"""
-        if not file_path.exists():
-            return None
-
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading {file_path}: {e}")
-            return None
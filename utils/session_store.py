@@ -0,0 +1,435 @@
+"""
+Session stores - Storage backends of SessionManager
+
+This module handles:
+- JsonSessionStore: one directory per session with metadata.json,
+  config.json and one JSON file per document (default backend, and the
+  export format of every backend)
+- SqliteSessionStore: a single SQLite database in WAL mode with indexed
+  status, recency and tags, so listings are paginated queries instead of
+  a walk over every session directory
+- The one-shot migration of the existing session directories into SQLite
+
+Documents (BDI data, belief base) are named after their
+JSON file, e.g. "current_bdi.json". The JSON backend reads its files
+through the shared metadata cache, so unchanged files are not re-parsed
+on every Streamlit rerun. Other files of a session (BDI event log,
+chat logs, telemetry, history summaries, checkpoints) always live in the
+session directory; current_bdi.json is only the snapshot of the last BDI
+compaction.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.atomic_json import write_json_atomic
+from utils.metadata_cache import get_metadata_cache
+
+
+SESSION_STORE_ENV_VAR = "LUMIA_SESSION_STORE"
+DEFAULT_SESSION_STORE = "json"
+DEFAULT_SQLITE_PATH = "./data/sessions.sqlite3"
+
+METADATA_FILE = "metadata.json"
+CONFIG_FILE = "config.json"
+# Documenti gestiti dallo store (gli altri file della sessione restano nella sua directory).
+# Le conversazioni sono log su file per ogni backend (utils/chat_log.py)
+SESSION_DOCUMENTS = ("belief_base.json", "current_bdi.json")
+
+
+def _matches(metadata: Dict[str, Any], status: Optional[str], tags: Optional[List[str]],
+             accessed_since: Optional[str]) -> bool:
+    if status is not None and metadata.get("status") != status:
+        return False
+    if tags and not set(tags).issubset(metadata.get("tags") or []):
+        return False
+    if accessed_since and metadata.get("last_accessed", "") < accessed_since:
+        return False
+    return True
+
+
+class SessionStore(ABC):
+    """
+    Storage backend interface of SessionManager
+
+    list_sessions filters by status, tags (all must match) and recency
+    (ISO timestamp of the oldest last_accessed), most recently accessed first.
+    Backends must implement every abstract method to be instantiated.
+    """
+
+    @abstractmethod
+    def create(self, session_id: str, metadata: Dict[str, Any], config: Dict[str, Any],
+               documents: Dict[str, Dict[str, Any]]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def exists(self, session_id: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_metadata(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_config(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_metadata(self, session_id: str, metadata: Dict[str, Any]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_config(self, session_id: str, config: Dict[str, Any]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_document(self, session_id: str, name: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_document(self, session_id: str, name: str, data: Dict[str, Any]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_sessions(self, status: Optional[str] = None, tags: Optional[List[str]] = None,
+                      accessed_since: Optional[str] = None, limit: Optional[int] = None,
+                      offset: int = 0) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_sessions(self, status: Optional[str] = None, tags: Optional[List[str]] = None,
+                       accessed_since: Optional[str] = None) -> int:
+        raise NotImplementedError
+
+    def export_session(self, session_id: str, target_dir: Path) -> Optional[Path]:
+        """Writes the session in the JSON directory layout and returns its directory"""
+        metadata = self.get_metadata(session_id)
+        config = self.get_config(session_id)
+        if metadata is None or config is None:
+            return None
+
+        export_dir = Path(target_dir) / session_id
+        export_dir.mkdir(parents=True, exist_ok=True)
+        _write_json(export_dir / METADATA_FILE, metadata)
+        _write_json(export_dir / CONFIG_FILE, config)
+        for name in SESSION_DOCUMENTS:
+            data = self.get_document(session_id, name)
+            if data is not None:
+                _write_json(export_dir / name, data)
+        return export_dir
+
+
+def _write_json(file_path: Path, data: Dict[str, Any]):
+    write_json_atomic(str(file_path), data)
+
+
+def _read_json(file_path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        # Riletto da disco solo se il file è cambiato (mtime, dimensione)
+        return get_metadata_cache().read_json(str(file_path))
+    except Exception as e:
+        print(f"Error loading {file_path}: {e}")
+        return None
+
+
+class JsonSessionStore(SessionStore):
+    """Sessions as directories of JSON files under base_dir (the original layout)"""
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = Path(base_dir)
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+
+    def create(self, session_id, metadata, config, documents):
+        session_dir = self.base_dir / session_id
+        session_dir.mkdir(parents=True, exist_ok=True)
+        self._save_json(session_dir / METADATA_FILE, metadata)
+        self._save_json(session_dir / CONFIG_FILE, config)
+        for name, data in documents.items():
+            self._save_json(session_dir / name, data)
+
+    def exists(self, session_id):
+        return (self.base_dir / session_id / METADATA_FILE).exists()
+
+    def get_metadata(self, session_id):
+        return self._load_json(self.base_dir / session_id / METADATA_FILE)
+
+    def get_config(self, session_id):
+        return self._load_json(self.base_dir / session_id / CONFIG_FILE)
+
+    def save_metadata(self, session_id, metadata):
+        self._save_json(self.base_dir / session_id / METADATA_FILE, metadata)
+
+    def save_config(self, session_id, config):
+        self._save_json(self.base_dir / session_id / CONFIG_FILE, config)
+
+    def get_document(self, session_id, name):
+        return self._load_json(self.base_dir / session_id / name)
+
+    def save_document(self, session_id, name, data):
+        self._save_json(self.base_dir / session_id / name, data)
+
+    def _iter_sessions(self, status, tags, accessed_since) -> List[Dict[str, Any]]:
+        sessions = []
+        for session_dir in self.base_dir.iterdir():
+            if not session_dir.is_dir():
+                continue
+            metadata = self._load_json(session_dir / METADATA_FILE)
+            if not metadata or not _matches(metadata, status, tags, accessed_since):
+                continue
+            config = self._load_json(session_dir / CONFIG_FILE)
+            if config:
+                sessions.append({"session_id": session_dir.name, "metadata": metadata, "config": config})
+        return sessions
+
+    def list_sessions(self, status=None, tags=None, accessed_since=None, limit=None, offset=0):
+        sessions = self._iter_sessions(status, tags, accessed_since)
+        sessions.sort(key=lambda x: x["metadata"].get("last_accessed", ""), reverse=True)
+        return sessions[offset:offset + limit] if limit is not None else sessions[offset:]
+
+    def count_sessions(self, status=None, tags=None, accessed_since=None):
+        return len(self._iter_sessions(status, tags, accessed_since))
+
+    def _save_json(self, file_path: Path, data: Dict[str, Any]):
+        """Saves data in JSON format"""
+        _write_json(file_path, data)
+
+    def _load_json(self, file_path: Path) -> Optional[Dict[str, Any]]:
+        """Loads data from JSON file"""
+        return _read_json(file_path)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Sessions in a single SQLite database (WAL mode)
+
+    Metadata and config are stored as JSON together with indexed columns
+    (status, last_accessed) and a tag table; documents are one row per
+    (session, name). base_dir still holds one directory per session for
+    the files managed outside the store.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_SQLITE_PATH, base_dir: Path = Path("./data/sessions")):
+        self.db_path = db_path
+        self.base_dir = Path(base_dir)
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    status TEXT,
+                    created_at TEXT,
+                    last_accessed TEXT,
+                    metadata TEXT NOT NULL,
+                    config TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_sessions_last_accessed ON sessions (last_accessed);
+                CREATE INDEX IF NOT EXISTS idx_sessions_status ON sessions (status, last_accessed);
+                CREATE TABLE IF NOT EXISTS session_tags (
+                    session_id TEXT NOT NULL,
+                    tag TEXT NOT NULL,
+                    PRIMARY KEY (session_id, tag)
+                );
+                CREATE INDEX IF NOT EXISTS idx_session_tags_tag ON session_tags (tag);
+                CREATE TABLE IF NOT EXISTS documents (
+                    session_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (session_id, name)
+                );
+                CREATE TABLE IF NOT EXISTS store_info (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # Una connessione per operazione: Streamlit esegue gli script su thread diversi
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _write_session(conn: sqlite3.Connection, session_id: str, metadata: Dict[str, Any],
+                       config: Optional[Dict[str, Any]] = None):
+        """Inserts or updates the session row (config unchanged when None) and its tags"""
+        values = (
+            metadata.get("status"), metadata.get("created_at"), metadata.get("last_accessed"),
+            json.dumps(metadata, ensure_ascii=False)
+        )
+        if config is None:
+            conn.execute(
+                "UPDATE sessions SET status = ?, created_at = ?, last_accessed = ?, metadata = ? WHERE session_id = ?",
+                values + (session_id,)
+            )
+        else:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO sessions (status, created_at, last_accessed, metadata, config, session_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                values + (json.dumps(config, ensure_ascii=False), session_id)
+            )
+        conn.execute("DELETE FROM session_tags WHERE session_id = ?", (session_id,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO session_tags (session_id, tag) VALUES (?, ?)",
+            [(session_id, tag) for tag in metadata.get("tags") or []]
+        )
+
+    @staticmethod
+    def _write_document(conn: sqlite3.Connection, session_id: str, name: str, data: Dict[str, Any]):
+        conn.execute(
+            "INSERT OR REPLACE INTO documents (session_id, name, data, updated_at) VALUES (?, ?, ?, ?)",
+            (session_id, name, json.dumps(data, ensure_ascii=False), datetime.now().isoformat())
+        )
+
+    def create(self, session_id, metadata, config, documents):
+        (self.base_dir / session_id).mkdir(parents=True, exist_ok=True)
+        with self._lock, self._connect() as conn:
+            self._write_session(conn, session_id, metadata, config)
+            for name, data in documents.items():
+                self._write_document(conn, session_id, name, data)
+
+    def exists(self, session_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row is not None
+
+    def _get_column(self, session_id: str, column: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {column} FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_metadata(self, session_id):
+        return self._get_column(session_id, "metadata")
+
+    def get_config(self, session_id):
+        return self._get_column(session_id, "config")
+
+    def save_metadata(self, session_id, metadata):
+        with self._lock, self._connect() as conn:
+            self._write_session(conn, session_id, metadata)
+
+    def save_config(self, session_id, config):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE sessions SET config = ? WHERE session_id = ?",
+                (json.dumps(config, ensure_ascii=False), session_id)
+            )
+
+    def get_document(self, session_id, name):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT data FROM documents WHERE session_id = ? AND name = ?", (session_id, name)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_document(self, session_id, name, data):
+        with self._lock, self._connect() as conn:
+            self._write_document(conn, session_id, name, data)
+
+    @staticmethod
+    def _where(status, tags, accessed_since) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if accessed_since:
+            clauses.append("last_accessed >= ?")
+            params.append(accessed_since)
+        if tags:
+            unique_tags = sorted(set(tags))
+            placeholders = ",".join("?" * len(unique_tags))
+            clauses.append(
+                f"session_id IN (SELECT session_id FROM session_tags WHERE tag IN ({placeholders}) "
+                "GROUP BY session_id HAVING COUNT(*) = ?)"
+            )
+            params.extend(unique_tags + [len(unique_tags)])
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def list_sessions(self, status=None, tags=None, accessed_since=None, limit=None, offset=0):
+        where, params = self._where(status, tags, accessed_since)
+        query = f"SELECT session_id, metadata, config FROM sessions{where} ORDER BY last_accessed DESC LIMIT ? OFFSET ?"
+        with self._connect() as conn:
+            rows = conn.execute(query, params + [-1 if limit is None else limit, offset]).fetchall()
+        return [
+            {"session_id": session_id, "metadata": json.loads(metadata), "config": json.loads(config)}
+            for session_id, metadata, config in rows
+        ]
+
+    def count_sessions(self, status=None, tags=None, accessed_since=None):
+        where, params = self._where(status, tags, accessed_since)
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM sessions{where}", params).fetchone()[0]
+
+    def migrate_from_json(self, json_store: JsonSessionStore) -> int:
+        """
+        One-shot import of the JSON session directories
+
+        Runs only once per database (recorded in store_info); sessions
+        already present are skipped and the JSON files are left in place.
+
+        Returns:
+            Number of imported sessions
+        """
+        with self._connect() as conn:
+            done = conn.execute("SELECT value FROM store_info WHERE key = 'json_migrated_at'").fetchone()
+        if done or not json_store.base_dir.exists():
+            return 0
+
+        imported = 0
+        with self._lock, self._connect() as conn:
+            for session_dir in json_store.base_dir.iterdir():
+                if not session_dir.is_dir():
+                    continue
+                session_id = session_dir.name
+                metadata = json_store.get_metadata(session_id)
+                config = json_store.get_config(session_id)
+                if not metadata or not config:
+                    continue
+                if conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone():
+                    continue
+
+                self._write_session(conn, session_id, metadata, config)
+                for name in SESSION_DOCUMENTS:
+                    data = json_store.get_document(session_id, name)
+                    if data is not None:
+                        self._write_document(conn, session_id, name, data)
+                imported += 1
+
+            conn.execute(
+                "INSERT OR REPLACE INTO store_info (key, value) VALUES ('json_migrated_at', ?)",
+                (datetime.now().isoformat(),)
+            )
+
+        if imported:
+            print(f"Migrated {imported} sessions from {json_store.base_dir} to {self.db_path}")
+        return imported
+
+
+def create_session_store(base_dir: Path, backend: Optional[str] = None) -> SessionStore:
+    """
+    Returns the session store selected by backend or LUMIA_SESSION_STORE ("json" or "sqlite")
+
+    The SQLite database lives next to the sessions directory; the first
+    time it is opened the existing JSON sessions are migrated into it.
+    """
+    backend = (backend or os.environ.get(SESSION_STORE_ENV_VAR) or DEFAULT_SESSION_STORE).lower()
+    if backend == "json":
+        return JsonSessionStore(base_dir)
+    if backend == "sqlite":
+        store = SqliteSessionStore(str(Path(base_dir).parent / "sessions.sqlite3"), base_dir)
+        store.migrate_from_json(JsonSessionStore(base_dir))
+        return store
+    raise ValueError(f"Unsupported session store '{backend}'. Available: json, sqlite")
+
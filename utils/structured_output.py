@@ -0,0 +1,234 @@
+"""
+Structured output - Shared JSON extraction, incremental parsing and repair
+
+This module handles:
+- Extracting the JSON document of an LLM response (plain JSON, ```json
+  fences or JSON embedded in prose), replacing the per-page regexes
+- Parsing a streamed response incrementally, emitting the elements of
+  selected arrays (e.g. "beliefs", "steps") as soon as they are complete
+- Locating the valid prefix of a malformed or truncated document, so that
+  only its tail needs to be repaired
+"""
+
+import re
+import json
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+OPENERS = {"{": "}", "[": "]"}
+CLOSERS = {"}", "]"}
+
+_FENCE_PATTERN = re.compile(r"```(?:json)?\s*\n?(.*?)```", re.DOTALL | re.IGNORECASE)
+
+
+class StructuredOutputError(ValueError):
+    """Raised when an LLM response does not contain a valid JSON document"""
+
+    def __init__(self, message: str, text: str = ""):
+        super().__init__(message)
+        self.text = text
+
+
+def _scan_document(text: str, start: int) -> Tuple[Optional[int], Optional[int], List[str], bool]:
+    """
+    Scans the JSON document starting at text[start] ('{' or '[')
+
+    Returns:
+        (end, cut, stack, truncated): end is the index after the closing
+        bracket of the document (None when it is not closed); cut is the
+        index after the last complete element of a container (the document
+        is valid up to there once the containers in stack are closed);
+        truncated is True when the text ends inside the document.
+    """
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    cut, cut_stack = None, []
+
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in OPENERS:
+            stack.append(OPENERS[char])
+        elif char in CLOSERS:
+            if not stack or stack[-1] != char:
+                return None, cut, cut_stack, False
+            stack.pop()
+            if not stack:
+                return index + 1, cut, cut_stack, False
+            cut, cut_stack = index + 1, list(stack)
+        elif char == ",":
+            # Prima della virgola l'elemento precedente è completo
+            cut, cut_stack = index, list(stack)
+
+    return None, cut, cut_stack, True
+
+
+def _candidates(text: str) -> Iterable[str]:
+    """Yields the substrings that may hold the JSON document, most likely first"""
+    stripped = text.strip()
+    yield stripped
+
+    for match in _FENCE_PATTERN.finditer(text):
+        yield match.group(1).strip()
+
+    for index, char in enumerate(text):
+        if char in OPENERS:
+            end, _, _, truncated = _scan_document(text, index)
+            if end is not None:
+                yield text[index:end]
+            elif truncated:
+                # Documento troncato: gli oggetti successivi ne sono frammenti, non risposte
+                return
+
+
+def extract_json(text: Optional[str], expect: Optional[type] = None) -> Optional[Any]:
+    """
+    Returns the JSON document contained in an LLM response, or None
+
+    Args:
+        text: LLM response (JSON, fenced JSON or prose with embedded JSON)
+        expect: Optional required type of the document (dict or list)
+    """
+    if not text:
+        return None
+
+    for candidate in _candidates(text):
+        if not candidate or candidate[0] not in OPENERS:
+            continue
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if expect is None or isinstance(data, expect):
+            return data
+    return None
+
+
+def split_valid_prefix(text: str) -> Optional[Tuple[str, str, List[str]]]:
+    """
+    Splits a malformed JSON document into its valid prefix and the tail to repair
+
+    Returns:
+        (prefix, tail, open_containers) where prefix + closing brackets of
+        open_containers (innermost last) is valid JSON, or None when the
+        text contains no usable JSON start.
+    """
+    fence = text.find("```")
+    if fence != -1:
+        # Il documento inizia dopo l'apertura del blocco ```json (anche se non è chiuso)
+        newline = text.find("\n", fence)
+        text = text[newline + 1:] if newline != -1 else text[fence + 3:]
+        text = text.split("```", 1)[0]
+
+    starts = [text.find(opener) for opener in OPENERS if text.find(opener) != -1]
+    if not starts:
+        return None
+
+    start = min(starts)
+    end, cut, cut_stack, _ = _scan_document(text, start)
+    if end is not None:
+        return text[start:end], "", []
+    if cut is None:
+        return text[start:start + 1], text[start + 1:], [OPENERS[text[start]]]
+    return text[start:cut], text[cut:], cut_stack
+
+
+def close_valid_prefix(text: str) -> Optional[Any]:
+    """Local repair: keeps the complete elements of a truncated document and closes its containers"""
+    split = split_valid_prefix(text)
+    if not split:
+        return None
+    prefix, _, open_containers = split
+    try:
+        return json.loads(prefix + "".join(reversed(open_containers)))
+    except json.JSONDecodeError:
+        return None
+
+
+class IncrementalJSONParser:
+    """
+    Incremental parser of a streamed JSON response
+
+    feed() receives the text deltas and returns the elements of the arrays
+    named in item_keys (at any depth) completed by that delta, e.g. every
+    belief of {"beliefs": [...]} or every step of
+    {"phases": [{"steps": [...]}]}. Text outside the JSON document
+    (prose, code fences) is ignored.
+    """
+
+    def __init__(self, item_keys: Iterable[str]):
+        self.item_keys = set(item_keys)
+        self.items: List[Tuple[str, Any]] = []
+        self._buffer = ""
+        self._position = 0
+        # Ogni livello: [chiusura attesa, chiave dell'array, inizio dell'elemento corrente]
+        self._stack: List[list] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._pending_key = None
+
+    def feed(self, delta: str) -> List[Tuple[str, Any]]:
+        """Consumes a text delta and returns the newly completed (key, item) pairs"""
+        self._buffer += delta
+        completed = []
+
+        while self._position < len(self._buffer):
+            index = self._position
+            char = self._buffer[index]
+            self._position += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = self._buffer[self._string_start + 1:index]
+                continue
+
+            if not self._stack and char not in OPENERS:
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = index
+            elif char == ":":
+                self._pending_key = self._last_string
+            elif char in OPENERS:
+                parent = self._stack[-1] if self._stack else None
+                if parent is not None and parent[0] == "]" and parent[1] in self.item_keys:
+                    parent[2] = index
+                key = self._pending_key if parent is not None and parent[0] == "}" else None
+                self._stack.append([OPENERS[char], key, None])
+                self._pending_key = None
+            elif char in CLOSERS:
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                parent = self._stack[-1] if self._stack else None
+                if parent is not None and parent[0] == "]" and parent[1] in self.item_keys and parent[2] is not None:
+                    try:
+                        item = json.loads(self._buffer[parent[2]:index + 1])
+                        completed.append((parent[1], item))
+                    except json.JSONDecodeError:
+                        pass
+                    parent[2] = None
+            elif char == ",":
+                self._pending_key = None
+
+        self.items.extend(completed)
+        return completed